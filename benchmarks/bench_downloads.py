@@ -0,0 +1,111 @@
+# Download scheduling against a local file server that throttles every
+# connection (like YouTube does per stream): yt-dlp defaults vs a per-host
+# connection limit with parallel HLS fragments, shortest-job-first ordering
+# and a global bandwidth cap. Tracks have mixed lengths so ordering matters.
+#
+#   python -m benchmarks.bench_downloads [--tracks 40] [--workers 6] [--bandwidth 1000000]
+#       [--per-host 12] [--fragments 4] [--cap 8]
+
+import argparse
+import os
+import random
+import shutil
+import statistics
+import tempfile
+import time
+
+from benchmarks.stub_youtube import AudioServer, Catalog, install
+from parallel_downloader import remaining_download
+from src.bandwidth import DownloadShaping
+from src.pipeline import Pipeline, Stage
+from src.youtube import download_raw_audio, set_download_shaping
+
+BYTES_PER_SECOND = 16_000  # 128 kbps, to turn payload sizes into track lengths
+
+
+def make_jobs(count, seed=0):
+    # Track lengths between 30 seconds and 8 minutes, in random playlist order
+    rng = random.Random(seed)
+    jobs = []
+    for index in range(count):
+        seconds = rng.choice((30, 60, 120, 180, 240, 480)) + rng.randint(0, 20)
+        jobs.append({
+            'id': f'bench{index:04d}', 'bytes': seconds * BYTES_PER_SECOND, 'video': {'duration': seconds},
+            'duration_ms': seconds * 1000, 'safe_name': f'track{index:04d}',
+        })
+    return jobs
+
+
+def run_scenario(name, jobs, options, shaping=None, fragmented=False, shortest_first=False):
+    workdir = tempfile.mkdtemp(prefix='bench_downloads_')
+    source = os.path.join(workdir, 'source.mp3')
+    with open(source, 'wb') as f:
+        f.write(b'\0' * 1024)
+    server = AudioServer(source, options.bandwidth, segments=options.segments).start()
+    catalog = Catalog(server, fragmented=fragmented)
+    rng = random.Random(1)
+    for job in jobs:
+        server.add(job['id'], rng.randbytes(job['bytes']))
+    install(catalog)
+    set_download_shaping(shaping)
+    jobs = [{**job, 'folder': workdir} for job in jobs]
+
+    started = time.perf_counter()
+    finished = {}
+
+    def download(job):
+        path = download_raw_audio(f"https://www.youtube.com/watch?v={job['id']}",
+                                  os.path.join(workdir, job['safe_name'] + '.download'))
+        job['ok'] = bool(path) and os.path.getsize(path) == job['bytes']
+        finished[job['id']] = time.perf_counter() - started
+        return job
+
+    stage = Stage('download', download, options.workers, queue_size=options.workers * 4,
+                  priority=remaining_download if shortest_first else None)
+    results = list(Pipeline([stage]).run(jobs))
+    elapsed = time.perf_counter() - started
+    server.stop()
+    shutil.rmtree(workdir, ignore_errors=True)
+
+    total = sum(job['bytes'] for job in jobs)
+    return {
+        'name': name,
+        'ok': sum(job['ok'] for job in results),
+        'elapsed': elapsed,
+        'mean_completion': statistics.mean(finished.values()),
+        'p50_completion': statistics.median(finished.values()),
+        'throughput': total / elapsed / 1e6,
+        'peak_connections': server.peak_active,
+        'shaping': shaping.stats() if shaping else None,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark download scheduling against a throttled local server.")
+    parser.add_argument('--tracks', type=int, default=40)
+    parser.add_argument('--workers', type=int, default=6, help="files downloading at once")
+    parser.add_argument('--bandwidth', type=int, default=1_000_000, help="server bytes/second per connection")
+    parser.add_argument('--segments', type=int, default=8, help="HLS fragments per file")
+    parser.add_argument('--per-host', type=int, default=12, help="connection limit for the shaped runs")
+    parser.add_argument('--fragments', type=int, default=4, help="parallel fragments per file for the shaped runs")
+    parser.add_argument('--cap', type=float, default=8.0, help="MB/s bandwidth cap for the capped run")
+    args = parser.parse_args()
+
+    jobs = make_jobs(args.tracks)
+    print(f"{args.tracks} tracks, {sum(job['bytes'] for job in jobs) / 1e6:.1f} MB, {args.workers} workers, "
+          f"{args.bandwidth / 1e6:.1f} MB/s per connection")
+    scenarios = [
+        ('yt-dlp defaults, FIFO', {}),
+        ('per-host limit + fragments', dict(shaping=DownloadShaping(per_host=args.per_host, fragments=args.fragments),
+                                            fragmented=True)),
+        ('+ shortest job first', dict(shaping=DownloadShaping(per_host=args.per_host, fragments=args.fragments),
+                                      fragmented=True, shortest_first=True)),
+        (f'+ {args.cap:g} MB/s cap', dict(shaping=DownloadShaping(rate=args.cap * 1e6, per_host=args.per_host,
+                                                                  fragments=args.fragments),
+                                          fragmented=True, shortest_first=True)),
+    ]
+    for name, options in scenarios:
+        result = run_scenario(name, jobs, args, **options)
+        print(f"{result['name']:<28} {result['elapsed']:6.1f}s total, mean done at {result['mean_completion']:5.1f}s "
+              f"(p50 {result['p50_completion']:5.1f}s), {result['throughput']:5.2f} MB/s, "
+              f"peak {result['peak_connections']} connections, {result['ok']}/{len(jobs)} ok")
@@ -0,0 +1,271 @@
+# End-to-end benchmark: download_playlist against a local Spotify stub and a
+# yt-dlp stand-in serving local audio, so throughput changes can be measured
+# offline and compared between runs. Each playlist size runs in a fresh
+# process so peak RSS and file descriptors belong to that run alone.
+#
+#   python -m benchmarks.bench_pipeline [--sizes 50 500 5000] [--bandwidth 4000000]
+#       [--latency 0.02] [--throttle-rate 0.01] [--search-latency 0.05] [--source mp3|m4a]
+#
+# Results are appended to benchmarks/results/bench_pipeline.jsonl and each
+# run is compared with the last one made with the same options.
+
+import argparse
+import contextlib
+import json
+import multiprocessing
+import os
+import queue
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+RESULTS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results', 'bench_pipeline.jsonl')
+DEFAULT_SIZES = (50, 500, 5000)
+SAMPLE_INTERVAL = 0.2
+
+
+def make_audio(path, seconds, source):
+    from src.youtube import get_ffmpeg_path
+    codec = ['-c:a', 'libmp3lame', '-b:a', '128k'] if source == 'mp3' else ['-c:a', 'aac', '-b:a', '128k']
+    subprocess.run(
+        [get_ffmpeg_path(), '-y', '-loglevel', 'error', '-f', 'lavfi', '-i', f'sine=frequency=440:duration={seconds}',
+         *codec, path],
+        check=True,
+    )
+    return path
+
+
+def open_fds():
+    for folder in ('/proc/self/fd', '/dev/fd'):
+        if os.path.isdir(folder):
+            return len(os.listdir(folder))
+    return None
+
+
+class FdSampler:
+    # ru_maxrss already tracks peak memory; open descriptors have to be sampled
+    def __init__(self):
+        self.peak = open_fds()
+        self.stop = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self.stop.wait(SAMPLE_INTERVAL):
+            count = open_fds()
+            if count is not None:
+                self.peak = max(self.peak or 0, count)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop.set()
+        self.thread.join()
+
+
+def peak_rss_mb(who):
+    # Linux reports kilobytes, macOS bytes
+    peak = resource.getrusage(who).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def build_catalog(catalog, tracks, duration):
+    # Same query the downloader sends; each track gets its label upload and a sped-up decoy
+    for track in tracks:
+        artist = track['artists'][0]['name']
+        query = f"{track['name']} {artist} official audio"
+        catalog.add(query, f"decoy{track['id']}", f"{track['name']} (sped up)", duration - 20, 'fan uploads')
+        catalog.add(query, track['id'], f"{track['name']}", duration, f"{artist} - Topic")
+
+
+def run_size(size, options):
+    from benchmarks.stub_spotify import StubSpotifyServer, make_tracks
+    from benchmarks.stub_youtube import AudioServer, Catalog, install
+    from src.auth import authenticate_spotipy
+    from src.events import EventEmitter
+    from src.metrics import percentile
+    from parallel_downloader import download_playlist, default_worker_counts
+
+    workdir = tempfile.mkdtemp(prefix='bench_pipeline_')
+    audio_server = spotify = None
+    try:
+        audio_path = make_audio(os.path.join(workdir, f'source.{options["source"]}'), options['audio_seconds'],
+                                options['source'])
+        audio_server = AudioServer(audio_path, options['bandwidth']).start()
+        catalog = Catalog(audio_server, options['search_latency'])
+        spotify = StubSpotifyServer(latency=options['latency'], throttle_rate=options['throttle_rate'],
+                                    retry_after=options['retry_after']).start()
+        tracks = make_tracks(size, spotify.base_url, options['audio_seconds'] * 1000)
+        spotify.load(tracks)
+        build_catalog(catalog, tracks, options['audio_seconds'])
+        install(catalog)
+
+        os.environ.setdefault('SPOTIPY_CLIENT_ID', 'bench')
+        os.environ.setdefault('SPOTIPY_CLIENT_SECRET', 'bench')
+        os.chdir(workdir)
+
+        finished = []
+
+        def collect(event):
+            if event['event'] in ('track_finished', 'track_failed'):
+                finished.append(event)
+
+        with open(os.path.join(workdir, 'run.log'), 'w', encoding='utf-8') as log, \
+                contextlib.redirect_stdout(log), FdSampler() as fds:
+            sp = authenticate_spotipy(api_prefix=spotify.api_prefix, token_url=spotify.token_url)
+            started = time.perf_counter()
+            download_playlist(sp, spotify.playlist_url, workers=default_worker_counts(options['workers']),
+                              show_progress=False, analyze=options['analysis'], adaptive=not options['fixed_workers'],
+                              events=EventEmitter(collect))
+            elapsed = time.perf_counter() - started
+
+        spans = {}
+        for event in finished:
+            for name, seconds in event['timings'].items():
+                spans.setdefault(name, []).append(seconds)
+        done = sum(event['status'] == 'done' for event in finished)
+        return {
+            'size': size,
+            'elapsed': round(elapsed, 2),
+            'done': done,
+            'failed': sum(event['event'] == 'track_failed' for event in finished),
+            'tracks_per_min': round(done / elapsed * 60, 1),
+            'spans': {
+                name: {'p50': percentile(values, 0.5), 'p99': percentile(values, 0.99)}
+                for name, values in sorted(spans.items())
+            },
+            'peak_rss_mb': peak_rss_mb(resource.RUSAGE_SELF),
+            'peak_child_rss_mb': peak_rss_mb(resource.RUSAGE_CHILDREN),
+            'peak_fds': fds.peak,
+            'spotify_requests': spotify.requests,
+            'spotify_throttled': spotify.throttled,
+            'audio_mb': round(audio_server.bytes_sent / 1e6, 1),
+        }
+    finally:
+        if audio_server:
+            audio_server.stop()
+        if spotify:
+            spotify.stop()
+        os.chdir(os.path.dirname(workdir))
+        if options['keep']:
+            print(f"kept {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+def _run_in_child(size, options, results):
+    results.put(run_size(size, options))
+
+
+def run_isolated(size, options):
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    process = context.Process(target=_run_in_child, args=(size, options, results))
+    process.start()
+    # Poll rather than block on the queue, so a child that crashes (no ffmpeg, an import error) fails the
+    # benchmark instead of hanging it
+    while True:
+        try:
+            result = results.get(timeout=1)
+            break
+        except queue.Empty:
+            if process.exitcode is not None:
+                try:
+                    result = results.get(timeout=1)  # put just before exiting
+                    break
+                except queue.Empty:
+                    raise RuntimeError(f"{size}-track run exited with code {process.exitcode} "
+                                       f"before reporting a result") from None
+    process.join()
+    return result
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def previous_run(path, options):
+    if not os.path.exists(path):
+        return None
+    last = None
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            entry = json.loads(line)
+            if entry['options'] == options:
+                last = entry
+    return last
+
+
+def change(current, previous):
+    if not previous:
+        return ''
+    return f" ({(current - previous) / previous * 100:+.1f}% vs {previous})"
+
+
+def print_result(result, previous=None):
+    print(f"{result['size']:>6} tracks: {result['tracks_per_min']:.1f} tracks/min"
+          f"{change(result['tracks_per_min'], previous and previous['tracks_per_min'])}, "
+          f"{result['done']} done, {result['failed']} failed in {result['elapsed']:.1f}s")
+    print(f"        peak RSS {result['peak_rss_mb']} MB (children {result['peak_child_rss_mb']} MB), "
+          f"peak fds {result['peak_fds']}, Spotify {result['spotify_requests']} requests "
+          f"({result['spotify_throttled']} throttled), {result['audio_mb']} MB served")
+    print("        " + ", ".join(
+        f"{name} p50 {stats['p50']:.3f}s p99 {stats['p99']:.3f}s" for name, stats in result['spans'].items()))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Offline end-to-end throughput benchmark for download_playlist.")
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(DEFAULT_SIZES), help="playlist sizes to run")
+    parser.add_argument('--bandwidth', type=int, default=4_000_000, help="bytes/second per download (0: unthrottled)")
+    parser.add_argument('--latency', type=float, default=0.02, help="seconds added to every Spotify request")
+    parser.add_argument('--throttle-rate', type=float, default=0.01, help="share of Spotify requests answered with 429")
+    parser.add_argument('--retry-after', type=float, default=0.2, help="Retry-After seconds on injected 429s")
+    parser.add_argument('--search-latency', type=float, default=0.05, help="seconds per YouTube search")
+    parser.add_argument('--audio-seconds', type=int, default=10, help="length of the served audio")
+    parser.add_argument('--source', choices=('mp3', 'm4a'), default='mp3',
+                        help="served codec: mp3 is stream-copied, m4a forces an MP3 encode per track")
+    parser.add_argument('-w', '--workers', type=int, help="starting number of parallel downloads")
+    parser.add_argument('--fixed-workers', action='store_true', help="disable adaptive concurrency")
+    parser.add_argument('--analysis', action='store_true', help="include the local BPM/key/loudness stage")
+    parser.add_argument('--results', default=RESULTS_PATH, help="JSON lines file results are appended to")
+    parser.add_argument('--keep', action='store_true', help="keep each run's working directory")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    options = {
+        'bandwidth': args.bandwidth or None,
+        'latency': args.latency,
+        'throttle_rate': args.throttle_rate,
+        'retry_after': args.retry_after,
+        'search_latency': args.search_latency,
+        'audio_seconds': args.audio_seconds,
+        'source': args.source,
+        'workers': args.workers,
+        'fixed_workers': args.fixed_workers,
+        'analysis': args.analysis,
+    }
+    previous = previous_run(args.results, options)
+    previous_results = {result['size']: result for result in (previous or {}).get('results', [])}
+
+    results = []
+    for size in args.sizes:
+        result = run_isolated(size, {**options, 'keep': args.keep})
+        print_result(result, previous_results.get(size))
+        results.append(result)
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.results)), exist_ok=True)
+    with open(args.results, 'a', encoding='utf-8') as f:
+        f.write(json.dumps({'ts': round(time.time()), 'commit': git_commit(), 'options': options,
+                            'results': results}) + '\n')
+    print(f"results appended to {args.results}")
@@ -0,0 +1,76 @@
+# Cold-start cost of the entry points: each module is imported in a fresh
+# interpreter with -X importtime, repeatedly, and the heaviest imports of the
+# median run are listed so regressions can be traced to a dependency.
+#
+#   python -m benchmarks.bench_startup [runs] [--modules parallel_downloader dj_gui] [--top 10]
+
+import argparse
+import statistics
+import subprocess
+import sys
+import time
+
+DEFAULT_MODULES = ('parallel_downloader', 'dj_gui', 'retag_library', 'mp3_tag_viewer')
+
+
+def import_profile(module):
+    # [(name, self_us, cumulative_us, depth)] from one cold import, plus the wall time of the whole process
+    started = time.perf_counter()
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                            capture_output=True, text=True, check=True)
+    wall = time.perf_counter() - started
+    entries = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        # Indentation is nesting depth; children are listed before their parent
+        entries.append((name.strip(), int(self_us), int(cumulative_us), len(name) - len(name.lstrip())))
+    return wall, entries
+
+
+def subtree(entries, module):
+    # The module's own line and everything it pulled in, leaving out interpreter startup (site, encodings)
+    index = next(i for i, entry in enumerate(entries) if entry[0] == module)
+    depth = entries[index][3]
+    start = index
+    while start > 0 and entries[start - 1][3] > depth:
+        start -= 1
+    return entries[start:index + 1]
+
+
+def measure(module, runs):
+    samples = [(wall, subtree(entries, module)) for wall, entries in
+               (import_profile(module) for _ in range(runs))]
+    samples.sort(key=lambda sample: sample[1][-1][2])
+    imports = [entries[-1][2] / 1e6 for _, entries in samples]
+    return {
+        'import': statistics.median(imports),
+        'import_min': min(imports),
+        'process': statistics.median(wall for wall, _ in samples),
+        'entries': samples[len(samples) // 2][1],
+    }
+
+
+def heaviest(entries, top):
+    # Top-level packages by the cumulative time of their outermost import, the module itself excluded
+    packages = {}
+    for name, _, cumulative, _ in entries[:-1]:
+        root = name.split('.')[0]
+        packages[root] = max(packages.get(root, 0), cumulative)
+    return sorted(packages.items(), key=lambda item: -item[1])[:top]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure cold import time of the entry points.")
+    parser.add_argument('runs', nargs='?', type=int, default=7, help="fresh interpreters per module")
+    parser.add_argument('--modules', nargs='+', default=list(DEFAULT_MODULES))
+    parser.add_argument('--top', type=int, default=8, help="heaviest packages to list per module")
+    args = parser.parse_args()
+
+    for module in args.modules:
+        result = measure(module, args.runs)
+        print(f"{module}: import {result['import'] * 1000:.0f} ms median ({result['import_min'] * 1000:.0f} ms best), "
+              f"process {result['process'] * 1000:.0f} ms")
+        for name, cumulative in heaviest(result['entries'], args.top):
+            print(f"    {name:<24} {cumulative / 1000:7.1f} ms")
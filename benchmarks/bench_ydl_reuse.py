@@ -0,0 +1,63 @@
+# Microbenchmark: fresh YoutubeDL per call vs the per-worker instances in src.youtube.
+# Runs offline: each "track" resolves formats for a synthetic video the way a
+# real search/download would, minus the network.
+#
+#   python -m benchmarks.bench_ydl_reuse [tracks]
+
+import sys
+import time
+
+import yt_dlp
+
+from src.youtube import YDL_OPTIONS, get_ydl, set_outtmpl
+
+
+def fake_video(index):
+    return {
+        'id': f'video{index:05d}',
+        'title': f'Artist - Song {index} (Official Audio)',
+        'webpage_url': f'https://www.youtube.com/watch?v=video{index:05d}',
+        'extractor': 'youtube',
+        'extractor_key': 'Youtube',
+        'duration': 210,
+        'formats': [
+            {'format_id': '140', 'url': 'https://example.invalid/140', 'ext': 'm4a', 'acodec': 'mp4a.40.2', 'vcodec': 'none', 'abr': 129},
+            {'format_id': '251', 'url': 'https://example.invalid/251', 'ext': 'webm', 'acodec': 'opus', 'vcodec': 'none', 'abr': 135},
+        ],
+    }
+
+
+def resolve(ydl, index):
+    set_outtmpl(ydl, f'/tmp/bench_ydl/{index}.%(ext)s')
+    info = ydl.process_ie_result(fake_video(index), download=False)
+    return ydl.prepare_filename(info)
+
+
+def run_fresh(tracks):
+    for index in range(tracks):
+        # One search and one download instance per track, as before
+        for kind in ('search', 'download_mp3'):
+            with yt_dlp.YoutubeDL(dict(YDL_OPTIONS[kind])) as ydl:
+                resolve(ydl, index)
+
+
+def run_reused(tracks):
+    for index in range(tracks):
+        for kind in ('search', 'download_mp3'):
+            resolve(get_ydl(kind), index)
+
+
+def measure(func, tracks):
+    started = time.perf_counter()
+    func(tracks)
+    return (time.perf_counter() - started) / tracks * 1000
+
+
+if __name__ == "__main__":
+    tracks = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    fresh = measure(run_fresh, tracks)
+    reused = measure(run_reused, tracks)
+    print(f"tracks: {tracks}")
+    print(f"fresh YoutubeDL per call: {fresh:.2f} ms/track")
+    print(f"reused per-worker:        {reused:.2f} ms/track")
+    print(f"saved:                    {fresh - reused:.2f} ms/track ({fresh / reused:.1f}x)")
@@ -0,0 +1,162 @@
+# Local stand-in for the parts of the Spotify Web API the downloader uses:
+# client-credentials tokens, playlists with paginated tracks, and batched
+# tracks / audio-features / artists lookups. Latency and 429s are injectable.
+
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+PAGE_SIZE = 100
+# Any JPEG header is enough: cover art is embedded as-is
+COVER = b'\xff\xd8\xff\xe0\x00\x10JFIF\x00\x01\x01\x00\x00\x01\x00\x01\x00\x00' + b'\x00' * 1024 + b'\xff\xd9'
+
+
+def make_tracks(count, base_url, duration_ms=30000):
+    tracks = []
+    for index in range(count):
+        album_id = f'benchalbum{index // 10:05d}'
+        tracks.append({
+            'id': f'bench{index:06d}',
+            'name': f'Song {index}',
+            'duration_ms': duration_ms,
+            'artists': [{'id': f'benchartist{index // 5:05d}', 'name': f'Artist {index // 5}'}],
+            'album': {
+                'id': album_id,
+                'name': f'Album {index // 10}',
+                'release_date': '2024-01-01',
+                'release_date_precision': 'day',
+                'images': [{'url': f'{base_url}/image/{album_id}.jpg'}],
+            },
+            'external_ids': {'isrc': f'BENCH{index:07d}'},
+        })
+    return tracks
+
+
+class StubSpotifyServer:
+    """Serves one playlist of generated tracks on 127.0.0.1.
+
+    latency: seconds added to every request. throttle_rate: share of API
+    requests answered with 429 and a Retry-After of retry_after seconds.
+    Start it, then load() the tracks (their cover URLs point back at it).
+    """
+
+    def __init__(self, playlist_id='benchplaylist', latency=0.0, throttle_rate=0.0, retry_after=0.5, seed=0):
+        self.tracks = {}
+        self.playlist_tracks = []
+        self.playlist_id = playlist_id
+        self.latency = latency
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.throttled = 0
+        self.server = None
+
+    @property
+    def base_url(self):
+        return f'http://127.0.0.1:{self.server.server_address[1]}'
+
+    @property
+    def api_prefix(self):
+        return self.base_url + '/v1/'
+
+    @property
+    def token_url(self):
+        return self.base_url + '/api/token'
+
+    @property
+    def playlist_url(self):
+        return f'https://open.spotify.com/playlist/{self.playlist_id}'
+
+    def start(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get('Content-Length') or 0))
+                stub.respond(self, 'POST')
+
+            def do_GET(self):
+                stub.respond(self, 'GET')
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, name='stub-spotify', daemon=True).start()
+        return self
+
+    def load(self, tracks):
+        self.tracks = {track['id']: track for track in tracks}
+        self.playlist_tracks = tracks
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _should_throttle(self):
+        with self.lock:
+            self.requests += 1
+            if self.throttle_rate and self.random.random() < self.throttle_rate:
+                self.throttled += 1
+                return True
+        return False
+
+    def respond(self, handler, method):
+        if self.latency:
+            time.sleep(self.latency)
+        url = urlparse(handler.path)
+        query = parse_qs(url.query)
+        path = url.path.rstrip('/')
+
+        if method == 'POST' and path == '/api/token':
+            return self._send(handler, 200, {'access_token': 'bench-token', 'token_type': 'Bearer', 'expires_in': 3600})
+        if path.startswith('/image/'):
+            return self._send(handler, 200, COVER, 'image/jpeg')
+        if self._should_throttle():
+            return self._send(handler, 429, {'error': {'status': 429, 'message': 'API rate limit exceeded'}},
+                              headers={'Retry-After': str(self.retry_after)})
+
+        ids = [value for value in (query.get('ids') or [''])[0].split(',') if value]
+        if path == f'/v1/playlists/{self.playlist_id}':
+            return self._send(handler, 200, {'name': 'Benchmark', 'snapshot_id': f'bench-{len(self.playlist_tracks)}'})
+        if path == f'/v1/playlists/{self.playlist_id}/tracks':
+            offset = int((query.get('offset') or ['0'])[0])
+            limit = min(PAGE_SIZE, int((query.get('limit') or [PAGE_SIZE])[0]))
+            page = self.playlist_tracks[offset:offset + limit]
+            next_url = None
+            if offset + limit < len(self.playlist_tracks):
+                next_url = f'{self.api_prefix}playlists/{self.playlist_id}/tracks?offset={offset + limit}&limit={limit}'
+            return self._send(handler, 200, {
+                'items': [{'track': track} for track in page], 'next': next_url,
+                'offset': offset, 'limit': limit, 'total': len(self.playlist_tracks),
+            })
+        if path == '/v1/tracks':
+            return self._send(handler, 200, {'tracks': [self.tracks.get(track_id) for track_id in ids]})
+        if path == '/v1/audio-features':
+            return self._send(handler, 200, {'audio_features': [
+                {'id': track_id, 'tempo': 124.0, 'energy': 0.8, 'key': 9, 'mode': 0,
+                 'duration_ms': self.tracks[track_id]['duration_ms']} if track_id in self.tracks else None
+                for track_id in ids
+            ]})
+        if path == '/v1/artists':
+            return self._send(handler, 200, {'artists': [{'id': artist_id, 'genres': ['house']} for artist_id in ids]})
+        return self._send(handler, 404, {'error': {'status': 404, 'message': 'Not found'}})
+
+    def _send(self, handler, status, body, content_type='application/json', headers=None):
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode('utf-8')
+        handler.send_response(status)
+        handler.send_header('Content-Type', content_type)
+        handler.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            handler.send_header(name, value)
+        handler.end_headers()
+        handler.wfile.write(body)
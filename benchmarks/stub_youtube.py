@@ -0,0 +1,214 @@
+# Stand-in for YouTube behind yt-dlp: a YoutubeDL whose only extractors answer
+# searches from a local catalog and resolve videos to audio files served over
+# HTTP at a configurable bandwidth. yt-dlp's own downloader, .part handling and
+# format selection still run; only the network on the other end is fake.
+
+import os
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import yt_dlp
+from yt_dlp.extractor.common import InfoExtractor, SearchInfoExtractor
+
+CHUNK_SIZE = 16 * 1024
+
+
+class AudioServer:
+    """Serves audio under /audio/<video id>, throttled per connection.
+
+    bandwidth: bytes per second for each connection (None for unthrottled),
+    like YouTube's per-stream throttling. Every video gets the same file
+    unless add() gives it its own bytes. Range requests are honoured so
+    interrupted downloads can resume, and /hls/<video id>.m3u8 serves the
+    same bytes as an HLS playlist of `segments` fragments.
+    """
+
+    def __init__(self, audio_path, bandwidth=None, segments=8):
+        with open(audio_path, 'rb') as f:
+            self.data = f.read()
+        self.extension = os.path.splitext(audio_path)[1].lstrip('.')
+        self.bandwidth = bandwidth
+        self.segments = segments
+        self.payloads = {}
+        self.lock = threading.Lock()
+        self.downloads = 0
+        self.bytes_sent = 0
+        self.active = 0
+        self.peak_active = 0
+        self.server = None
+
+    def add(self, video_id, data):
+        self.payloads[video_id] = data
+
+    def payload(self, video_id):
+        return self.payloads.get(video_id, self.data)
+
+    def segment(self, data, index):
+        size = -(-len(data) // self.segments)
+        return data[index * size:(index + 1) * size]
+
+    @property
+    def base_url(self):
+        return f'http://127.0.0.1:{self.server.server_address[1]}'
+
+    def start(self):
+        audio = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                audio.respond(self)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, name='stub-audio', daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def respond(self, handler):
+        path = handler.path.split('?')[0]
+        match = re.match(r'/hls/([\w-]+)\.m3u8$', path)
+        if match:
+            return self._send_playlist(handler, match.group(1))
+        match = re.match(r'/hls/([\w-]+)/(\d+)\.\w+$', path)
+        if match:
+            return self._send_body(handler, self.segment(self.payload(match.group(1)), int(match.group(2))))
+        match = re.match(r'/audio/([\w-]+)\.\w+$', path)
+        self._send_body(handler, self.payload(match.group(1)) if match else self.data)
+
+    def _send_playlist(self, handler, video_id):
+        lines = ['#EXTM3U', '#EXT-X-VERSION:3', '#EXT-X-TARGETDURATION:10', '#EXT-X-MEDIA-SEQUENCE:0']
+        for index in range(self.segments):
+            lines += ['#EXTINF:10.0,', f'{self.base_url}/hls/{video_id}/{index}.{self.extension}']
+        lines.append('#EXT-X-ENDLIST')
+        body = ('\n'.join(lines) + '\n').encode('utf-8')
+        handler.send_response(200)
+        handler.send_header('Content-Type', 'application/vnd.apple.mpegurl')
+        handler.send_header('Content-Length', str(len(body)))
+        handler.end_headers()
+        handler.wfile.write(body)
+
+    def _send_body(self, handler, data):
+        start, end = 0, len(data) - 1
+        match = re.match(r'bytes=(\d+)-(\d*)', handler.headers.get('Range') or '')
+        if match:
+            start = int(match.group(1))
+            end = min(end, int(match.group(2))) if match.group(2) else end
+        body = data[start:end + 1]
+
+        handler.send_response(206 if match else 200)
+        handler.send_header('Content-Type', 'audio/' + self.extension)
+        handler.send_header('Content-Length', str(len(body)))
+        handler.send_header('Accept-Ranges', 'bytes')
+        if match:
+            handler.send_header('Content-Range', f'bytes {start}-{end}/{len(data)}')
+        handler.end_headers()
+
+        with self.lock:
+            self.active += 1
+            self.peak_active = max(self.peak_active, self.active)
+        started = time.monotonic()
+        sent = 0
+        try:
+            for offset in range(0, len(body), CHUNK_SIZE):
+                if self.bandwidth:
+                    # Sleep until the bytes sent so far fit the configured rate; pacing before each
+                    # write means the connection closes as soon as its last byte is out
+                    ahead = sent / self.bandwidth - (time.monotonic() - started)
+                    if ahead > 0:
+                        time.sleep(ahead)
+                chunk = body[offset:offset + CHUNK_SIZE]
+                handler.wfile.write(chunk)
+                sent += len(chunk)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        with self.lock:
+            self.active -= 1
+            self.downloads += 1
+            self.bytes_sent += sent
+
+
+class Catalog:
+    """What the fake YouTube knows: search query -> results, video id -> audio."""
+
+    def __init__(self, audio_server, search_latency=0.0, fragmented=False):
+        self.audio_server = audio_server
+        self.search_latency = search_latency
+        # Offer HLS (fragmented) formats instead of one progressive file, like YouTube's DASH audio
+        self.fragmented = fragmented
+        self.results = {}
+
+    def add(self, query, video_id, title, duration, channel):
+        self.results.setdefault(query.lower(), []).append(
+            {'id': video_id, 'title': title, 'duration': duration, 'channel': channel},
+        )
+
+    def search(self, query):
+        if self.search_latency:
+            time.sleep(self.search_latency)
+        return self.results.get(query.lower(), [])
+
+    def video(self, video_id):
+        extension = self.audio_server.extension
+        if self.fragmented:
+            location = {'url': f'{self.audio_server.base_url}/hls/{video_id}.m3u8', 'protocol': 'm3u8_native'}
+        else:
+            location = {'url': f'{self.audio_server.base_url}/audio/{video_id}.{extension}'}
+        return {
+            'id': video_id,
+            'title': video_id,
+            'formats': [{
+                'format_id': 'bench',
+                **location,
+                'ext': extension,
+                'acodec': {'mp3': 'mp3', 'm4a': 'mp4a.40.2', 'webm': 'opus', 'opus': 'opus'}.get(extension, extension),
+                'vcodec': 'none',
+                'abr': 128,
+            }],
+        }
+
+
+def make_youtube_dl(catalog):
+    class StubSearchIE(SearchInfoExtractor):
+        IE_NAME = 'stub:search'
+        _SEARCH_KEY = 'ytsearch'
+
+        def _search_results(self, query):
+            for result in catalog.search(query):
+                yield {
+                    '_type': 'url',
+                    'ie_key': StubVideoIE.ie_key(),
+                    'url': f'https://www.youtube.com/watch?v={result["id"]}',
+                    **result,
+                }
+
+    class StubVideoIE(InfoExtractor):
+        IE_NAME = 'stub:video'
+        _VALID_URL = r'https?://www\.youtube\.com/watch\?v=(?P<id>[\w-]+)'
+
+        def _real_extract(self, url):
+            return catalog.video(self._match_id(url))
+
+    class StubYoutubeDL(yt_dlp.YoutubeDL):
+        def __init__(self, params=None, auto_init=True):
+            super().__init__(params, auto_init=False)
+            # The stub's HLS fragments are plain bytes, not MPEG-TS; there is nothing to fix up
+            self.params.setdefault('fixup', 'never')
+            self.add_info_extractor(StubSearchIE())
+            self.add_info_extractor(StubVideoIE())
+
+    return StubYoutubeDL
+
+
+def install(catalog):
+    # src.youtube builds its per-worker instances through yt_dlp.YoutubeDL
+    yt_dlp.YoutubeDL = make_youtube_dl(catalog)
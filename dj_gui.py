@@ -1,11 +1,20 @@
+import os
+import time
+import argparse
 import tkinter as tk
 from tkinter import ttk, messagebox
-import subprocess
 import threading
-import os
-import re
+import queue
 import multiprocessing
 
+from src import console
+from src.scheduler import JobScheduler
+from src.concurrency import AdaptiveController, default_limits
+from src.events import EventEmitter
+from src.youtube import throttled_count
+from src.bandwidth import DownloadShaping
+from parallel_downloader import download_playlist, default_worker_counts
+
 COLORS = {
     "bg": "#1e142f",           # midnight purple
     "fg": "#dcd6f7",           # lilac white
@@ -19,14 +28,29 @@ COLORS = {
 
 
 class DownloaderSession(tk.Frame):
-    def __init__(self, master, core_info, on_remove):
+    MAX_CONSOLE_LINES = 500
+    DRAIN_INTERVAL_MS = 100
+    DRAIN_BATCH = 500
+
+    def __init__(self, master, core_info, on_remove, scheduler, get_client, controller, get_analyzer, shaping):
         super().__init__(master, bg=COLORS["bg"], bd=2, relief=tk.RIDGE)
         self.master = master
         self.core_info = core_info
         self.on_remove = on_remove
-        self.process = None
+        self.scheduler = scheduler
+        self.get_client = get_client
+        self.get_analyzer = get_analyzer
+        self.shaping = shaping
+        self.controller = controller
+        self.job = None
+        # Worker threads only ever put onto this queue; the Tk thread drains it
+        self.updates = queue.Queue()
+        self.track_rows = {}
+        self.total_tracks = 0
+        self.finished_tracks = 0
 
         self.build_ui()
+        self.after(self.DRAIN_INTERVAL_MS, self.drain_updates)
 
     def build_ui(self):
         style = ttk.Style()
@@ -53,11 +77,12 @@ class DownloaderSession(tk.Frame):
         self.url_entry = tk.Entry(self, width=50, bg=COLORS["entry_bg"], fg=COLORS["fg"], insertbackground=COLORS["fg"])
         self.url_entry.pack(pady=(0, 10))
 
-        tk.Label(self, text=f"Parallel Downloads (suggested: {self.core_info['suggested']}, max: {self.core_info['max']}):",
+        tk.Label(self, text="Priority (share of the global budget, 1-10):",
                 bg=COLORS["bg"], fg=COLORS["fg"]).pack()
-        self.thread_entry = tk.Entry(self, width=10, bg=COLORS["entry_bg"], fg=COLORS["fg"], insertbackground=COLORS["fg"])
-        self.thread_entry.insert(0, str(self.core_info['suggested']))
-        self.thread_entry.pack(pady=(0, 10))
+        self.weight_entry = tk.Entry(self, width=10, bg=COLORS["entry_bg"], fg=COLORS["fg"], insertbackground=COLORS["fg"])
+        self.weight_entry.insert(0, "1")
+        self.weight_entry.bind("<Return>", lambda _event: self.apply_weight())
+        self.weight_entry.pack(pady=(0, 10))
 
         self.btn_frame = tk.Frame(self, bg=COLORS["bg"])
         self.btn_frame.pack(pady=(0, 10))
@@ -65,70 +90,162 @@ class DownloaderSession(tk.Frame):
         self.start_btn = ttk.Button(self.btn_frame, text="Start Download", style="Purple.TButton", command=self.start_download)
         self.start_btn.grid(row=0, column=0, padx=5)
 
+        self.pause_btn = ttk.Button(self.btn_frame, text="Pause", style="Purple.TButton", command=self.toggle_pause)
+        self.pause_btn.grid(row=0, column=1, padx=5)
+
         self.stop_btn = ttk.Button(self.btn_frame, text="Stop", style="Purple.TButton", command=self.stop_download)
-        self.stop_btn.grid(row=0, column=1, padx=5)
+        self.stop_btn.grid(row=0, column=2, padx=5)
 
         self.remove_btn = ttk.Button(self.btn_frame, text="Remove", style="Purple.TButton", command=self.remove)
-        self.remove_btn.grid(row=0, column=2, padx=5)
+        self.remove_btn.grid(row=0, column=3, padx=5)
 
         self.progress_var = tk.DoubleVar()
         self.progress_bar = ttk.Progressbar(self, variable=self.progress_var, maximum=100, style="custom.Horizontal.TProgressbar")
         self.progress_bar.pack(fill='x', padx=10, pady=(0, 5))
 
-        self.console = tk.Text(self, height=10, width=70, bg=COLORS["console_bg"], fg=COLORS["console_fg"])
+        style.configure("Tracks.Treeview",
+            background=COLORS["console_bg"],
+            fieldbackground=COLORS["console_bg"],
+            foreground=COLORS["console_fg"])
+
+        self.track_table = ttk.Treeview(self, columns=("track", "stage", "time"), show="headings",
+                                        height=8, style="Tracks.Treeview")
+        self.track_table.heading("track", text="Track")
+        self.track_table.heading("stage", text="Status")
+        self.track_table.heading("time", text="Time")
+        self.track_table.column("track", width=330)
+        self.track_table.column("stage", width=110)
+        self.track_table.column("time", width=60, anchor=tk.E)
+        self.track_table.pack(fill='x', padx=10, pady=(0, 5))
+
+        self.console = tk.Text(self, height=4, width=70, bg=COLORS["console_bg"], fg=COLORS["console_fg"])
         self.console.pack(padx=10, pady=(0, 10))
 
     def set_playlist_title(self, name):
         self.master.master.title(f"DJ Library Downloader - {name}")
 
     
+    def is_running(self):
+        return self.job is not None
+
+    def read_weight(self):
+        try:
+            return min(10, max(1, int(self.weight_entry.get().strip())))
+        except ValueError:
+            return 1
+
+    def apply_weight(self):
+        if self.job:
+            self.job.set_weight(self.read_weight())
+
+    def write_output(self, text):
+        self.updates.put(("text", text))
+
+    def on_event(self, event):
+        self.updates.put(("event", event))
+
+    def drain_updates(self):
+        text = []
+        try:
+            for _ in range(self.DRAIN_BATCH):
+                kind, payload = self.updates.get_nowait()
+                if kind == "text":
+                    text.append(payload)
+                else:
+                    self.apply_event(payload)
+        except queue.Empty:
+            pass
+
+        if text:
+            self.append_console("".join(text))
+        self.after(self.DRAIN_INTERVAL_MS, self.drain_updates)
+
+    def append_console(self, text):
+        self.console.insert(tk.END, text.replace("\r", "\n"))
+        # Keep only the newest lines so long runs don't grow the widget forever
+        line_count = int(self.console.index("end-1c").split(".")[0])
+        if line_count > self.MAX_CONSOLE_LINES:
+            self.console.delete("1.0", f"{line_count - self.MAX_CONSOLE_LINES + 1}.0")
+        self.console.see(tk.END)
+
+    def apply_event(self, event):
+        name = event["event"]
+        if name == "playlist_started":
+            self.total_tracks = event["total"]
+            self.finished_tracks = 0
+            self.set_playlist_title(event["playlist"])
+        elif name == "track_queued":
+            row = self.track_table.insert("", tk.END, values=(f"{event['artist']} - {event['title']}", "queued", ""))
+            self.track_rows[event["key"]] = row
+        elif name == "stage_changed" and event["key"] in self.track_rows:
+            self.track_table.set(self.track_rows[event["key"]], "stage", event["stage"])
+        elif name == "track_retrying" and event["key"] in self.track_rows:
+            self.track_table.set(self.track_rows[event["key"]], "stage", f"retrying ({event['stage']})")
+        elif name in ("track_finished", "track_failed") and event["key"] in self.track_rows:
+            row = self.track_rows[event["key"]]
+            status = f"failed ({event['stage']})" if name == "track_failed" else event["status"]
+            self.track_table.set(row, "stage", status)
+            self.track_table.set(row, "time", f"{event['elapsed']:.0f}s")
+            self.finished_tracks += 1
+            if self.total_tracks:
+                self.progress_var.set(100 * self.finished_tracks / self.total_tracks)
+        elif name == "playlist_finished":
+            self.progress_var.set(100)
+        elif name == "session_done":
+            # Widget state only changes on the Tk thread
+            self.job = None
+            self.remove_btn.state(["!disabled"])
+
     def start_download(self):
         url = self.url_entry.get().strip()
-        threads = self.thread_entry.get().strip()
         if not url:
             messagebox.showerror("Error", "Please enter a Spotify playlist URL.")
             return
+        if self.job:
+            return
 
         self.remove_btn.state(["disabled"])
         self.progress_var.set(0)
-
-        command = ["python", "parallel_downloader.py"]
-        env = os.environ.copy()
-        env["PYTHONUNBUFFERED"] = "1"
+        self.pause_btn.config(text="Pause")
+        self.track_table.delete(*self.track_table.get_children())
+        self.track_rows = {}
+        self.job = self.scheduler.create_session(url, self.read_weight())
+        job = self.job
 
         def run():
-            self.process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
-                                            stderr=subprocess.STDOUT, text=True, env=env)
-            self.process.stdin.write(url + "\n")
-            self.process.stdin.write((threads or "") + "\n")
-            self.process.stdin.flush()
-
-            for line in self.process.stdout:
-                self.console.insert(tk.END, line)
-                self.console.see(tk.END)
-
-                match = re.search(r'(\d+)%\|', line)
-                if match:
-                    percent = int(match.group(1))
-                    self.progress_var.set(percent)
-
-            self.process.wait()
-            self.progress_var.set(100)
-            self.process = None
-            self.remove_btn.state(["!disabled"])
+            # Everything printed from this thread and its workers lands in this console
+            console.set_sink(self.write_output)
+            try:
+                # Threads up to the controller's ceilings; the shared budget decides how many run
+                download_playlist(self.get_client(), url, workers=self.controller.ceilings(self.scheduler.budgets),
+                                  sync=True, session=job, events=EventEmitter(self.on_event, self.controller.observe),
+                                  show_progress=False, analyzer=self.get_analyzer(), shaping=self.shaping)
+            except Exception as e:
+                print(f"❌ General error: {e}")
+            finally:
+                self.scheduler.remove_session(job)
+                self.updates.put(("event", {"event": "session_done"}))
 
         threading.Thread(target=run, daemon=True).start()
 
+    def toggle_pause(self):
+        if not self.job:
+            return
+        if self.job.paused:
+            self.job.resume()
+            self.pause_btn.config(text="Pause")
+        else:
+            self.job.pause()
+            self.pause_btn.config(text="Resume")
+
     def stop_download(self):
-        if self.process and self.process.poll() is None:
-            self.process.terminate()
-            self.console.insert(tk.END, "\n❌ Download process terminated by user.\n")
-            self.console.see(tk.END)
-            self.process = None
-            self.remove_btn.state(["!disabled"])
+        if self.job:
+            # Tracks already mid-stage finish; nothing new is started
+            self.job.cancel()
+            self.append_console("\n❌ Download stopped by user.\n")
 
     def remove(self):
-        if self.process and self.process.poll() is None:
+        if self.is_running():
             messagebox.showinfo("Cannot Remove", "Session is currently running. Please stop it first.")
             return
         self.on_remove(self)
@@ -137,14 +254,28 @@ class DownloaderSession(tk.Frame):
 class DownloaderGUI(tk.Tk):
     MAX_SESSIONS = 6
     COLS = 2
+    BUDGET_REFRESH_MS = 1000
 
-    def __init__(self):
+    def __init__(self, prewarm=False):
         super().__init__()
         self.title("DJ Library Downloader")
         self.configure(bg=COLORS["bg"])
 
         self.core_info = self.get_core_info()
         self.sessions = []
+        # Every session draws from this one budget instead of sizing its own pool
+        workers = default_worker_counts(self.core_info['suggested'])
+        self.scheduler = JobScheduler(workers)
+        # One controller tunes the shared download/transcode budget from every session's events
+        self.controller = AdaptiveController(self.scheduler, default_limits(workers), throttled=throttled_count)
+        self.controller.start()
+        # Bandwidth cap and per-host connection limit apply to all sessions together
+        self.shaping = DownloadShaping()
+        self.client = None
+        self.client_lock = threading.Lock()
+        self.analyzer = None
+        self.analyzer_lock = threading.Lock()
+        console.install()
 
         style = ttk.Style()
         style.theme_use("clam")
@@ -160,11 +291,67 @@ class DownloaderGUI(tk.Tk):
         self.close_btn = ttk.Button(self.control_frame, text="Close GUI", style="Purple.TButton", command=self.quit)
         self.close_btn.pack(side=tk.LEFT, padx=10)
 
+        self.budget_label = tk.Label(self.control_frame, bg=COLORS["bg"], fg=COLORS["fg"])
+        self.budget_label.pack(side=tk.LEFT, padx=10)
+        self.refresh_budget()
+
         self.session_frame = tk.Frame(self, bg=COLORS["bg"])
         self.session_frame.pack(padx=10, pady=10, fill=tk.BOTH, expand=True)
 
         self.update_geometry()
         self.add_new_session()
+        if prewarm:
+            threading.Thread(target=self.prewarm, name='prewarm', daemon=True).start()
+
+    def refresh_budget(self):
+        # The controller resizes the budget from its own thread; poll it from the Tk thread
+        budgets = self.scheduler.budgets
+        text = f"Shared budget: {budgets['search']} search · {budgets['download']} download · {budgets['transcode']} transcode"
+        last = self.controller.history[-1]
+        if last['reason'] != 'start':
+            text += f" (adaptive; last: {last['pool']} {last['previous']} → {last['level']}, {last['reason']})"
+        self.budget_label.config(text=text)
+        self.after(self.BUDGET_REFRESH_MS, self.refresh_budget)
+
+    def get_client(self):
+        # One Spotify client (and token) for every session
+        with self.client_lock:
+            if self.client is None:
+                from src.auth import authenticate_spotipy
+                self.client = authenticate_spotipy()
+            return self.client
+
+    def get_analyzer(self):
+        # One analysis process pool for every session, started on first use (or by prewarm)
+        with self.analyzer_lock:
+            if self.analyzer is None:
+                from src.analysis import AudioAnalyzer
+                self.analyzer = AudioAnalyzer.for_library(os.path.join(os.getcwd(), "Downloaded_Music"),
+                                                          workers=self.scheduler.budgets['analyze'])
+            return self.analyzer
+
+    def prewarm(self):
+        # Pays every one-off startup cost while the window sits idle, so Start begins work at once:
+        # Spotify token, yt-dlp's imports, NumPy, and the spawned analysis workers
+        started = time.perf_counter()
+        try:
+            self.get_client()
+            # Only the module-level work is shared: importing yt_dlp and its extractor list. Each pipeline
+            # worker still builds its own YoutubeDL on first use (see src.youtube.get_ydl)
+            from yt_dlp.extractor import gen_extractor_classes
+            gen_extractor_classes()
+            import src.matching
+            src.matching.score_candidates([], [])
+            pids = self.get_analyzer().warm()
+        except Exception as e:
+            print(f"⚠️ Prewarm failed: {e}")
+            return
+        print(f"🔥 Prewarmed in {time.perf_counter() - started:.1f}s ({len(pids)} analysis workers ready)")
+
+    def close(self):
+        self.controller.stop()
+        if self.analyzer:
+            self.analyzer.close()
 
     def get_core_info(self):
         total = multiprocessing.cpu_count()
@@ -181,7 +368,8 @@ class DownloaderGUI(tk.Tk):
             messagebox.showwarning("Limit Reached", f"Only {self.MAX_SESSIONS} simultaneous sessions allowed.")
             return
 
-        session = DownloaderSession(self.session_frame, self.core_info, self.remove_session)
+        session = DownloaderSession(self.session_frame, self.core_info, self.remove_session, self.scheduler, self.get_client,
+                                   self.controller, self.get_analyzer, self.shaping)
         row = len(self.sessions) // self.COLS
         col = len(self.sessions) % self.COLS
         session.grid(row=row, column=col, padx=10, pady=10, sticky="nsew")
@@ -209,12 +397,22 @@ class DownloaderGUI(tk.Tk):
 
     def update_removal_states(self):
         for session in self.sessions:
-            if len(self.sessions) <= 1 or (session.process and session.process.poll() is None):
+            if len(self.sessions) <= 1 or session.is_running():
                 session.remove_btn.state(["disabled"])
             else:
                 session.remove_btn.state(["!disabled"])
 
 
+def parse_args():
+    parser = argparse.ArgumentParser(description="Download Spotify playlists in parallel GUI sessions.")
+    parser.add_argument('--prewarm', action='store_true',
+                        help="authenticate, load yt-dlp and start the analysis workers in the background at launch")
+    return parser.parse_args()
+
 if __name__ == "__main__":
-    app = DownloaderGUI()
-    app.mainloop()
\ No newline at end of file
+    args = parse_args()
+    app = DownloaderGUI(prewarm=args.prewarm)
+    try:
+        app.mainloop()
+    finally:
+        app.close()
\ No newline at end of file
@@ -1,15 +1,110 @@
+#show the tags on one file, or build and query a tag catalog of the whole library
+#
+#   python mp3_tag_viewer.py show "Downloaded_Music/Playlist/50 Cent - In Da Club.mp3"
+#   python mp3_tag_viewer.py scan [Downloaded_Music] [-w WORKERS] [--full]
+#   python mp3_tag_viewer.py query "124-128 BPM, 8A, house" [--compatible] [--genre house] [--year 2015-2020]
 
-#run this on an mp3 to see the metadata and what tags are on it
-
+import os
+import time
+import argparse
+import multiprocessing
 from mutagen.mp3 import MP3
 from mutagen.id3 import ID3, ID3NoHeaderError
+from src.catalog import TagCatalog, parse_query, camelot, compatible_keys
+
+DEFAULT_ROOT = os.path.join(os.getcwd(), "Downloaded_Music")
+
+
+def show(file_path):
+    try:
+        audio = MP3(file_path, ID3=ID3)
+        print(f"Tags in {file_path}:")
+        for tag in audio.tags.keys():
+            print(f"{tag}: {audio.tags[tag]}")
+    except ID3NoHeaderError:
+        print(f"No ID3 tags found in {file_path}")
+
+def scan(root, workers=None, full=False):
+    catalog = TagCatalog.for_library(root)
+    try:
+        started = time.perf_counter()
+        result = catalog.scan(workers=workers, full=full)
+        elapsed = time.perf_counter() - started
+        print(f"📚 {result['files']} files: {result['read']} read, {result['removed']} removed, "
+              f"{result['files'] - result['read']} unchanged in {elapsed:.1f}s")
+        for path, error in result['errors']:
+            print(f"❌ {path}: {error}")
+        return result
+    finally:
+        catalog.close()
+
+def parse_range(text):
+    # '124-128', '124-' or '-128'; a single value matches itself
+    low, _, high = text.replace('–', '-').partition('-')
+    if not _:
+        high = low
+    return (float(low) if low.strip() else None, float(high) if high.strip() else None)
+
+def format_track(track):
+    bpm = f"{track['bpm']:.0f}" if track['bpm'] else '-'
+    genre = f" [{track['genre']}]" if track['genre'] else ''
+    year = f" ({track['year']})" if track['year'] else ''
+    return (f"{bpm:>4}  {track['camelot'] or '-':>3} {track['key'] or '':<4} "
+            f"{track['artist'] or '?'} - {track['title'] or os.path.basename(track['path'])}{genre}{year}")
+
+def query(root, text='', key=None, compatible=False, genre=None, year=None, limit=None, order='bpm', paths=False):
+    catalog = TagCatalog.for_library(root)
+    try:
+        terms = parse_query(text)
+        if key:
+            terms['keys'] = [camelot(value) or value for value in key.split(',')]
+        if compatible and terms['keys']:
+            terms['keys'] = list(dict.fromkeys(code for value in terms['keys'] for code in compatible_keys(value)))
+        started = time.perf_counter()
+        tracks = catalog.query(**terms, genre=genre, year=parse_range(year) if year else None, limit=limit,
+                               order=order)
+        elapsed = time.perf_counter() - started
+        for track in tracks:
+            print(track['path'] if paths else format_track(track))
+        if not paths:
+            print(f"\n🔎 {len(tracks)} of {catalog.count()} tracks in {elapsed * 1000:.1f} ms")
+        return tracks
+    finally:
+        catalog.close()
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Inspect tags on one file, or scan and query the whole library.")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    show_parser = commands.add_parser('show', help="print every tag frame on one MP3")
+    show_parser.add_argument('file')
+
+    scan_parser = commands.add_parser('scan', help="build or refresh the tag catalog (only changed files are read)")
+    scan_parser.add_argument('root', nargs='?', default=DEFAULT_ROOT, help="library folder (default: ./Downloaded_Music)")
+    scan_parser.add_argument('-w', '--workers', type=int, default=multiprocessing.cpu_count(),
+                             help="worker processes (default: CPU count)")
+    scan_parser.add_argument('--full', action='store_true', help="re-read every file, not just changed ones")
 
-file_path = "Downloaded_Music/POV you have aux but don't know what to play/50 Cent - In Da Club.mp3"
+    query_parser = commands.add_parser('query', help="search the catalog, e.g. \"124-128 BPM, 8A, house\"")
+    query_parser.add_argument('text', nargs='*', help="BPM range, Camelot keys and words matched against "
+                                                      "artist, title, album and genre")
+    query_parser.add_argument('--root', default=DEFAULT_ROOT, help="library folder (default: ./Downloaded_Music)")
+    query_parser.add_argument('--key', help="Camelot codes or keys, comma-separated (e.g. 8A,9A or F#m)")
+    query_parser.add_argument('--compatible', action='store_true',
+                              help="include harmonically compatible keys (±1 on the wheel and the relative key)")
+    query_parser.add_argument('--genre', help="words matched against the genre only")
+    query_parser.add_argument('--year', help="year or range, e.g. 2015-2020")
+    query_parser.add_argument('--order', choices=('bpm', 'key', 'artist', 'year'), default='bpm')
+    query_parser.add_argument('-n', '--limit', type=int, help="show at most this many tracks")
+    query_parser.add_argument('--paths', action='store_true', help="print only file paths (e.g. for an M3U)")
+    return parser.parse_args()
 
-try:
-    audio = MP3(file_path, ID3=ID3)
-    print(f"Tags in {file_path}:")
-    for tag in audio.tags.keys():
-        print(f"{tag}: {audio.tags[tag]}")
-except ID3NoHeaderError:
-    print(f"No ID3 tags found in {file_path}")
+if __name__ == "__main__":
+    args = parse_args()
+    if args.command == 'show':
+        show(args.file)
+    elif args.command == 'scan':
+        scan(args.root, workers=args.workers, full=args.full)
+    else:
+        query(args.root, ' '.join(args.text), key=args.key, compatible=args.compatible, genre=args.genre,
+              year=args.year, limit=args.limit, order=args.order, paths=args.paths)
@@ -1,14 +1,32 @@
 import os
 import re
-import csv
+import sys
+import time
+import shutil
+import argparse
 import multiprocessing
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from collections import Counter
+from functools import partial
 from tqdm import tqdm
-from src.auth import authenticate_spotipy
-from src.youtube import search_youtube_multiple, download_audio_from_url, is_valid_mp3
-from spotipy.exceptions import SpotifyException
-from mutagen.id3 import ID3, TIT2, TPE1, TALB, TCON, TDRC, ID3NoHeaderError
-from mutagen.mp3 import MP3
+from src.pipeline import Pipeline, Stage
+from src.scheduler import JobScheduler, SessionCancelled
+from src.concurrency import AdaptiveController, default_limits, format_change
+from src.events import EventEmitter, JsonLinesWriter
+from src.search_cache import SearchCache
+from src.manifest import LibraryManifest, file_checksum
+from src.spotify_data import SpotifyMetadata
+from src.integrity import check_file, is_broken
+from src.journal import JobJournal, resume_point
+from src.metrics import RunMetrics, RunReport, span
+from src.album_art import AlbumArtCache
+from src.tagging import write_tags, job_tags
+from src.playlist_sync import Tracklist, load_sync_state, save_sync_state, diff_track_ids, archive_removed, write_review
+from src.matching import select_matches, MIN_CONFIDENCE
+from src.youtube import (
+    search_candidates, download_raw_audio, convert_audio, stream_audio, guess_codec, throttled_count,
+    partial_download_size, download_shaping, set_download_shaping, OUTPUT_FORMATS, ENCODER_PRESETS,
+)
+from src.bandwidth import DownloadShaping, DEFAULT_PER_HOST, DEFAULT_FRAGMENTS
 
 def clean_filename(name):
     name = re.sub(r'[\/*?:"<>|]', '', name)  # remove illegal characters
@@ -27,9 +45,11 @@ def normalize_mp3_extension(path):
     return path
 
 
+def get_playlist_info(sp, playlist_id):
+    return sp.playlist(playlist_id, fields='name,snapshot_id')
+
 def get_playlist_name(sp, playlist_id):
-    playlist = sp.playlist(playlist_id)
-    return playlist['name']
+    return get_playlist_info(sp, playlist_id)['name']
 
 def get_playlist_tracks(sp, playlist_id):
     tracks = []
@@ -39,127 +59,682 @@ def get_playlist_tracks(sp, playlist_id):
         results = sp.next(results) if results['next'] else None
     return tracks
 
-def tag_mp3(filepath, artist, title, album="", genre="", year=""):
-    try:
-        audio = MP3(filepath, ID3=ID3)
-    except ID3NoHeaderError:
-        audio = MP3(filepath)
-        audio.add_tags()
-
-    audio.tags.add(TPE1(encoding=3, text=[artist]))
-    audio.tags.add(TIT2(encoding=3, text=[title]))
-    if album:
-        audio.tags.add(TALB(encoding=3, text=[album]))
-    if genre:
-        audio.tags.add(TCON(encoding=3, text=[genre]))
-    if year:
-        audio.tags.add(TDRC(encoding=3, text=[str(year)]))
-
-    audio.save()
-    print(f"🏷️ Tagged for Serato: {title} by {artist}")
-
-def process_track(track, playlist_folder, writer_lock, writer):
-    import time
+def make_job(track, playlist_folder, info=None, index=0, extra_folders=(), output_format='mp3', preset=None):
     title = track['name']
     artist = track['artists'][0]['name']
-    album = track.get('album', {}).get('name', '')
-    year = track.get('album', {}).get('release_date', '')[:4]
-    genre = ', '.join(track.get('artists', [])[0].get('genres', [])) if 'genres' in track['artists'][0] else ''
+    info = info or {}
+    return {
+        'track': track,
+        'track_id': track.get('id'),
+        'key': track.get('id') or f"local-{index}",
+        'title': title,
+        'artist': artist,
+        'album': track.get('album', {}).get('name', ''),
+        'year': track.get('album', {}).get('release_date', '')[:4],
+        'genre': ', '.join(info.get('genre') or []),
+        'bpm': info.get('bpm'),
+        'energy': info.get('energy'),
+        'musical_key': info.get('key'),
+        'mode': info.get('mode'),
+        'isrc': info.get('isrc'),
+        'duration_ms': info.get('duration_ms') or track.get('duration_ms'),
+        'album_spotify_id': track.get('album', {}).get('id'),
+        'album_art_url': info.get('album_art_url') or next(iter(track.get('album', {}).get('images') or []), {}).get('url'),
+        'folder': playlist_folder,
+        # Every playlist folder this track belongs in; the first one gets the download
+        'folders': [playlist_folder, *extra_folders],
+        'safe_name': clean_filename(f"{artist} - {title}"),
+        'output_format': output_format,
+        'extension': '.' + OUTPUT_FORMATS[output_format]['ext'],
+        'preset': preset,
+        'status': 'queued',
+        'stage': 'queued',
+        'timings': {},
+        'queued_at': time.time(),
+    }
+
+def find_existing(job, manifest):
+    for folder in job['folders']:
+        entry = manifest.lookup(job['track_id'], folder) if manifest else None
+        if entry:
+            return entry['path']
+
+    # Files from before the manifest existed: one stat, then adopt them
+    expected_path = os.path.join(job['folder'], job['safe_name'] + job['extension'])
+    if os.path.exists(expected_path):
+        if manifest and job['track_id']:
+            manifest.record(job['track_id'], expected_path)
+        return expected_path
 
-    search_query = f"{title} {artist} official audio"
+    # Already downloaded for some other playlist
+    entry = manifest.find_any(job['track_id']) if manifest else None
+    return entry['path'] if entry else None
+
+def place_file(source_path, target_path):
+    # Hardlink when the filesystem allows it, so shared tracks cost no extra space
+    try:
+        os.link(source_path, target_path)
+    except OSError:
+        shutil.copy2(source_path, target_path)
+
+def place_copies(job, source_path, manifest=None):
+    placed = 0
+    checksum = None  # every copy placed here has the source's bytes, so it is hashed once
+    extension = os.path.splitext(source_path)[1]
+    for folder in job['folders']:
+        if manifest and manifest.lookup(job['track_id'], folder):
+            continue
+        target_path = os.path.join(folder, job['safe_name'] + extension)
+        is_copy = os.path.abspath(target_path) == os.path.abspath(source_path)
+        if not is_copy and not os.path.exists(target_path):
+            place_file(source_path, target_path)
+            placed += 1
+            is_copy = True
+        if manifest and job['track_id']:
+            if is_copy and checksum is None:
+                checksum = file_checksum(source_path)
+            # A file that was already there under the same name may differ; record() hashes that one itself
+            manifest.record(job['track_id'], target_path, job.get('duration'), checksum=checksum if is_copy else None)
+    return placed
+
+def search_track(job, search_cache=None, manifest=None):
+    existing_path = find_existing(job, manifest)
+    if existing_path:
+        placed = place_copies(job, existing_path, manifest)
+        if placed:
+            print(f"🔗 Linked {placed} copies of: {os.path.basename(existing_path)}")
+            job['status'] = 'linked'
+        else:
+            print(f"✅ Already downloaded: {os.path.basename(existing_path)}")
+            job['status'] = 'skipped'
+        return None
+
+    search_query = f"{job['title']} {job['artist']} official audio"
     print(f"🔎 Searching: {search_query}")
 
-    video_info = search_youtube_multiple(search_query)
-    if not video_info:
-        print(f"❌ No results found for {title} by {artist}")
-        return
+    candidates = search_candidates(search_query, cache=search_cache, track_id=job['track_id'])
+    if candidates is None:
+        # A failed search (often YouTube throttling) is retried like a failed download
+        job['status'] = 'failed'
+        job['error'] = 'search failed'
+        return None
+    if not candidates:
+        print(f"❌ No results found for {job['title']} by {job['artist']}")
+        job['status'] = 'not_found'
+        return None
 
-    yt_title = video_info['title']
-    yt_url = video_info['webpage_url']
+    job['candidates'] = candidates
+    return job
 
-    base_filename = f"{artist} - {title}"
-    safe_name = clean_filename(base_filename)
-    expected_path = os.path.join(playlist_folder, safe_name + ".mp3")
+def match_tracks(jobs, min_confidence=MIN_CONFIDENCE):
+    # Scores the candidates of every job waiting in the queue in one pass
+    tracks = [
+        {'title': job['title'], 'artists': [a['name'] for a in job['track']['artists']], 'duration_ms': job['duration_ms']}
+        for job in jobs
+    ]
+    matches = select_matches(tracks, [job.pop('candidates') for job in jobs], min_confidence)
 
-    if os.path.exists(expected_path):
-        print(f"✅ Already downloaded: {os.path.basename(expected_path)}")
-        return
+    results = []
+    for job, (video, confidence, delta, accepted) in zip(jobs, matches):
+        job['match'] = {
+            'confidence': confidence,
+            'duration_delta': delta,
+            'title': video['title'] if video else None,
+            'url': video['webpage_url'] if video else None,
+        }
+        if accepted:
+            job['video'] = video
+            results.append(job)
+            continue
+        # A wrong version costs a download and a re-download; better to ask first
+        print(f"🤔 Deferred for review: {job['safe_name']} (best match {confidence:.2f}: {job['match']['title']})")
+        job['status'] = 'review'
+        results.append(None)
+    return results
+
+def match_track(job, min_confidence=MIN_CONFIDENCE):
+    return match_tracks([job], min_confidence)[0]
+
+def remaining_download(job):
+    # Download order: shortest job first by estimated bytes still to fetch, so a .part file left by an
+    # interrupted run and short tracks finish early and keep the later stages busy
+    seconds = (job.get('video') or {}).get('duration') or (job.get('duration_ms') or 0) / 1000
+    estimate = seconds * ESTIMATED_BYTES_PER_SECOND
+    return max(0, estimate - partial_download_size(os.path.join(job['folder'], job['safe_name'] + ".download")))
+
+def download_track(job):
+    print(f"⬇️ Downloading: {job['safe_name']}{job['extension']} ({job['video']['title']})")
+    raw_path = download_raw_audio(job['video']['webpage_url'], os.path.join(job['folder'], job['safe_name'] + ".download"),
+                                  job['output_format'])
+    if not raw_path:
+        job['status'] = 'failed'
+        job['error'] = 'download failed'
+        return None
+
+    job['raw_path'] = raw_path
+    job['download_bytes'] = os.path.getsize(raw_path)
+    return job
+
+def check_output(job, path, output_path):
+    # Walks the frames of the finished file, so truncated or padded downloads are caught before tagging
+    report = check_file(path, job['duration_ms']) if path else None
+    if report is None or is_broken(report):
+        problems = ', '.join(report['problems']) if report else 'no output'
+        print(f"❌ Corrupted or invalid audio detected: {output_path} ({problems})")
+        if path:
+            os.remove(path)
+        job['status'] = 'failed'
+        job['error'] = problems
+        return None
+    job['duration'] = report['duration']
+    if 'duration_mismatch' in report['problems']:
+        print(f"⚠️ {job['safe_name']} is {job['duration']:.0f}s long, Spotify says {job['duration_ms'] / 1000:.0f}s")
 
-    print(f"⬇️ Downloading: {safe_name}.mp3 ({yt_title})")
-    time_before = time.time()
-    downloaded_path = download_audio_from_url(yt_url, os.path.join(playlist_folder, safe_name))
+    job['path'] = normalize_mp3_extension(path) if job['output_format'] == 'mp3' else path
+    return job
 
-    # yt-dlp should now return path with .mp3 appended
-    if downloaded_path and os.path.exists(downloaded_path):
-        if not is_valid_mp3(downloaded_path):
-            print(f"❌ Corrupted or invalid MP3 detected: {downloaded_path}")
-            os.remove(downloaded_path)
+def transcode_track(job):
+    # Re-encodes only when the downloaded codec differs from the target; otherwise a stream copy
+    output_path = os.path.join(job['folder'], job['safe_name'] + job['extension'])
+    with span(job['timings'], 'encode'):
+        path = convert_audio(job['raw_path'], output_path, job['output_format'], job['preset'], guess_codec(job['raw_path']))
+    with span(job['timings'], 'validate'):
+        return check_output(job, path, output_path)
+
+def stream_track(job):
+    # Download and encode in one ffmpeg process, straight from the stream URL
+    output_path = os.path.join(job['folder'], job['safe_name'] + job['extension'])
+    print(f"⬇️ Streaming: {job['safe_name']}{job['extension']} ({job['video']['title']})")
+    with span(job['timings'], 'encode'):
+        path = stream_audio(job['video']['webpage_url'], output_path, job['output_format'], job['preset'])
+    if path:
+        job['download_bytes'] = os.path.getsize(path)
+    with span(job['timings'], 'validate'):
+        return check_output(job, path, output_path)
+
+def analyze_track(job, analyzer=None):
+    # Spotify's audio features win when present; local analysis fills the gaps and always supplies loudness.
+    # Like missing art, a failed analysis never fails the track
+    try:
+        result = analyzer.analyze(job['path']) if analyzer else None
+    except Exception as e:
+        print(f"⚠️ Analysis failed for {job['safe_name']}: {e}")
+        result = None
+    if result:
+        if not job['bpm']:
+            job['bpm'] = result['bpm']
+        if job['musical_key'] is None:
+            job['musical_key'], job['mode'] = result['key'], result['mode']
+        job['loudness'] = result['loudness']
+        job['replay_gain'] = result['replay_gain']
+        job['replay_peak'] = result['peak']
+    return job
+
+def fetch_art(job, art_cache=None):
+    # Missing art never fails a track; it just gets tagged without a cover
+    if art_cache:
+        job['art'] = art_cache.get(job['album_spotify_id'], job['album_art_url'])
+    return job
+
+def tag_track(job, manifest=None):
+    write_tags(job['path'], job_tags(job), job.pop('art', None))
+    print(f"🏷️ Tagged for Serato: {job['title']} by {job['artist']}")
+    place_copies(job, job['path'], manifest)
+    job['status'] = 'done'
+    print(f"✅ Downloaded and tagged: {os.path.basename(job['path'])}")
+    return job
+
+def process_track(track, playlist_folder, search_cache=None, manifest=None, info=None, art_cache=None,
+                  output_format='mp3', preset=None, analyzer=None, min_confidence=MIN_CONFIDENCE):
+    # Runs one track through every stage in turn, without the pipeline
+    job = make_job(track, playlist_folder, info, output_format=output_format, preset=preset)
+    stages = (
+        partial(search_track, search_cache=search_cache, manifest=manifest),
+        partial(match_track, min_confidence=min_confidence),
+        download_track,
+        transcode_track,
+        partial(analyze_track, analyzer=analyzer),
+        partial(fetch_art, art_cache=art_cache),
+        partial(tag_track, manifest=manifest),
+    )
+    for stage in stages:
+        if stage(job) is None:
+            break
+    return job
+
+MATCH_BATCH = 64
+MAX_RETRIES = 3
+RETRY_BACKOFF = 5  # seconds before the first retry round; doubles each round
+ESTIMATED_BYTES_PER_SECOND = 16_000  # ~128 kbps audio; only used to order downloads
+
+def default_worker_counts(download_workers=None):
+    core_count = multiprocessing.cpu_count()
+    download_workers = download_workers or min(10, core_count * 2)
+    return {
+        'search': download_workers * 2,
+        'download': download_workers,
+        'transcode': core_count,
+        'analyze': core_count,
+        'art': 4,
+    }
+
+def on_stage_error(stage_name, job, error):
+    if isinstance(error, SessionCancelled):
+        job['status'] = 'cancelled'
+        return
+    print(f"❌ {stage_name} failed for {job['title']} by {job['artist']}: {error}")
+    job['status'] = 'failed'
+    job['error'] = str(error)
+
+def wait_for_retry(delay, session=None):
+    # Sleeps in short steps so Stop doesn't have to wait out the backoff
+    deadline = time.monotonic() + delay
+    while time.monotonic() < deadline:
+        if session is not None and session.cancelled:
             return
+        time.sleep(min(0.5, deadline - time.monotonic()))
+
+def requeue_failed(job, stage_names):
+    # Back into the pipeline at the stage that failed, or the nearest earlier one whose inputs still exist
+    job['resume_stage'] = job['stage']
+    job['resume_at'] = resume_point(job, stage_names)
+    job['status'] = 'queued'
+    job.pop('error', None)
+    return job
+
+def print_stage_summary(report):
+    stages = report.summary(report.tracks)['stages']
+    if stages:
+        print("⏱️ Stage time (p50 / p95 / total): " + ", ".join(
+            f"{name} {stats['p50']:.2f}s / {stats['p95']:.2f}s / {stats['total']:.0f}s" for name, stats in stages.items()))
+
+def emit_job_result(events, job):
+    fields = {
+        'key': job['key'],
+        'status': job['status'],
+        'stage': job['stage'],
+        'elapsed': round(time.time() - job['queued_at'], 3),
+        'timings': job['timings'],
+        'download_bytes': job.get('download_bytes'),
+    }
+    if job['status'] == 'done':
+        # Feeds the adaptive controller's bytes-per-second signal
+        fields['bytes'] = os.path.getsize(job['path'])
+    if job['status'] == 'failed':
+        events.emit('track_failed', error=job.get('error'), **fields)
     else:
-        # Fallback: check any new mp3s created after time_before
-        mp3_files = [
-            os.path.join(playlist_folder, f)
-            for f in os.listdir(playlist_folder)
-            if f.lower().endswith(".mp3") and os.path.getctime(os.path.join(playlist_folder, f)) >= time_before
+        events.emit('track_finished', **fields)
+
+def prepare_playlist(sp, playlist_url, base_folder, manifest, sync=False, archive=False):
+    # Resolves one playlist into the tracks that still need work, applying the sync diff
+    playlist_id = playlist_url.split("playlist/")[1].split("?")[0]
+    playlist_info = get_playlist_info(sp, playlist_id)
+    playlist_name = clean_filename(playlist_info['name'])
+    playlist_folder = os.path.join(base_folder, playlist_name)
+    os.makedirs(playlist_folder, exist_ok=True)
+
+    plan = {
+        'id': playlist_id,
+        'name': playlist_name,
+        'folder': playlist_folder,
+        'snapshot_id': playlist_info['snapshot_id'],
+        'tracks': [],
+        'track_ids': None,
+        'tracklist': Tracklist(os.path.join(playlist_folder, 'tracklist.csv')),
+    }
+
+    state = load_sync_state(playlist_folder) if sync else None
+    if state and state['snapshot_id'] == playlist_info['snapshot_id']:
+        missing = [track_id for track_id in state['track_ids'] if not manifest.lookup(track_id, playlist_folder)]
+        if not missing:
+            print(f"✅ {playlist_name} is up to date (snapshot unchanged)")
+            return plan
+        print(f"🔁 Snapshot unchanged, but {len(missing)} tracks are missing locally")
+
+    tracks = get_playlist_tracks(sp, playlist_id)
+    plan['track_ids'] = [track['id'] for track in tracks if track.get('id')]
+    print(f"🎵 Found {len(tracks)} tracks in playlist: {playlist_name}")
+
+    if state:
+        added, removed = diff_track_ids(state['track_ids'], plan['track_ids'])
+        print(f"🔀 Sync: {len(added)} added, {len(removed)} removed since last run")
+        if removed:
+            if archive:
+                moved = archive_removed(manifest, playlist_folder, removed)
+                print(f"📦 Archived {moved} removed tracks")
+            plan['tracklist'].remove(removed)
+        tracks = [
+            track for track in tracks
+            if track.get('id') in added or not manifest.lookup(track.get('id'), playlist_folder)
         ]
-        if mp3_files:
-            downloaded_path = max(mp3_files, key=os.path.getctime)
-            if not is_valid_mp3(downloaded_path):
-                print(f"❌ Fallback file also invalid: {downloaded_path}")
-                os.remove(downloaded_path)
-                return
+
+    plan['tracks'] = tracks
+    return plan
+
+def group_tracks(plans):
+    # One entry per unique Spotify track, listing every playlist folder that wants it
+    groups = {}
+    for plan in plans:
+        for index, track in enumerate(plan['tracks']):
+            key = track.get('id') or f"{plan['id']}:local-{index}"
+            if key in groups:
+                groups[key]['folders'].append(plan['folder'])
+            else:
+                groups[key] = {'track': track, 'folders': [plan['folder']]}
+    return list(groups.values())
+
+def build_stages(workers, search_cache, manifest, art_cache, stream=False, analyzer=None, min_confidence=MIN_CONFIDENCE):
+    if stream:
+        # Download and encode share one process per track, so they share one pool
+        fetch_stages = [Stage('download', stream_track, workers['download'], queue_size=workers['download'] * 4,
+                              priority=remaining_download)]
+    else:
+        fetch_stages = [
+            # A deeper queue than usual gives the shortest-first ordering more jobs to choose from
+            Stage('download', download_track, workers['download'], queue_size=workers['download'] * 4,
+                  priority=remaining_download),
+            Stage('transcode', transcode_track, workers['transcode']),
+        ]
+    analysis_stages = [Stage('analyze', partial(analyze_track, analyzer=analyzer), workers.get('analyze', 1))] if analyzer else []
+    return [
+        Stage('search', partial(search_track, search_cache=search_cache, manifest=manifest), workers['search']),
+        Stage('match', partial(match_tracks, min_confidence=min_confidence), 1, batch_size=MATCH_BATCH),
+        *fetch_stages,
+        *analysis_stages,
+        Stage('art', partial(fetch_art, art_cache=art_cache), workers.get('art', 4)),
+        Stage('tag', partial(tag_track, manifest=manifest), 1),
+    ]
+
+def download_playlists(sp, playlist_urls, workers=None, refresh_search=False, sync=False, archive=False,
+                       session=None, events=None, show_progress=True, output_format='mp3', preset=None, stream=False,
+                       analyze=True, min_confidence=MIN_CONFIDENCE, adaptive=True, metrics=None, analyzer=None,
+                       shaping=None):
+    # Imported here rather than at the top so the CLI and GUI start without spotipy or NumPy
+    from spotipy.exceptions import SpotifyException
+    # One download policy per process: a caller's (e.g. the GUI's shared one), else whatever is installed
+    shaping = shaping or download_shaping() or DownloadShaping()
+    set_download_shaping(shaping)
+    base_folder = os.path.join(os.getcwd(), "Downloaded_Music")
+    workers = workers or default_worker_counts()
+    events = events or EventEmitter()
+    if metrics:
+        events.add_listener(metrics)
+    report = RunReport()
+    started_at = time.time()
+    search_cache = SearchCache.for_library(base_folder, force_refresh=refresh_search)
+    manifest = LibraryManifest.for_library(base_folder)
+    metadata = SpotifyMetadata.for_library(sp, base_folder)
+    art_cache = AlbumArtCache.for_library(base_folder)
+    # A caller-supplied analyzer (e.g. the GUI's pre-warmed pool) is shared between runs and left open
+    owns_analyzer = analyze and analyzer is None
+    if owns_analyzer:
+        from src.analysis import AudioAnalyzer
+        analyzer = AudioAnalyzer.for_library(base_folder, workers=workers.get('analyze'))
+    elif not analyze:
+        analyzer = None
+    plans = []
+    journals = {}
+    controller = None
+
+    try:
+        with span(report.spans, 'spotify_playlists'):
+            for playlist_url in playlist_urls:
+                if len(playlist_urls) == 1:
+                    plans.append(prepare_playlist(sp, playlist_url, base_folder, manifest, sync, archive))
+                    continue
+                # In a batch, one bad URL shouldn't sink the other playlists
+                try:
+                    plans.append(prepare_playlist(sp, playlist_url, base_folder, manifest, sync, archive))
+                except (SpotifyException, IndexError) as e:
+                    print(f"❌ Skipping {playlist_url}: {e}")
+        events.emit('run_span', span='spotify_playlists', seconds=report.spans['spotify_playlists'])
+        playlist_label = ", ".join(plan['name'] for plan in plans)
+        tracklists = {plan['folder']: plan['tracklist'] for plan in plans}
+        journals = {plan['folder']: JobJournal.for_playlist(plan['folder']) for plan in plans}
+
+        groups = group_tracks(plans)
+        if not groups:
+            events.emit('playlist_finished', playlist=playlist_label, status='up_to_date', counts={}, elapsed=0)
         else:
-            print(f"⚠️ No file found after fallback for {title} by {artist}")
-            return
+            requested = sum(len(plan['tracks']) for plan in plans)
+            if len(plans) > 1:
+                print(f"🧮 {requested} tracks across {len(plans)} playlists, {len(groups)} unique")
 
-    downloaded_path = normalize_mp3_extension(downloaded_path)
-    tag_mp3(downloaded_path, artist, title, album, genre, year)
+            # One batched pass for genres and audio features instead of several calls per track
+            tracks = [group['track'] for group in groups]
+            with span(report.spans, 'spotify_metadata'):
+                metadata.prime_tracks(tracks)
+                track_info = metadata.fetch([track.get('id') for track in tracks])
+            events.emit('run_span', span='spotify_metadata', seconds=report.spans['spotify_metadata'])
+            print(f"🎧 Spotify metadata: {len(track_info)} tracks resolved, {metadata.requests} requests")
 
-    with writer_lock:
-        writer.writerow([artist, title, yt_url])
+            print(f"🧵 Workers: {workers['search']} search, {workers['download']} download, {workers['transcode']} transcode")
+            events.emit('playlist_started', playlist=playlist_label, total=len(groups))
+            stage_workers = workers
+            if adaptive and session is None:
+                # A private budget the controller can resize; a caller's session is tuned by whoever owns its scheduler
+                session = JobScheduler(workers).create_session(playlist_label)
 
-    print(f"✅ Downloaded and tagged: {os.path.basename(downloaded_path)}")
+                def on_concurrency_change(change):
+                    print(format_change(change))
+                    events.emit('concurrency_changed', pool=change['pool'], level=change['level'],
+                                previous=change['previous'], reason=change['reason'], sample=change['sample'])
+                    progress.set_postfix_str(controller.describe())
 
+                controller = AdaptiveController(session.scheduler, default_limits(workers), throttled=throttled_count,
+                                                on_change=on_concurrency_change)
+                stage_workers = controller.ceilings(workers)
+                events.add_listener(controller.observe)
+                print("🎛️ Adaptive concurrency: " + ", ".join(
+                    f"{pool} {floor}-{ceiling}" for pool, (floor, ceiling) in controller.limits.items()))
 
+            progress = tqdm(total=len(groups), desc="📅 Downloading", disable=not show_progress)
+            if controller:
+                progress.set_postfix_str(controller.describe())
 
-def download_playlist(sp, playlist_url):
-    playlist_id = playlist_url.split("playlist/")[1].split("?")[0]
-    playlist_name = clean_filename(get_playlist_name(sp, playlist_id))
-    base_folder = os.path.join(os.getcwd(), "Downloaded_Music")
-    playlist_folder = os.path.join(base_folder, playlist_name)
-    os.makedirs(playlist_folder, exist_ok=True)
+            def on_stage_start(stage_name, job):
+                job['stage'] = stage_name
+                # Committed before the stage runs, so a killed run restarts the track right here
+                journals[job['folder']].checkpoint(job, stage_name)
+                events.emit('stage_changed', key=job['key'], stage=stage_name)
+
+            def on_stage_done(stage_name, job, elapsed):
+                job['timings'][stage_name] = round(elapsed, 3)
+
+            stages = build_stages(stage_workers, search_cache, manifest, art_cache, stream, analyzer, min_confidence)
+            stage_names = [stage.name for stage in stages]
+
+            def skip_stage(stage_name, job):
+                # Resumed and retried jobs skip the stages whose work is already on disk
+                resume_at = job.get('resume_at')
+                return resume_at is not None and stage_names.index(stage_name) < stage_names.index(resume_at)
+
+            def queue_jobs():
+                for index, group in enumerate(groups):
+                    track = group['track']
+                    job = make_job(track, group['folders'][0], track_info.get(track.get('id')), index, group['folders'][1:],
+                                   output_format, preset)
+                    if journals[job['folder']].restore(job):
+                        job['resume_at'] = resume_point(job, stage_names)
+                        if job['resume_at']:
+                            print(f"⏯️ Resuming {job['safe_name']} at {job['resume_at']}")
+                    events.emit('track_queued', key=job['key'], track_id=job['track_id'], artist=job['artist'], title=job['title'])
+                    yield job
+
+            counts = Counter()
+            reviews = {plan['folder']: [] for plan in plans}
+            if controller:
+                controller.start()
+
+            jobs = queue_jobs()
+            for attempt in range(MAX_RETRIES + 1):
+                pipeline = Pipeline(stages, on_error=on_stage_error, session=session, on_stage_start=on_stage_start,
+                                    on_stage_done=on_stage_done, skip=skip_stage)
+                retries = []
+                # Only this thread writes the CSVs and the journal outcome, so no lock is needed
+                for job in pipeline.run(jobs):
+                    journal = journals[job['folder']]
+                    if job['status'] == 'failed':
+                        job['attempts'] = job.get('attempts', 0) + 1
+                        journal.fail(job)
+                        if attempt < MAX_RETRIES:
+                            retries.append(job)
+                            events.emit('track_retrying', key=job['key'], stage=job['stage'], error=job.get('error'),
+                                        attempt=attempt + 1)
+                            continue
+                    elif job['status'] != 'cancelled':
+                        journal.finish(job['track_id'])
 
-    csv_path = os.path.join(playlist_folder, 'tracklist.csv')
-    writer_lock = multiprocessing.Lock()
+                    progress.update(1)
+                    counts[job['status']] += 1
+                    report.add(job)
+                    emit_job_result(events, job)
+                    if job['status'] in ('done', 'skipped', 'linked'):
+                        youtube_url = job['video']['webpage_url'] if job['status'] == 'done' else None
+                        for folder in job['folders']:
+                            tracklists[folder].add(job['artist'], job['title'], youtube_url, job['track_id'])
+                    elif job['status'] == 'review':
+                        for folder in job['folders']:
+                            reviews[folder].append(job)
 
-    with open(csv_path, 'w', newline='', encoding='utf-8') as csvfile:
-        writer = csv.writer(csvfile)
-        writer.writerow(['Artist', 'Title', 'YouTube URL'])
+                if not retries or (session is not None and session.cancelled):
+                    break
+                delay = RETRY_BACKOFF * 2 ** attempt
+                print(f"🔁 Retrying {len(retries)} failed tracks in {delay}s (attempt {attempt + 2} of {MAX_RETRIES + 1})")
+                wait_for_retry(delay, session)
+                jobs = [requeue_failed(job, stage_names) for job in retries]
 
-        tracks = get_playlist_tracks(sp, playlist_id)
-        print(f"🎵 Found {len(tracks)} tracks in playlist: {playlist_name}")
+            progress.close()
+            if controller:
+                controller.stop()
+                print(f"🎛️ Concurrency: {controller.describe_history()}")
 
-        core_count = multiprocessing.cpu_count()
-        suggested_workers = min(10, core_count * 2)
-        try:
-            max_workers = int(input(f"\n🧐 Detected {core_count} CPU cores. Suggested max threads: {suggested_workers}\nHow many downloads should run in parallel? [Press Enter for suggested]: ") or suggested_workers)
-        except ValueError:
-            max_workers = suggested_workers
+            for plan in plans:
+                report.write(plan['folder'])
+            print_stage_summary(report)
 
-        with ThreadPoolExecutor(max_workers=max_workers) as executor:
-            futures = [
-                executor.submit(process_track, track, playlist_folder, writer_lock, writer)
-                for track in tracks
-            ]
-            for _ in tqdm(as_completed(futures), total=len(futures), desc="📅 Downloading"):
-                pass
+            cancelled = session is not None and session.cancelled
+            events.emit('playlist_finished', playlist=playlist_label, status='cancelled' if cancelled else 'finished',
+                        counts=dict(counts), elapsed=round(time.time() - started_at, 3))
+            if cancelled:
+                print(f"⏹️ Stopped: {playlist_label}")
+                return
+            for folder, deferred in reviews.items():
+                write_review(folder, deferred)
+            if counts['review']:
+                print(f"🤔 {counts['review']} low-confidence matches were not downloaded; see review.csv in each playlist folder")
+
+        for plan in plans:
+            if plan['track_ids'] is not None:
+                save_sync_state(plan['folder'], plan['id'], plan['snapshot_id'], plan['track_ids'])
+        print(f"🗂️ Search cache: {search_cache.hits} hits, {search_cache.misses} misses")
+        if analyzer:
+            print(f"🎚️ Audio analysis: {analyzer.analyzed} analyzed, {analyzer.hits} from cache")
+        if shaping.shaper.bytes:
+            print(shaping.describe())
+        if hasattr(sp, 'rate_limit_stats'):
+            stats = sp.rate_limit_stats()
+            print(f"📡 Spotify API: {stats['calls']} calls, {stats['throttled']} throttled, {stats['retries']} retries, {stats['waited_seconds']}s waiting")
+    finally:
+        for plan in plans:
+            plan['tracklist'].close()
+        for journal in journals.values():
+            journal.close()
+        search_cache.close()
+        manifest.close()
+        metadata.close()
+        art_cache.close()
+        if owns_analyzer:
+            analyzer.close()
+        if controller:
+            controller.stop()
+
+def download_playlist(sp, playlist_url, **options):
+    return download_playlists(sp, [playlist_url], **options)
+
+def read_playlist_file(path):
+    with open(path, encoding='utf-8') as f:
+        return [line.strip() for line in f if line.strip() and not line.strip().startswith('#')]
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Download Spotify playlists as tagged MP3s.")
+    parser.add_argument('urls', nargs='*', help="Spotify playlist URLs")
+    parser.add_argument('-f', '--file', help="text file with one playlist URL per line")
+    parser.add_argument('-w', '--workers', type=int,
+                        help="starting number of parallel downloads (search and transcode pools scale from this)")
+    parser.add_argument('--fixed-workers', action='store_true',
+                        help="keep the worker counts fixed instead of adapting them to throughput, errors and CPU load")
+    parser.add_argument('--sync', action='store_true', help="only process tracks added since the last run")
+    parser.add_argument('--archive', action='store_true', help="with --sync, move removed tracks to an Archive folder")
+    parser.add_argument('--refresh-search', action='store_true', help="ignore cached YouTube search results")
+    parser.add_argument('--format', choices=sorted(OUTPUT_FORMATS), default='mp3',
+                        help="output format; m4a and opus keep YouTube's native audio without re-encoding")
+    parser.add_argument('--preset', choices=sorted(ENCODER_PRESETS), help="encoder preset when re-encoding is needed")
+    parser.add_argument('--stream', action='store_true', help="pipe the stream straight into ffmpeg, no intermediate file")
+    parser.add_argument('--max-bandwidth', type=float, metavar='MB/S',
+                        help="cap the combined download rate of all tracks, in megabytes per second")
+    parser.add_argument('--per-host', type=int, default=DEFAULT_PER_HOST,
+                        help=f"connections allowed to one media host at a time (default: {DEFAULT_PER_HOST})")
+    parser.add_argument('--fragments', type=int, default=DEFAULT_FRAGMENTS,
+                        help=f"parallel fragment requests per file for DASH/HLS formats (default: {DEFAULT_FRAGMENTS})")
+    parser.add_argument('--min-confidence', type=float, default=MIN_CONFIDENCE,
+                        help=f"YouTube matches scoring below this (0-1) are deferred to review.csv (default: {MIN_CONFIDENCE})")
+    parser.add_argument('--no-analysis', action='store_true',
+                        help="skip local BPM/key/loudness analysis (Spotify values are still used)")
+    parser.add_argument('--json-events', metavar='PATH',
+                        help="write progress events as JSON lines to PATH; '-' means stdout, and the log moves to stderr")
+    parser.add_argument('--metrics-port', type=int, metavar='PORT',
+                        help="serve Prometheus metrics at http://127.0.0.1:PORT/metrics during the run")
+    parser.add_argument('--metrics-file', metavar='PATH',
+                        help="write Prometheus metrics to this text file when the run ends")
+    return parser.parse_args(argv)
+
+def open_event_stream(path):
+    if path != '-':
+        return open(path, 'a', encoding='utf-8')
+    # Events get the real stdout; fd 1 is pointed at stderr so every print (ours, yt-dlp's and the
+    # worker processes') lands in the log instead of the JSON stream
+    sys.stdout.flush()
+    stream = os.fdopen(os.dup(sys.stdout.fileno()), 'w', encoding='utf-8')
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+    return stream
 
 if __name__ == "__main__":
+    args = parse_args()
+    event_stream = open_event_stream(args.json_events) if args.json_events else None
+    urls = list(args.urls)
+    if args.file:
+        urls.extend(read_playlist_file(args.file))
+
+    if not urls:
+        # No URLs given: fall back to the interactive prompt
+        urls = [input("Enter Spotify playlist URL: ").strip()]
+
+    from spotipy.exceptions import SpotifyException
+    from src.auth import authenticate_spotipy
     sp = authenticate_spotipy()
-    url = input("Enter Spotify playlist URL: ").strip()
+    workers = default_worker_counts(args.workers)
+    shaping = DownloadShaping(rate=args.max_bandwidth * 1e6 if args.max_bandwidth else None,
+                              per_host=args.per_host, fragments=args.fragments)
+
+    events = EventEmitter(JsonLinesWriter(event_stream)) if event_stream else None
+    metrics = RunMetrics() if args.metrics_port is not None or args.metrics_file else None
+    if args.metrics_port is not None:
+        print(f"📈 Metrics at http://127.0.0.1:{metrics.serve(args.metrics_port)}/metrics")
     try:
-        download_playlist(sp, url)
+        download_playlists(sp, urls, workers, refresh_search=args.refresh_search, sync=args.sync,
+                           archive=args.archive, events=events, output_format=args.format, preset=args.preset,
+                           stream=args.stream, analyze=not args.no_analysis, min_confidence=args.min_confidence,
+                           adaptive=not args.fixed_workers, metrics=metrics, shaping=shaping)
     except SpotifyException as e:
         print(f"❌ Spotify API error: {e}")
     except Exception as e:
-        print(f"❌ General error: {e}")
\ No newline at end of file
+        print(f"❌ General error: {e}")
+    finally:
+        if metrics:
+            if args.metrics_file:
+                metrics.write_textfile(args.metrics_file)
+                print(f"📈 Metrics written to {args.metrics_file}")
+            metrics.close()
+        if event_stream:
+            event_stream.close()
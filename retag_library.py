@@ -0,0 +1,117 @@
+import os
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from tqdm import tqdm
+from mutagen import MutagenError
+from src.auth import authenticate_spotipy
+from src.manifest import LibraryManifest, file_checksum
+from src.spotify_data import SpotifyMetadata
+from src.album_art import AlbumArtCache
+from src.tagging import write_tags, track_data_tags
+from src.analysis import AudioAnalyzer
+
+ART_WORKERS = 8
+
+
+def retag_file(path, tags, art_path=None):
+    # Runs in a worker process; returns (error message or None, checksum of the re-tagged file).
+    # Hashing here keeps it parallel, and hardlinked copies share the one checksum
+    try:
+        art = None
+        if art_path:
+            with open(art_path, 'rb') as f:
+                art = f.read()
+        write_tags(path, tags, art)
+        return None, file_checksum(path)
+    except (MutagenError, OSError) as e:
+        return str(e), None
+
+def group_by_inode(entries):
+    # Hardlinked copies in other playlists share one file; tag it once
+    groups = {}
+    for entry in entries:
+        try:
+            stat = os.stat(entry['path'])
+        except FileNotFoundError:
+            continue
+        groups.setdefault((stat.st_dev, stat.st_ino), []).append(entry)
+    return list(groups.values())
+
+def fetch_art(art_cache, track_data, offline=False):
+    albums = {data['album_spotify_id']: data['album_art_url'] for data in track_data.values() if data['album_spotify_id']}
+    if not offline:
+        with ThreadPoolExecutor(max_workers=ART_WORKERS) as executor:
+            list(executor.map(art_cache.get, albums.keys(), albums.values()))
+    return {album_id: art_cache.cached_path(album_id) for album_id in albums}
+
+def retag_library(root, workers=None, offline=False, art=True, analyze=False):
+    manifest = LibraryManifest.for_library(root)
+    metadata = SpotifyMetadata.for_library(None if offline else authenticate_spotipy(), root)
+    art_cache = AlbumArtCache.for_library(root) if art else None
+    analyzer = AudioAnalyzer.for_library(root, workers=workers) if analyze else None
+    try:
+        groups = group_by_inode(manifest.entries())
+        track_data = metadata.fetch([group[0]['track_id'] for group in groups])
+        art_paths = fetch_art(art_cache, track_data, offline) if art_cache else {}
+        if metadata.requests:
+            print(f"📡 Spotify metadata: {metadata.requests} batched API calls")
+
+        todo = [group for group in groups if group[0]['track_id'] in track_data]
+        skipped = len(groups) - len(todo)
+        analysis = {}
+        if analyzer:
+            paths = [group[0]['path'] for group in todo]
+            print(f"🎚️ Analyzing {len(paths)} files")
+            analysis = dict(zip(paths, analyzer.analyze_many(paths)))
+            print(f"🎚️ Audio analysis: {analyzer.analyzed} analyzed, {analyzer.hits} from cache")
+        print(f"🏷️ Re-tagging {len(todo)} files with {workers} workers")
+
+        retagged = failed = 0
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {}
+            for group in todo:
+                data = track_data[group[0]['track_id']]
+                future = executor.submit(
+                    retag_file, group[0]['path'], track_data_tags(data, analysis.get(group[0]['path'])),
+                    art_paths.get(data['album_spotify_id']),
+                )
+                futures[future] = group
+            for future in tqdm(as_completed(futures), total=len(futures), desc="Re-tagging", unit="file"):
+                group = futures[future]
+                error, checksum = future.result()
+                if error:
+                    failed += 1
+                    print(f"❌ {group[0]['path']}: {error}")
+                    continue
+                retagged += 1
+                # Size and checksum changed with the tag; keep every copy's manifest row in step
+                for entry in group:
+                    manifest.record(entry['track_id'], entry['path'], entry['duration'], checksum=checksum)
+
+        print(f"\n✅ Re-tagged {retagged} files, {failed} failed, {skipped} without Spotify metadata")
+        return retagged
+    finally:
+        metadata.close()
+        manifest.close()
+        if art_cache:
+            art_cache.close()
+        if analyzer:
+            analyzer.close()
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Rewrite tags (BPM, key, ISRC, art...) across an existing library.")
+    parser.add_argument('root', nargs='?', default=os.path.join(os.getcwd(), "Downloaded_Music"),
+                        help="library folder (default: ./Downloaded_Music)")
+    parser.add_argument('-w', '--workers', type=int, default=multiprocessing.cpu_count(),
+                        help="worker processes (default: CPU count)")
+    parser.add_argument('--offline', action='store_true',
+                        help="use only cached Spotify metadata and album art; no network calls")
+    parser.add_argument('--no-art', action='store_true', help="leave embedded cover art as it is")
+    parser.add_argument('--analyze', action='store_true',
+                        help="run local BPM/key/loudness analysis (cached) to fill gaps and add ReplayGain")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    retag_library(args.root, workers=args.workers, offline=args.offline, art=not args.no_art, analyze=args.analyze)
@@ -1,25 +1,161 @@
-import requests
+import io
 import os
-import re
-
-def download_album_art(album_art_url, artist, title):
-    if album_art_url:
-        safe_artist = re.sub(r'[^\w\s-]', '', artist).replace(" ", "_")
-        safe_title = re.sub(r'[^\w\s-]', '', title).replace(" ", "_")
-        directory_path = os.path.join('album_art', safe_artist)
-        if not os.path.exists(directory_path):
-            os.makedirs(directory_path)
-        file_path = os.path.join(directory_path, f"{safe_title}_cover.jpg")
-
-        if not os.path.exists(file_path):  # Check if the file already exists
-            response = requests.get(album_art_url)
-            if response.status_code == 200:
-                with open(file_path, 'wb') as img_file:
-                    img_file.write(response.content)
-                print(f"Album art downloaded: {file_path}")
-        else:
-            print(f"Album art already exists: {file_path}")
-        return file_path
-    else:
-        print("No album art URL provided")
-        return None
\ No newline at end of file
+import threading
+from concurrent.futures import Future
+
+import requests
+from requests.adapters import HTTPAdapter
+from PIL import Image
+
+ART_CACHE_FOLDER = '.album_art'
+DEFAULT_CACHE_BYTES = 512 * 1024 * 1024
+DEFAULT_MAX_SIZE = 600  # pixels on the longest side; None keeps the original
+REQUEST_TIMEOUT = (5, 20)
+
+
+def image_mime(data):
+    return 'image/png' if data[:8] == b'\x89PNG\r\n\x1a\n' else 'image/jpeg'
+
+
+class AlbumArtCache:
+    """Fetches cover art once per album and keeps it in a bounded folder.
+
+    Requests share one pooled HTTP session. When several tracks from the
+    same album ask at the same time, only the first one downloads and the
+    rest wait for its result. The least recently used images are deleted
+    once the folder grows past max_bytes.
+    """
+
+    def __init__(self, cache_dir, max_bytes=DEFAULT_CACHE_BYTES, max_size=DEFAULT_MAX_SIZE, pool_size=16):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.max_size = max_size
+        os.makedirs(cache_dir, exist_ok=True)
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+        self.lock = threading.Lock()
+        self.in_flight = {}
+        self.failed = set()  # albums whose art couldn't be fetched this run
+        self.total_bytes = sum(entry.stat().st_size for entry in os.scandir(cache_dir) if entry.is_file())
+        self.downloads = 0
+        self.hits = 0
+
+    @classmethod
+    def for_library(cls, library_root, **kwargs):
+        return cls(os.path.join(library_root, ART_CACHE_FOLDER), **kwargs)
+
+    def _path(self, album_id):
+        return os.path.join(self.cache_dir, f"{album_id}.img")
+
+    def cached_path(self, album_id):
+        path = self._path(album_id) if album_id else None
+        return path if path and os.path.exists(path) else None
+
+    def get(self, album_id, url):
+        if not album_id or not url:
+            return None
+
+        path = self._path(album_id)
+        data = self._read_cached(path)
+        if data is not None:
+            return data
+
+        with self.lock:
+            if album_id in self.failed:
+                return None
+            future = self.in_flight.get(album_id)
+            owner = future is None
+            if owner:
+                future = self.in_flight[album_id] = Future()
+        if not owner:
+            return future.result()
+
+        try:
+            # Another worker may have saved this album between the cache read and taking the lock
+            data = self._read_cached(path)
+            if data is None:
+                data = self._resize(self._download(url))
+                self._save(path, data)
+        except (requests.RequestException, OSError, Image.DecompressionBombError) as e:
+            # Don't retry for every other track on the same album
+            with self.lock:
+                self.failed.add(album_id)
+            print(f"⚠️ Album art download failed for {album_id}: {e}")
+        finally:
+            with self.lock:
+                del self.in_flight[album_id]
+            future.set_result(data)
+        return data
+
+    def _read_cached(self, path):
+        try:
+            os.utime(path)  # mark as recently used
+            with open(path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        with self.lock:
+            self.hits += 1
+        return data
+
+    def _download(self, url):
+        with self.session.get(url, timeout=REQUEST_TIMEOUT, stream=True) as response:
+            response.raise_for_status()
+            buffer = io.BytesIO()
+            for chunk in response.iter_content(64 * 1024):
+                buffer.write(chunk)
+        self.downloads += 1
+        return buffer.getvalue()
+
+    def _resize(self, data):
+        if not self.max_size:
+            return data
+        try:
+            image = Image.open(io.BytesIO(data))
+            if max(image.size) <= self.max_size:
+                return data
+            image.thumbnail((self.max_size, self.max_size))
+            output = io.BytesIO()
+            image.convert('RGB').save(output, format='JPEG', quality=90)
+            return output.getvalue()
+        except OSError:
+            # Not something Pillow understands; embed it untouched. A DecompressionBombError isn't an
+            # OSError, so it reaches get(), which drops that cover rather than embedding it
+            return data
+
+    def _save(self, path, data):
+        temp_path = path + '.tmp'
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, path)
+        with self.lock:
+            self.total_bytes += len(data)
+            if self.total_bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        entries = sorted(
+            (entry for entry in os.scandir(self.cache_dir) if entry.is_file()),
+            key=lambda entry: entry.stat().st_mtime,
+        )
+        self.total_bytes = sum(entry.stat().st_size for entry in entries)
+        for entry in entries:
+            if self.total_bytes <= self.max_bytes:
+                break
+            self.total_bytes -= entry.stat().st_size
+            os.remove(entry.path)
+
+    def close(self):
+        self.session.close()
+
+
+def download_album_art(album_art_url, album_spotify_id, cache_dir='album_art'):
+    cache = AlbumArtCache(cache_dir)
+    try:
+        return cache.get(album_spotify_id, album_art_url)
+    finally:
+        cache.close()
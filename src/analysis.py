@@ -0,0 +1,323 @@
+import hashlib
+import json
+import mmap
+import multiprocessing
+import os
+import sqlite3
+import subprocess
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from src.integrity import id3v2_size, trailing_tag_size
+from src.manifest import file_checksum
+
+CACHE_FILENAME = '.analysis_cache.sqlite'
+ANALYSIS_VERSION = 1  # bump when the algorithms change so old results are recomputed
+
+SAMPLE_RATE = 22050
+N_FFT = 2048
+HOP = 512
+CHUNK_SECONDS = 10
+MIN_BPM, MAX_BPM = 60, 200
+TEMPO_PRIOR_BPM = 120
+REPLAYGAIN_REFERENCE = -18.0  # LUFS, as in ReplayGain 2.0
+
+# Krumhansl-Schmuckler key profiles, C first
+MAJOR_PROFILE = np.array([6.35, 2.23, 3.48, 2.33, 4.38, 4.09, 2.52, 5.19, 2.39, 3.66, 2.29, 2.88])
+MINOR_PROFILE = np.array([6.33, 2.68, 3.52, 5.38, 2.60, 3.53, 2.54, 4.75, 3.98, 2.69, 3.34, 3.17])
+# 24 rows: the 12 major keys then the 12 minor keys, each standardized for correlation
+KEY_PROFILES = np.stack([np.roll(profile, tonic) for profile in (MAJOR_PROFILE, MINOR_PROFILE) for tonic in range(12)])
+KEY_PROFILES = (KEY_PROFILES - KEY_PROFILES.mean(axis=1, keepdims=True)) / KEY_PROFILES.std(axis=1, keepdims=True) / 12
+
+# BS.1770 K-weighting (pre-filter shelf, then RLB high-pass) as 48 kHz biquads
+K_WEIGHTING = (
+    ((1.53512485958697, -2.69169618940638, 1.19839281085285), (1.0, -1.69065929318241, 0.73248077421585)),
+    ((1.0, -2.0, 1.0), (1.0, -1.99004745483398, 0.99007225036621)),
+)
+
+
+class AnalysisError(Exception):
+    pass
+
+
+def audio_checksum(path):
+    # For MP3s only the frames are hashed, so re-tagging a file keeps its cache entry
+    if not path.lower().endswith('.mp3'):
+        return file_checksum(path)
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        digest.update(data[id3v2_size(data):len(data) - trailing_tag_size(data)])
+    return digest.hexdigest()
+
+
+def decode_chunks(path, ffmpeg='ffmpeg', sample_rate=SAMPLE_RATE, chunk_seconds=CHUNK_SECONDS):
+    """Yields (samples, 2) float32 stereo PCM blocks straight from an ffmpeg pipe."""
+    command = [
+        ffmpeg, '-nostdin', '-loglevel', 'error', '-i', path,
+        '-vn', '-ac', '2', '-ar', str(sample_rate), '-f', 'f32le', '-',
+    ]
+    chunk_bytes = sample_rate * chunk_seconds * 2 * 4
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    try:
+        while True:
+            data = process.stdout.read(chunk_bytes)
+            if not data:
+                break
+            usable = len(data) - len(data) % 8
+            yield np.frombuffer(data[:usable], dtype=np.float32).reshape(-1, 2)
+    finally:
+        process.stdout.close()
+        stderr = process.stderr.read().decode('utf-8', 'replace')
+        process.stderr.close()
+        if process.wait() != 0:
+            raise AnalysisError(stderr.strip() or f"ffmpeg exited with {process.returncode}")
+
+
+def k_weighting_gains(freqs):
+    # Power response of the K-weighting filters at each FFT bin
+    z = np.exp(-2j * np.pi * freqs / 48000)
+    response = np.ones_like(z)
+    for b, a in K_WEIGHTING:
+        response *= (b[0] + b[1] * z + b[2] * z ** 2) / (a[0] + a[1] * z + a[2] * z ** 2)
+    return np.abs(response) ** 2
+
+
+def chroma_map(freqs):
+    # One row per pitch class (C=0), summing the bins between A1 and ~D#8
+    chroma = np.zeros((12, len(freqs)))
+    audible = (freqs >= 55) & (freqs <= 5000)
+    midi = np.round(12 * np.log2(freqs[audible] / 440) + 69).astype(int)
+    chroma[midi % 12, np.flatnonzero(audible)] = 1
+    return chroma
+
+
+class SpectralAccumulator:
+    """Collects what tempo, key and loudness need from a stream of STFT frames.
+
+    Only small per-frame summaries are kept (one onset value and one loudness
+    value per hop, plus a running spectrum), so memory stays flat no matter
+    how long the track is.
+    """
+
+    def __init__(self, sample_rate=SAMPLE_RATE):
+        self.sample_rate = sample_rate
+        self.window = np.hanning(N_FFT).astype(np.float32)
+        freqs = np.fft.rfftfreq(N_FFT, 1 / sample_rate)
+        # Scales a one-sided power spectrum back to the frame's mean square (Parseval)
+        one_sided = np.full(len(freqs), 2.0)
+        one_sided[[0, -1]] = 1.0
+        self.loudness_weights = k_weighting_gains(freqs) * one_sided / (N_FFT * np.sum(self.window ** 2))
+        self.chroma = chroma_map(freqs)
+
+        self.pending = np.zeros((0, 2), dtype=np.float32)
+        self.previous = None
+        self.onsets = []
+        self.energies = []
+        self.spectrum = np.zeros(len(freqs))
+        self.peak = 0.0
+        self.samples = 0
+
+    def add(self, block):
+        self.samples += len(block)
+        if len(block):
+            self.peak = max(self.peak, float(np.abs(block).max()))
+        data = np.concatenate([self.pending, block])
+        count = 1 + (len(data) - N_FFT) // HOP if len(data) >= N_FFT else 0
+        if not count:
+            self.pending = data
+            return
+
+        # (frames, channels, N_FFT) views over the buffer, no copies until the window is applied
+        frames = sliding_window_view(data, N_FFT, axis=0)[::HOP][:count]
+        spectra = np.fft.rfft(frames * self.window, axis=-1)
+        power = np.abs(spectra) ** 2
+        self.energies.append((power @ self.loudness_weights).sum(axis=1))
+
+        magnitude = np.abs(spectra.mean(axis=1))
+        self.spectrum += magnitude.sum(axis=0)
+        log_magnitude = np.log1p(1000 * magnitude)
+        if self.previous is not None:
+            log_magnitude = np.vstack([self.previous, log_magnitude])
+        flux = np.maximum(np.diff(log_magnitude, axis=0), 0).mean(axis=1)
+        self.onsets.append(flux)
+        self.previous = log_magnitude[-1:]
+        self.pending = data[count * HOP:]
+
+    def frame_rate(self):
+        return self.sample_rate / HOP
+
+    def tempo(self):
+        envelope = np.concatenate(self.onsets) if self.onsets else np.zeros(0)
+        fps = self.frame_rate()
+        max_lag = int(60 * fps / MIN_BPM) + 1
+        if len(envelope) < 2 * max_lag:
+            return None
+        envelope = envelope - envelope.mean()
+        size = 1 << int(np.ceil(np.log2(2 * len(envelope))))
+        autocorrelation = np.fft.irfft(np.abs(np.fft.rfft(envelope, size)) ** 2)[:max_lag + 2]
+
+        lags = np.arange(len(autocorrelation), dtype=float)
+        lags[0] = 1
+        bpm = 60 * fps / lags
+        # Log-normal prior around 120 BPM settles the usual half/double tempo ambiguity
+        prior = np.exp(-0.5 * np.log2(bpm / TEMPO_PRIOR_BPM) ** 2)
+        score = np.where((bpm >= MIN_BPM) & (bpm <= MAX_BPM), autocorrelation * prior, -np.inf)
+        best = int(np.argmax(score))
+        if not np.isfinite(score[best]) or score[best] <= 0:
+            return None
+        # Parabolic interpolation for a sub-frame lag
+        if 0 < best < len(score) - 1 and np.isfinite(score[best - 1]) and np.isfinite(score[best + 1]):
+            left, centre, right = score[best - 1], score[best], score[best + 1]
+            denominator = left - 2 * centre + right
+            if denominator:
+                best = best + 0.5 * (left - right) / denominator
+        return round(float(60 * fps / best), 1)
+
+    def key(self):
+        chroma = self.chroma @ self.spectrum
+        if not chroma.any():
+            return None, None
+        # Pearson correlation against all 24 rotated profiles at once
+        chroma = (chroma - chroma.mean()) / chroma.std()
+        best = int(np.argmax(KEY_PROFILES @ chroma))
+        return best % 12, 1 if best < 12 else 0
+
+    def loudness(self):
+        # BS.1770 integrated loudness: 400 ms blocks every 100 ms, absolute then relative gating
+        energies = np.concatenate(self.energies) if self.energies else np.zeros(0)
+        fps = self.frame_rate()
+        block, step = max(1, round(0.4 * fps)), max(1, round(0.1 * fps))
+        if len(energies) < block:
+            return None
+        totals = np.concatenate([[0.0], np.cumsum(energies)])
+        starts = np.arange(0, len(energies) - block + 1, step)
+        blocks = (totals[starts + block] - totals[starts]) / block
+        blocks = blocks[blocks > 0]
+        gated = blocks[-0.691 + 10 * np.log10(blocks) > -70]
+        if not len(gated):
+            return None
+        relative = -0.691 + 10 * np.log10(gated.mean()) - 10
+        gated = gated[-0.691 + 10 * np.log10(gated) > relative]
+        return round(float(-0.691 + 10 * np.log10(gated.mean())), 2)
+
+
+def analyze_file(path, ffmpeg='ffmpeg'):
+    """Tempo, key and loudness for one file; runs in a worker process."""
+    accumulator = SpectralAccumulator()
+    for block in decode_chunks(path, ffmpeg):
+        accumulator.add(block)
+    if not accumulator.samples:
+        raise AnalysisError(f"no audio decoded from {path}")
+
+    key, mode = accumulator.key()
+    loudness = accumulator.loudness()
+    return {
+        'bpm': accumulator.tempo(),
+        'key': key,
+        'mode': mode,
+        'loudness': loudness,
+        'replay_gain': round(REPLAYGAIN_REFERENCE - loudness, 2) if loudness is not None else None,
+        'peak': round(accumulator.peak, 6),
+        'duration': round(accumulator.samples / accumulator.sample_rate, 3),
+    }
+
+
+def worker_ready():
+    # Submitted by AudioAnalyzer.warm: unpickling it makes a fresh worker import this module (and NumPy)
+    return os.getpid()
+
+
+class AudioAnalyzer:
+    """Runs analyze_file in a process pool, memoized by audio checksum.
+
+    Safe to call from many threads at once (e.g. pipeline workers); each call
+    waits for its own result. With a cache_path, results survive between
+    runs, so re-analyzing an unchanged library costs one hash per file.
+    """
+
+    def __init__(self, cache_path=None, workers=None, ffmpeg=None):
+        if ffmpeg is None:
+            from src.youtube import get_ffmpeg_path
+            ffmpeg = get_ffmpeg_path()
+        self.ffmpeg = ffmpeg
+        self.workers = workers or multiprocessing.cpu_count()
+        # Spawned rather than forked: callers are usually full of threads
+        self.executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context('spawn'))
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.analyzed = 0
+
+        self.conn = None
+        if cache_path:
+            self.conn = sqlite3.connect(cache_path, check_same_thread=False)
+            with self.conn:
+                self.conn.execute('''
+                    CREATE TABLE IF NOT EXISTS analysis (
+                        checksum TEXT PRIMARY KEY,
+                        version INTEGER,
+                        data TEXT,
+                        analyzed_at REAL
+                    )
+                ''')
+
+    @classmethod
+    def for_library(cls, library_root, **kwargs):
+        os.makedirs(library_root, exist_ok=True)
+        return cls(os.path.join(library_root, CACHE_FILENAME), **kwargs)
+
+    def _cached(self, checksum):
+        if self.conn is None:
+            return None
+        with self.lock:
+            row = self.conn.execute(
+                'SELECT data FROM analysis WHERE checksum = ? AND version = ?', (checksum, ANALYSIS_VERSION),
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _store(self, checksum, result):
+        if self.conn is None:
+            return
+        with self.lock, self.conn:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO analysis VALUES (?, ?, ?, ?)',
+                (checksum, ANALYSIS_VERSION, json.dumps(result), time.time()),
+            )
+
+    def warm(self):
+        """Starts every worker process now rather than when the first track arrives; returns their pids."""
+        futures = [self.executor.submit(worker_ready) for _ in range(self.workers)]
+        return sorted({future.result() for future in futures})
+
+    def analyze(self, path):
+        return self.analyze_many([path])[0]
+
+    def analyze_many(self, paths):
+        # Cache lookups happen here; only the misses go to the pool, all at once
+        checksums = [audio_checksum(path) for path in paths]
+        results = [self._cached(checksum) for checksum in checksums]
+        futures = {
+            index: self.executor.submit(analyze_file, path, self.ffmpeg)
+            for index, path in enumerate(paths) if results[index] is None
+        }
+        with self.lock:
+            self.hits += len(paths) - len(futures)
+        for index, future in futures.items():
+            try:
+                results[index] = future.result()
+            except (AnalysisError, OSError) as e:
+                # A file that can't be analyzed just keeps whatever tags it has
+                print(f"⚠️ Analysis failed for {os.path.basename(paths[index])}: {e}")
+                continue
+            self._store(checksums[index], results[index])
+            with self.lock:
+                self.analyzed += 1
+        return results
+
+    def close(self):
+        self.executor.shutdown()
+        if self.conn is not None:
+            self.conn.close()
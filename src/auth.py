@@ -1,22 +1,94 @@
 import os
+import hashlib
+import requests
 from dotenv import load_dotenv
 from spotipy.oauth2 import SpotifyClientCredentials
+from spotipy.cache_handler import CacheFileHandler, MemoryCacheHandler
+from spotipy.exceptions import SpotifyException
 import spotipy
 
+from src.rate_limit import TokenBucket
+
 load_dotenv('keys.env')
 
-def authenticate_spotipy():
+DEFAULT_RATE = 10  # requests per second shared by every thread
+DEFAULT_BURST = 20
+MAX_ATTEMPTS = 6
+TOKEN_CACHE_PATH = '.spotify_token'
+
+
+def parse_retry_after(headers):
+    try:
+        return max(0.0, float((headers or {}).get('Retry-After')))
+    except (TypeError, ValueError):
+        return None
+
+
+class ScheduledSpotify(spotipy.Spotify):
+    """spotipy client whose every request goes through a shared TokenBucket.
+
+    The auth manager refreshes the access token whenever it expires. spotipy's
+    own per-session urllib3 retries are disabled; 429 and 5xx responses are
+    retried here instead so that Retry-After pauses every thread at once.
+    """
+
+    def __init__(self, *args, scheduler=None, api_prefix=None, max_attempts=MAX_ATTEMPTS, **kwargs):
+        self.scheduler = scheduler or TokenBucket(DEFAULT_RATE, DEFAULT_BURST)
+        self.max_attempts = max_attempts
+        super().__init__(*args, **kwargs)
+        if api_prefix:
+            self.prefix = api_prefix.rstrip('/') + '/'
+
+    def _build_session(self):
+        self._session = requests.Session()
+
+    def _internal_call(self, method, url, payload, params):
+        for attempt in range(1, self.max_attempts + 1):
+            self.scheduler.acquire()
+            try:
+                result = super()._internal_call(method, url, payload, params)
+            except SpotifyException as e:
+                retryable = e.http_status == 429 or (e.http_status or 0) >= 500
+                if not retryable or attempt == self.max_attempts:
+                    raise
+                self.scheduler.backoff(
+                    parse_retry_after(getattr(e, 'headers', None)),
+                    throttled=e.http_status == 429,
+                )
+                continue
+            self.scheduler.success()
+            return result
+
+    def rate_limit_stats(self):
+        return self.scheduler.stats()
+
+
+def token_cache(client_id, token_url=None, cache_path=TOKEN_CACHE_PATH):
+    # Client-credentials tokens last an hour; keeping them on disk lets back-to-back runs skip the token request
+    if not cache_path or not client_id or token_url:
+        # Tokens from a stub server are never worth keeping
+        return MemoryCacheHandler()
+    suffix = hashlib.sha1(client_id.encode('utf-8')).hexdigest()[:8]
+    return CacheFileHandler(cache_path=f"{cache_path}-{suffix}")
+
+
+def authenticate_spotipy(api_prefix=None, token_url=None, scheduler=None, cache_path=TOKEN_CACHE_PATH):
     client_id = os.getenv('SPOTIPY_CLIENT_ID')
     client_secret = os.getenv('SPOTIPY_CLIENT_SECRET')
+    # Point both at a local stub server for offline testing
+    api_prefix = api_prefix or os.getenv('SPOTIPY_API_PREFIX')
+    token_url = token_url or os.getenv('SPOTIPY_TOKEN_URL')
 
-    # Manually get the token
-    credentials_manager = SpotifyClientCredentials(client_id=client_id, client_secret=client_secret)
-    token_info = credentials_manager.get_access_token(as_dict=True)
-    token = token_info['access_token']
+    # The manager reuses the cached token and fetches a new one when it expires
+    credentials_manager = SpotifyClientCredentials(
+        client_id=client_id, client_secret=client_secret,
+        cache_handler=token_cache(client_id, token_url, cache_path),
+    )
+    if token_url:
+        credentials_manager.OAUTH_TOKEN_URL = token_url
+    token = credentials_manager.get_access_token(as_dict=False)
 
     # Log proof
     print(f"✅ Access token: {token[:10]}... (length: {len(token)})")
 
-    # Manually inject the token into Spotipy
-    sp = spotipy.Spotify(auth=token)
-    return sp
+    return ScheduledSpotify(auth_manager=credentials_manager, api_prefix=api_prefix, scheduler=scheduler)
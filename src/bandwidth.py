@@ -0,0 +1,126 @@
+import threading
+from contextlib import contextmanager
+from urllib.parse import urlparse
+
+from src.rate_limit import TokenBucket
+
+DEFAULT_PER_HOST = 8  # connections to one media host, fragment connections included
+DEFAULT_FRAGMENTS = 4  # parallel fragment requests per file for DASH/HLS formats
+BURST_SECONDS = 1.0
+# Protocols yt-dlp downloads fragment by fragment; plain https formats are one stream
+FRAGMENTED_PROTOCOLS = ('m3u8', 'm3u8_native', 'http_dash_segments', 'dash_frag_urls', 'ism', 'f4m')
+
+
+class HostLimiter:
+    """Caps how many connections run against one host at a time, across every thread."""
+
+    def __init__(self, limit=DEFAULT_PER_HOST):
+        self.limit = max(1, int(limit))
+        self.active = {}
+        self.peak = {}
+        self.waits = 0
+        self.cond = threading.Condition()
+
+    @contextmanager
+    def slot(self, host, connections=1):
+        # A file that needs more connections than the limit still runs, alone
+        connections = min(max(1, connections), self.limit)
+        with self.cond:
+            if self.active.get(host, 0) + connections > self.limit:
+                self.waits += 1
+            while self.active.get(host, 0) + connections > self.limit:
+                self.cond.wait()
+            self.active[host] = self.active.get(host, 0) + connections
+            self.peak[host] = max(self.peak.get(host, 0), self.active[host])
+        try:
+            yield
+        finally:
+            with self.cond:
+                self.active[host] -= connections
+                self.cond.notify_all()
+
+
+class BandwidthShaper:
+    """Global bytes-per-second budget for every download, fed by yt-dlp progress hooks.
+
+    hook() sees each file's running byte count, charges the increase to a
+    shared TokenBucket and blocks the calling downloader thread while the
+    bucket is empty, so the cap holds however many downloads (and fragment
+    threads) are running. Without a rate it only counts bytes.
+    """
+
+    def __init__(self, rate=None, burst_seconds=BURST_SECONDS):
+        self.rate = rate
+        self.bucket = TokenBucket(rate, rate * burst_seconds) if rate else None
+        self.lock = threading.Lock()
+        self.seen = {}
+        self.bytes = 0
+
+    def hook(self, status):
+        if status.get('status') not in ('downloading', 'finished'):
+            return
+        name = status.get('tmpfilename') or status.get('filename')
+        downloaded = status.get('downloaded_bytes') or 0
+        with self.lock:
+            # The first report only sets the baseline: a resumed .part file starts at its old size
+            delta = downloaded - self.seen.get(name, downloaded)
+            if status['status'] == 'finished':
+                self.seen.pop(name, None)
+            else:
+                self.seen[name] = downloaded
+            if delta <= 0:
+                return
+            self.bytes += delta
+        if self.bucket:
+            self.bucket.acquire(delta)
+
+    def waited(self):
+        return self.bucket.stats()['waited_seconds'] if self.bucket else 0.0
+
+
+def media_hosts(info):
+    # Where the selected format(s) actually come from, e.g. an rr---sn-....googlevideo.com edge
+    formats = info.get('requested_formats') or [info]
+    return [urlparse(f.get('url') or info.get('webpage_url') or '').netloc for f in formats]
+
+
+def is_fragmented(info):
+    formats = info.get('requested_formats') or [info]
+    return any(f.get('protocol') in FRAGMENTED_PROTOCOLS or f.get('fragments') for f in formats)
+
+
+class DownloadShaping:
+    """Process-wide download policy: bandwidth cap, per-host connections, fragment concurrency.
+
+    download() resolves the video first, so the media host and protocol
+    are known, then waits for a host slot (one connection per file, or
+    `fragments` for DASH/HLS formats) before yt-dlp starts transferring.
+    """
+
+    def __init__(self, rate=None, per_host=DEFAULT_PER_HOST, fragments=DEFAULT_FRAGMENTS):
+        self.shaper = BandwidthShaper(rate)
+        self.hosts = HostLimiter(per_host)
+        self.fragments = max(1, int(fragments))
+
+    def download(self, ydl, url):
+        ydl.params['concurrent_fragment_downloads'] = self.fragments
+        info = ydl.extract_info(url, download=False)
+        connections = self.fragments if is_fragmented(info) else 1
+        # Merged video+audio formats come from two hosts; the first is the one worth limiting for audio
+        with self.hosts.slot(media_hosts(info)[0], connections):
+            return ydl.process_ie_result(info, download=True)
+
+    def stats(self):
+        return {
+            'bytes': self.shaper.bytes,
+            'rate': self.shaper.rate,
+            'waited_seconds': self.shaper.waited(),
+            'host_waits': self.hosts.waits,
+            'peak_per_host': max(self.hosts.peak.values(), default=0),
+        }
+
+    def describe(self):
+        stats = self.stats()
+        cap = f"capped at {stats['rate'] / 1e6:.1f} MB/s, {stats['waited_seconds']:.0f}s shaping" if stats['rate'] else "uncapped"
+        return (f"🚦 Downloads: {stats['bytes'] / 1e6:.1f} MB {cap}; peak {stats['peak_per_host']} connections per host "
+                f"(limit {self.hosts.limit}, {stats['host_waits']} waits), {self.fragments} fragments per DASH/HLS file")
@@ -0,0 +1,343 @@
+import io
+import os
+import re
+import sqlite3
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from mutagen import MutagenError
+from mutagen.id3 import ID3
+from mutagen.mp4 import MP4
+from mutagen.oggopus import OggOpus
+from tqdm import tqdm
+
+from src.integrity import id3v2_size
+from src.manifest import AUDIO_EXTENSIONS
+from src.tagging import ID3_TEXT_FRAMES, ID3_USER_FRAMES, MP4_TEXT_ATOMS, MP4_FREEFORM_ATOMS, MP4_FREEFORM, VORBIS_FIELDS
+
+CATALOG_FILENAME = '.catalog.sqlite'
+CATALOG_VERSION = 1  # bump when the schema or the tag reading changes; the next scan re-reads everything
+MIN_PARALLEL = 64  # below this many changed files a process pool costs more than it saves
+CHUNK_SIZE = 32
+SKIPPED_FOLDERS = ('Archive',)
+
+COLUMNS = ('path', 'size', 'mtime_ns', 'track_id', 'artist', 'title', 'album', 'genre', 'year', 'bpm', 'key',
+           'camelot', 'energy', 'isrc', 'scanned_at')
+
+PITCH_CLASSES = {'C': 0, 'D': 2, 'E': 4, 'F': 5, 'G': 7, 'A': 9, 'B': 11}
+CAMELOT_PATTERN = re.compile(r'^(1[0-2]|[1-9])([AB])$', re.IGNORECASE)
+KEY_PATTERN = re.compile(r'^([A-G])([#♯b♭]?)\s*(m|min|minor|maj|major)?$', re.IGNORECASE)
+
+
+def parse_key(text):
+    """(pitch class, mode) from a key tag such as 'F#m', 'Bb', 'A minor' or a Camelot code; None if unknown."""
+    text = (text or '').strip()
+    match = CAMELOT_PATTERN.match(text)
+    if match:
+        number, letter = int(match.group(1)), match.group(2).upper()
+        # 8B is C major; each step round the wheel is a fifth
+        major = (7 * (number - 8)) % 12
+        return (major, 1) if letter == 'B' else ((major - 3) % 12, 0)
+    match = KEY_PATTERN.match(text)
+    if not match:
+        return None
+    note, accidental, quality = match.groups()
+    pitch = PITCH_CLASSES[note.upper()] + {'#': 1, '♯': 1, 'b': -1, '♭': -1}.get(accidental, 0)
+    mode = 0 if quality and quality.lower() in ('m', 'min', 'minor') else 1
+    return pitch % 12, mode
+
+
+def camelot(text):
+    # 'Am' -> '8A', 'C' -> '8B'
+    key = parse_key(text)
+    if key is None:
+        return None
+    pitch, mode = key
+    major = pitch if mode == 1 else (pitch + 3) % 12
+    return f"{(7 * major + 7) % 12 + 1}{'B' if mode == 1 else 'A'}"
+
+
+def compatible_keys(code):
+    # The keys a mix from `code` stays in tune with: itself, one step either way, and its relative major/minor
+    match = CAMELOT_PATTERN.match(code or '')
+    if not match:
+        return [code]
+    number, letter = int(match.group(1)), match.group(2).upper()
+    other = 'B' if letter == 'A' else 'A'
+    return [f"{number}{letter}", f"{number % 12 + 1}{letter}", f"{(number - 2) % 12 + 1}{letter}", f"{number}{other}"]
+
+
+def read_id3_header(path):
+    # Only the ID3v2 tag at the front of the file is read, never the MPEG frames behind it
+    with open(path, 'rb') as f:
+        header = f.read(10)
+        size = id3v2_size(header)
+        if not size:
+            return None
+        data = header + f.read(size - len(header))
+    return ID3(io.BytesIO(data), load_v1=False)
+
+
+def read_tags(path):
+    """The tag set write_tags stores, read back as strings (missing fields left out)."""
+    tags = {}
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.mp3':
+        id3 = read_id3_header(path)
+        if id3 is None:
+            return tags
+        for name, frame in ID3_TEXT_FRAMES:
+            if frame.__name__ in id3 and id3[frame.__name__].text:
+                tags[name] = str(id3[frame.__name__].text[0])
+        for name, desc in ID3_USER_FRAMES:
+            key = f'TXXX:{desc}'
+            if key in id3 and id3[key].text:
+                tags[name] = str(id3[key].text[0])
+    elif extension == '.m4a':
+        audio = MP4(path)
+        for name, atom in MP4_TEXT_ATOMS:
+            if atom in (audio.tags or {}):
+                tags[name] = str(audio.tags[atom][0])
+        for name, atom in MP4_FREEFORM_ATOMS:
+            if MP4_FREEFORM + atom in (audio.tags or {}):
+                tags[name] = bytes(audio.tags[MP4_FREEFORM + atom][0]).decode('utf-8', 'replace')
+        if 'tmpo' in (audio.tags or {}):
+            tags['bpm'] = str(audio.tags['tmpo'][0])
+    elif extension == '.opus':
+        audio = OggOpus(path)
+        for name, field in VORBIS_FIELDS:
+            if field in (audio.tags or {}):
+                tags[name] = audio.tags[field][0]
+    return tags
+
+
+def scan_file(path):
+    # Runs in a worker process; returns (tags, error)
+    try:
+        return read_tags(path), None
+    except (MutagenError, OSError, ValueError) as e:
+        return {}, str(e)
+
+
+def _number(value, kind=float):
+    try:
+        return kind(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _year(value):
+    match = re.match(r'\d{4}', value or '')
+    return int(match.group()) if match else None
+
+
+class TagCatalog:
+    """Indexed copy of every file's tags, for queries by BPM, key, genre, year or text.
+
+    Lives next to the manifest and is refreshed by scan(), which re-reads
+    only files whose size or mtime changed since the last scan. Artist,
+    title, album and genre are full-text indexed (FTS5); BPM, Camelot key
+    and year have ordinary indexes.
+    """
+
+    def __init__(self, path, library_root):
+        self.path = path
+        self.library_root = os.path.abspath(library_root)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        with self.conn:
+            self.conn.execute('PRAGMA journal_mode=WAL')
+            if self.conn.execute('PRAGMA user_version').fetchone()[0] != CATALOG_VERSION:
+                self.conn.execute('DROP TABLE IF EXISTS tracks_fts')
+                self.conn.execute('DROP TABLE IF EXISTS tracks')
+                self.conn.execute(f'PRAGMA user_version = {CATALOG_VERSION}')
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS tracks (
+                    id INTEGER PRIMARY KEY,
+                    path TEXT UNIQUE,
+                    size INTEGER,
+                    mtime_ns INTEGER,
+                    track_id TEXT,
+                    artist TEXT,
+                    title TEXT,
+                    album TEXT,
+                    genre TEXT,
+                    year INTEGER,
+                    bpm REAL,
+                    key TEXT,
+                    camelot TEXT,
+                    energy REAL,
+                    isrc TEXT,
+                    scanned_at REAL
+                )
+            ''')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS idx_tracks_bpm ON tracks (bpm)')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS idx_tracks_camelot ON tracks (camelot, bpm)')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS idx_tracks_year ON tracks (year)')
+            # External-content FTS index over the tracks table, kept in step by triggers
+            self.conn.execute('''
+                CREATE VIRTUAL TABLE IF NOT EXISTS tracks_fts USING fts5(
+                    artist, title, album, genre, content='tracks', content_rowid='id',
+                    tokenize='unicode61 remove_diacritics 2'
+                )
+            ''')
+            self.conn.executescript('''
+                CREATE TRIGGER IF NOT EXISTS tracks_ai AFTER INSERT ON tracks BEGIN
+                    INSERT INTO tracks_fts (rowid, artist, title, album, genre)
+                    VALUES (new.id, new.artist, new.title, new.album, new.genre);
+                END;
+                CREATE TRIGGER IF NOT EXISTS tracks_ad AFTER DELETE ON tracks BEGIN
+                    INSERT INTO tracks_fts (tracks_fts, rowid, artist, title, album, genre)
+                    VALUES ('delete', old.id, old.artist, old.title, old.album, old.genre);
+                END;
+                CREATE TRIGGER IF NOT EXISTS tracks_au AFTER UPDATE ON tracks BEGIN
+                    INSERT INTO tracks_fts (tracks_fts, rowid, artist, title, album, genre)
+                    VALUES ('delete', old.id, old.artist, old.title, old.album, old.genre);
+                    INSERT INTO tracks_fts (rowid, artist, title, album, genre)
+                    VALUES (new.id, new.artist, new.title, new.album, new.genre);
+                END;
+            ''')
+
+    @classmethod
+    def for_library(cls, library_root):
+        os.makedirs(library_root, exist_ok=True)
+        return cls(os.path.join(library_root, CATALOG_FILENAME), library_root)
+
+    def walk(self):
+        # (relative path, size, mtime_ns) for every audio file, from directory entries alone
+        stack = [self.library_root]
+        while stack:
+            with os.scandir(stack.pop()) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        if entry.name not in SKIPPED_FOLDERS and not entry.name.startswith('.'):
+                            stack.append(entry.path)
+                    elif entry.name.lower().endswith(AUDIO_EXTENSIONS):
+                        stat = entry.stat()
+                        yield os.path.relpath(entry.path, self.library_root), stat.st_size, stat.st_mtime_ns
+
+    def scan(self, workers=None, full=False, show_progress=True):
+        """Brings the catalog in line with the files on disk; returns counts of what changed."""
+        with self.lock:
+            known = {path: (size, mtime_ns) for path, size, mtime_ns in
+                     self.conn.execute('SELECT path, size, mtime_ns FROM tracks')}
+        files = list(self.walk())
+        changed = [(path, size, mtime_ns) for path, size, mtime_ns in files
+                   if full or known.get(path) != (size, mtime_ns)]
+        removed = set(known) - {path for path, _, _ in files}
+
+        paths = [os.path.join(self.library_root, path) for path, _, _ in changed]
+        if len(paths) >= MIN_PARALLEL and workers != 1:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                results = list(tqdm(executor.map(scan_file, paths, chunksize=CHUNK_SIZE), total=len(paths),
+                                    desc="Reading tags", unit="file", disable=not show_progress))
+        else:
+            results = [scan_file(path) for path in paths]
+
+        rows = []
+        errors = []
+        now = time.time()
+        for (path, size, mtime_ns), (tags, error) in zip(changed, results):
+            if error:
+                # Still recorded, so an unreadable file isn't retried until it changes
+                errors.append((path, error))
+            rows.append((
+                path, size, mtime_ns, tags.get('track_id'), tags.get('artist'), tags.get('title'),
+                tags.get('album'), tags.get('genre'), _year(tags.get('year')), _number(tags.get('bpm')),
+                tags.get('key'), camelot(tags.get('key')), _number(tags.get('energy')), tags.get('isrc'), now,
+            ))
+
+        with self.lock, self.conn:
+            self.conn.executemany(
+                f"INSERT INTO tracks ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))}) "
+                f"ON CONFLICT (path) DO UPDATE SET "
+                + ', '.join(f"{column} = excluded.{column}" for column in COLUMNS[1:]),
+                rows,
+            )
+            self.conn.executemany('DELETE FROM tracks WHERE path = ?', [(path,) for path in removed])
+        return {'files': len(files), 'read': len(rows), 'removed': len(removed), 'errors': errors}
+
+    def query(self, text=None, bpm=None, keys=None, genre=None, year=None, limit=None, order='bpm'):
+        """Matching tracks as dicts.
+
+        text: words matched as prefixes against artist, title, album and
+        genre. bpm and year: (low, high) inclusive ranges, either end may be
+        None. keys: Camelot codes. genre: words matched in the genre only.
+        """
+        clauses, params = [], []
+        match = []
+        if text:
+            match.append(fts_terms(text))
+        if genre:
+            match.append('genre : (' + fts_terms(genre) + ')')
+        if match:
+            clauses.append('id IN (SELECT rowid FROM tracks_fts WHERE tracks_fts MATCH ?)')
+            params.append(' AND '.join(f'({terms})' for terms in match))
+        for column, bounds in (('bpm', bpm), ('year', year)):
+            low, high = bounds or (None, None)
+            if low is not None:
+                clauses.append(f'{column} >= ?')
+                params.append(low)
+            if high is not None:
+                clauses.append(f'{column} <= ?')
+                params.append(high)
+        if keys:
+            clauses.append(f"camelot IN ({', '.join('?' * len(keys))})")
+            params.extend(code.upper() for code in keys)
+
+        sql = 'SELECT * FROM tracks'
+        if clauses:
+            sql += ' WHERE ' + ' AND '.join(clauses)
+        sql += {'bpm': ' ORDER BY bpm, camelot, artist', 'key': ' ORDER BY camelot, bpm, artist',
+                'artist': ' ORDER BY artist, title', 'year': ' ORDER BY year, artist'}[order]
+        if limit:
+            sql += ' LIMIT ?'
+            params.append(limit)
+        with self.lock:
+            cursor = self.conn.execute(sql, params)
+            names = [column[0] for column in cursor.description]
+            rows = cursor.fetchall()
+        tracks = [dict(zip(names, row)) for row in rows]
+        for track in tracks:
+            track['path'] = os.path.join(self.library_root, track['path'])
+        return tracks
+
+    def count(self):
+        with self.lock:
+            return self.conn.execute('SELECT COUNT(*) FROM tracks').fetchone()[0]
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+def fts_terms(text):
+    # Each word as a quoted prefix, so 'hou' finds 'house' and FTS syntax in the input can't break the query
+    words = re.findall(r'\w+', text)
+    return ' '.join(f'"{word}"*' for word in words) or '""'
+
+
+RANGE_PATTERN = re.compile(r'(\d{2,3}(?:\.\d+)?)\s*(?:-|–|—|to)\s*(\d{2,3}(?:\.\d+)?)\s*(?:bpm)?', re.IGNORECASE)
+BPM_PATTERN = re.compile(r'\b(\d{2,3}(?:\.\d+)?)\s*bpm\b', re.IGNORECASE)
+CAMELOT_WORD_PATTERN = re.compile(r'\b(1[0-2]|[1-9])([AB])\b', re.IGNORECASE)
+
+
+def parse_query(text):
+    """Splits a free-form query like '124–128 BPM, 8A, house' into query() arguments."""
+    bpm = keys = None
+    match = RANGE_PATTERN.search(text)
+    if match:
+        bpm = tuple(sorted((float(match.group(1)), float(match.group(2)))))
+        text = text[:match.start()] + ' ' + text[match.end():]
+    else:
+        match = BPM_PATTERN.search(text)
+        if match:
+            bpm = (float(match.group(1)) - 0.5, float(match.group(1)) + 0.5)
+            text = text[:match.start()] + ' ' + text[match.end():]
+    codes = [f"{number}{letter.upper()}" for number, letter in CAMELOT_WORD_PATTERN.findall(text)]
+    if codes:
+        keys = codes
+        text = CAMELOT_WORD_PATTERN.sub(' ', text)
+    text = ' '.join(re.findall(r'\w+', text))
+    return {'text': text or None, 'bpm': bpm, 'keys': keys}
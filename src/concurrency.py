@@ -0,0 +1,192 @@
+import os
+import time
+import threading
+import multiprocessing
+
+INTERVAL = 15.0  # seconds of completions each adjustment is based on
+DECREASE = 0.5  # multiplicative back-off on throttling, errors or a saturated CPU
+MAX_ERROR_RATE = 0.2
+MIN_ERRORS = 2  # a single bad video isn't congestion
+TOLERANCE = 0.1  # throughput within 10% of the last window counts as "not worse"
+CPU_HIGH = 0.9
+CPU_LOW = 0.6
+MAX_DOWNLOAD_SLOTS = 32
+
+
+def default_limits(workers):
+    """(floor, ceiling) per adapted pool, starting from the configured worker counts."""
+    core_count = multiprocessing.cpu_count()
+    return {
+        'download': (1, min(MAX_DOWNLOAD_SLOTS, max(workers['download'] * 2, 4))),
+        'transcode': (1, max(workers['transcode'], core_count * 2)),
+    }
+
+
+def cpu_load():
+    # Run-queue length per core; includes the ffmpeg and analysis processes we spawn
+    try:
+        return os.getloadavg()[0] / multiprocessing.cpu_count()
+    except (AttributeError, OSError):
+        return None
+
+
+class AdaptiveController:
+    """AIMD tuning of the download and transcode slot budgets at runtime.
+
+    Every interval the controller looks at what completed since the last
+    tick (tracks per minute, bytes per second, failures and 429s) and at
+    CPU load:
+
+    - download slots grow by one while they're all busy and throughput
+      holds up, step back one when the last increase made things worse,
+      and are halved when YouTube throttles us or errors pile up;
+    - transcode slots grow by one while work is waiting and the CPU has
+      headroom, and are halved when the CPU is saturated.
+
+    Levels are applied with JobScheduler.set_budget, so stage threads
+    (sized at the ceilings) pick them up without restarting anything.
+    Feed it progress events with observe().
+    """
+
+    def __init__(self, scheduler, limits, interval=INTERVAL, throttled=None, load=cpu_load, on_change=None):
+        self.scheduler = scheduler
+        self.limits = dict(limits)
+        self.interval = interval
+        self.throttled = throttled or (lambda: 0)
+        self.load = load
+        self.on_change = on_change
+        self.lock = threading.Lock()
+        self.history = []
+        self.samples = []
+        self._window = {'finished': 0, 'failed': 0, 'bytes': 0}
+        self._window_started = time.monotonic()
+        self._throttled_seen = self.throttled()
+        self._previous = None
+        self._last_change = {}
+        self._stop = threading.Event()
+        self._thread = None
+        for pool, (floor, ceiling) in self.limits.items():
+            level = min(ceiling, max(floor, scheduler.budgets.get(pool, floor)))
+            scheduler.set_budget(pool, level)
+            self.history.append({'ts': round(time.time(), 3), 'pool': pool, 'level': level, 'reason': 'start'})
+
+    def ceilings(self, workers):
+        # Stage thread counts: enough threads for the highest level the controller may pick
+        return {**workers, **{pool: ceiling for pool, (_, ceiling) in self.limits.items()}}
+
+    def levels(self):
+        return {pool: self.scheduler.budgets[pool] for pool in self.limits}
+
+    def describe(self):
+        return ' · '.join(f"{pool} {level}" for pool, level in self.levels().items())
+
+    def describe_history(self):
+        trail = {}
+        for change in self.history:
+            trail.setdefault(change['pool'], []).append(str(change['level']))
+        return ', '.join(f"{pool} {'→'.join(levels)}" for pool, levels in trail.items())
+
+    def observe(self, event):
+        if event['event'] not in ('track_finished', 'track_failed', 'track_retrying'):
+            return
+        with self.lock:
+            if event['event'] != 'track_finished':
+                self._window['failed'] += 1
+            elif event.get('status') == 'done':
+                # Skipped and linked tracks finish instantly and say nothing about the network
+                self._window['finished'] += 1
+                self._window['bytes'] += event.get('bytes') or 0
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='adaptive-concurrency', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.tick()
+
+    def sample(self):
+        now = time.monotonic()
+        with self.lock:
+            window, self._window = self._window, {'finished': 0, 'failed': 0, 'bytes': 0}
+            elapsed = max(now - self._window_started, 1e-9)
+            self._window_started = now
+        throttled = self.throttled()
+        new_throttles, self._throttled_seen = throttled - self._throttled_seen, throttled
+        attempts = window['finished'] + window['failed']
+        return {
+            'tracks_per_min': round(window['finished'] * 60 / elapsed, 2),
+            'bytes_per_sec': round(window['bytes'] / elapsed),
+            'failed': window['failed'],
+            'error_rate': round(window['failed'] / attempts, 3) if attempts else 0.0,
+            'throttled': new_throttles,
+            'cpu': self.load(),
+            'attempts': attempts,
+        }
+
+    def saturated(self, pool):
+        with self.scheduler.cond:
+            return self.scheduler.in_use.get(pool, 0) >= self.scheduler.budgets[pool]
+
+    def tick(self):
+        sample = self.sample()
+        self.samples.append(sample)
+        if 'download' in self.limits:
+            self._adjust_download(sample)
+        if 'transcode' in self.limits:
+            self._adjust_transcode(sample)
+        if sample['attempts']:
+            self._previous = sample
+
+    def _adjust_download(self, sample):
+        level = self.scheduler.budgets['download']
+        if sample['throttled']:
+            self._set('download', level * DECREASE, f"{sample['throttled']} throttled requests", sample)
+            return
+        if sample['failed'] >= MIN_ERRORS and sample['error_rate'] > MAX_ERROR_RATE:
+            self._set('download', level * DECREASE, f"{sample['error_rate']:.0%} failed", sample)
+            return
+        if not sample['attempts'] or self._previous is None:
+            return
+
+        # Bytes are the better signal when tracks vary in length; fall back to tracks when sizes are unknown
+        metric = 'bytes_per_sec' if sample['bytes_per_sec'] else 'tracks_per_min'
+        current, previous = sample[metric], self._previous[metric]
+        if current < previous * (1 - TOLERANCE) and self._last_change.get('download') == 'increase':
+            self._set('download', level - 1, "no gain from the last increase", sample)
+        elif current >= previous * (1 - TOLERANCE) and self.saturated('download'):
+            self._set('download', level + 1, "throughput holding up", sample)
+
+    def _adjust_transcode(self, sample):
+        if sample['cpu'] is None:
+            return
+        level = self.scheduler.budgets['transcode']
+        if sample['cpu'] > CPU_HIGH:
+            self._set('transcode', level * DECREASE, f"CPU load {sample['cpu']:.2f}", sample)
+        elif sample['cpu'] < CPU_LOW and self.saturated('transcode'):
+            self._set('transcode', level + 1, f"CPU load {sample['cpu']:.2f}", sample)
+
+    def _set(self, pool, level, reason, sample):
+        floor, ceiling = self.limits[pool]
+        previous = self.scheduler.budgets[pool]
+        level = min(ceiling, max(floor, int(level)))
+        if level == previous:
+            return
+        self.scheduler.set_budget(pool, level)
+        self._last_change[pool] = 'increase' if level > previous else 'decrease'
+        change = {'ts': round(time.time(), 3), 'pool': pool, 'level': level, 'previous': previous,
+                  'reason': reason, 'sample': sample}
+        self.history.append(change)
+        if self.on_change:
+            self.on_change(change)
+
+
+def format_change(change):
+    sample = change['sample']
+    return (f"🎛️ {change['pool']} slots {change['previous']} → {change['level']} ({change['reason']}; "
+            f"{sample['tracks_per_min']:.1f} tracks/min, {sample['bytes_per_sec'] / 1e6:.1f} MB/s)")
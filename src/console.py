@@ -0,0 +1,44 @@
+import contextvars
+import sys
+
+_sink = contextvars.ContextVar('console_sink', default=None)
+
+
+class RoutedStream:
+    """Drop-in for sys.stdout/sys.stderr that sends text to a per-context sink.
+
+    Lets several playlists run in one process (e.g. one per GUI session)
+    while each session still sees only its own output. Writes from a
+    context with no sink go to the original stream.
+    """
+
+    def __init__(self, fallback):
+        self.fallback = fallback
+
+    def write(self, text):
+        sink = _sink.get()
+        if sink is None:
+            return self.fallback.write(text)
+        sink(text)
+        return len(text)
+
+    def flush(self):
+        if _sink.get() is None:
+            self.fallback.flush()
+
+    def isatty(self):
+        return False
+
+    def __getattr__(self, name):
+        return getattr(self.fallback, name)
+
+
+def install():
+    if not isinstance(sys.stdout, RoutedStream):
+        sys.stdout = RoutedStream(sys.stdout)
+    if not isinstance(sys.stderr, RoutedStream):
+        sys.stderr = RoutedStream(sys.stderr)
+
+
+def set_sink(sink):
+    _sink.set(sink)
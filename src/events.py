@@ -0,0 +1,39 @@
+import json
+import threading
+import time
+
+
+class EventEmitter:
+    """Fans progress events out to listeners.
+
+    Events are plain dicts with an 'event' name and a 'ts' timestamp:
+    run_span, playlist_started, track_queued, stage_changed,
+    track_retrying, track_finished, track_failed, concurrency_changed and
+    playlist_finished. Listeners may be called from any worker thread, so
+    they should be quick and thread-safe (e.g. put the event on a queue).
+    """
+
+    def __init__(self, *listeners):
+        self.listeners = list(listeners)
+
+    def add_listener(self, listener):
+        self.listeners.append(listener)
+
+    def emit(self, name, **fields):
+        if not self.listeners:
+            return
+        event = {'event': name, 'ts': round(time.time(), 3), **fields}
+        for listener in self.listeners:
+            listener(event)
+
+
+class JsonLinesWriter:
+    def __init__(self, stream):
+        self.stream = stream
+        self.lock = threading.Lock()
+
+    def __call__(self, event):
+        line = json.dumps(event, ensure_ascii=False, default=str)
+        with self.lock:
+            self.stream.write(line + '\n')
+            self.stream.flush()
@@ -0,0 +1,218 @@
+import mmap
+import os
+
+from mutagen import MutagenError, File as MutagenFile
+
+# Bitrates (kbps) for Layer III by [MPEG-1, MPEG-2/2.5] and bitrate index
+BITRATES = (
+    (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 0),
+    (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160, 0),
+)
+SAMPLE_RATES = {3: (44100, 48000, 32000), 2: (22050, 24000, 16000), 0: (11025, 12000, 8000)}
+
+MIN_BITRATE_KBPS = 64
+DURATION_TOLERANCE = 0.05  # 5%, but never less than MIN_DURATION_SLACK seconds
+MIN_DURATION_SLACK = 5.0
+# Problems that mean the file itself is damaged; the rest (bitrate and duration anomalies) are only reported
+FATAL_PROBLEMS = {'unreadable', 'no_frames', 'truncated', 'garbage_tail', 'resync'}
+
+
+def parse_header(data, offset):
+    # Returns (frame_length, samples, sample_rate, bitrate_kbps) for a Layer III header, else None
+    b1, b2 = data[offset + 1], data[offset + 2]
+    if data[offset] != 0xFF or (b1 & 0xE0) != 0xE0:
+        return None
+    version = (b1 >> 3) & 0x3  # 3 = MPEG-1, 2 = MPEG-2, 0 = MPEG-2.5
+    layer = (b1 >> 1) & 0x3  # 1 = Layer III
+    bitrate_index = b2 >> 4
+    rate_index = (b2 >> 2) & 0x3
+    if version == 1 or layer != 1 or bitrate_index in (0, 15) or rate_index == 3:
+        return None
+
+    mpeg1 = version == 3
+    bitrate = BITRATES[0 if mpeg1 else 1][bitrate_index]
+    sample_rate = SAMPLE_RATES[version][rate_index]
+    padding = (b2 >> 1) & 0x1
+    samples = 1152 if mpeg1 else 576
+    frame_length = (144 if mpeg1 else 72) * bitrate * 1000 // sample_rate + padding
+    return frame_length, samples, sample_rate, bitrate
+
+
+def id3v2_size(data):
+    if len(data) < 10 or data[:3] != b'ID3':
+        return 0
+    size = 0
+    for byte in data[6:10]:
+        size = (size << 7) | (byte & 0x7F)
+    footer = 10 if data[5] & 0x10 else 0
+    return 10 + size + footer
+
+
+def trailing_tag_size(data):
+    # ID3v1 and APEv2 tags sit after the last frame and are not garbage
+    end = len(data)
+    if end >= 128 and data[end - 128:end - 125] == b'TAG':
+        end -= 128
+    if end >= 32 and data[end - 32:end - 24] == b'APETAGEX':
+        ape_size = int.from_bytes(data[end - 20:end - 16], 'little')
+        has_header = data[end - 9] & 0x80
+        end -= ape_size + (32 if has_header else 0)
+    return len(data) - max(end, 0)
+
+
+def find_first_frame(data, start, end):
+    # A sync word only counts if another valid header follows where it should
+    offset = data.find(b'\xff', start, end)
+    while 0 <= offset < end - 4:
+        header = parse_header(data, offset)
+        if header:
+            following = offset + header[0]
+            if following + 4 > end or parse_header(data, following):
+                return offset
+        offset = data.find(b'\xff', offset + 1, end)
+    return -1
+
+
+def read_vbr_header(data, offset):
+    # Xing/Info (LAME) or VBRI header inside the first frame: (kind, frames, bytes)
+    b1, b3 = data[offset + 1], data[offset + 3]
+    mpeg1 = ((b1 >> 3) & 0x3) == 3
+    mono = (b3 >> 6) == 3
+    side_info = (17 if mono else 32) if mpeg1 else (9 if mono else 17)
+    xing = offset + 4 + side_info
+    tag = data[xing:xing + 4]
+    if tag in (b'Xing', b'Info'):
+        flags = int.from_bytes(data[xing + 4:xing + 8], 'big')
+        position = xing + 8
+        frames = total_bytes = None
+        if flags & 0x1:
+            frames = int.from_bytes(data[position:position + 4], 'big')
+            position += 4
+        if flags & 0x2:
+            total_bytes = int.from_bytes(data[position:position + 4], 'big')
+        return tag.decode('ascii'), frames, total_bytes
+
+    vbri = offset + 36
+    if data[vbri:vbri + 4] == b'VBRI':
+        total_bytes = int.from_bytes(data[vbri + 10:vbri + 14], 'big')
+        frames = int.from_bytes(data[vbri + 14:vbri + 18], 'big')
+        return 'VBRI', frames, total_bytes
+    return None, None, None
+
+
+def check_mp3(path, expected_duration_ms=None):
+    """Walks every MPEG frame header of an MP3 without decoding any audio."""
+    report = {'path': path, 'problems': [], 'frames': 0, 'duration': 0.0, 'bitrate_kbps': 0}
+    try:
+        size = os.path.getsize(path)
+        if size == 0:
+            report['problems'].append('no_frames')
+            return report
+        with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            walk_frames(data, report)
+    except (OSError, ValueError) as e:
+        report['problems'].append('unreadable')
+        report['error'] = str(e)
+        return report
+
+    compare_duration(report, expected_duration_ms)
+    return report
+
+
+def walk_frames(data, report):
+    start = id3v2_size(data)
+    end = len(data) - trailing_tag_size(data)
+    offset = find_first_frame(data, start, end)
+    if offset < 0:
+        report['problems'].append('no_frames')
+        return
+
+    vbr_kind, vbr_frames, vbr_bytes = read_vbr_header(data, offset)
+    report['vbr_header'] = vbr_kind
+    if vbr_kind:
+        # The header frame carries no audio
+        offset += parse_header(data, offset)[0]
+
+    frames = samples = audio_bytes = resyncs = 0
+    sample_rate = None
+    bitrates = set()
+    while offset + 4 <= end:
+        header = parse_header(data, offset)
+        if header is None:
+            next_frame = find_first_frame(data, offset + 1, end)
+            if next_frame < 0:
+                break
+            resyncs += 1
+            offset = next_frame
+            continue
+        frame_length, frame_samples, sample_rate, bitrate = header
+        if offset + frame_length > end:
+            report['problems'].append('truncated')
+            break
+        frames += 1
+        samples += frame_samples
+        audio_bytes += frame_length
+        bitrates.add(bitrate)
+        offset += frame_length
+
+    tail = end - offset
+    report.update({
+        'frames': frames,
+        'duration': samples / sample_rate if sample_rate else 0.0,
+        'audio_bytes': audio_bytes,
+        'tail_bytes': max(tail, 0),
+        'resyncs': resyncs,
+    })
+    if not frames:
+        report['problems'].append('no_frames')
+        return
+
+    report['bitrate_kbps'] = round(audio_bytes * 8 / report['duration'] / 1000) if report['duration'] else 0
+    if resyncs:
+        report['problems'].append('resync')
+    # Anything after the last frame that isn't a known tag, beyond a partial frame's worth
+    if tail > 4 and 'truncated' not in report['problems']:
+        report['problems'].append('garbage_tail')
+    if vbr_frames and frames < vbr_frames * 0.99 and 'truncated' not in report['problems']:
+        report['problems'].append('truncated')
+    if vbr_kind in ('Xing', 'VBRI'):
+        return
+    # Constant bitrate streams should be exactly that, and at a sensible rate
+    if report['bitrate_kbps'] < MIN_BITRATE_KBPS:
+        report['problems'].append('low_bitrate')
+    if len(bitrates) > 1:
+        report['problems'].append('bitrate_mismatch')
+
+
+def compare_duration(report, expected_duration_ms):
+    if not expected_duration_ms or not report['duration']:
+        return
+    expected = expected_duration_ms / 1000
+    report['expected_duration'] = expected
+    if abs(report['duration'] - expected) > max(MIN_DURATION_SLACK, expected * DURATION_TOLERANCE):
+        report['problems'].append('duration_mismatch')
+
+
+def check_other(path, expected_duration_ms=None):
+    # M4A and Opus have no frame walker; fall back to the container's own length
+    report = {'path': path, 'problems': [], 'frames': 0, 'duration': 0.0, 'bitrate_kbps': 0}
+    try:
+        audio = MutagenFile(path)
+        report['duration'] = audio.info.length if audio is not None else 0.0
+    except (MutagenError, OSError) as e:
+        report['error'] = str(e)
+    if not report['duration']:
+        report['problems'].append('unreadable')
+        return report
+    compare_duration(report, expected_duration_ms)
+    return report
+
+
+def check_file(path, expected_duration_ms=None):
+    if path.lower().endswith('.mp3'):
+        return check_mp3(path, expected_duration_ms)
+    return check_other(path, expected_duration_ms)
+
+
+def is_broken(report):
+    return bool(FATAL_PROBLEMS.intersection(report['problems']))
@@ -0,0 +1,133 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+JOURNAL_FILENAME = '.jobs.sqlite'
+# Everything a job needs to pick up after the match stage without searching or downloading again
+RESUME_FIELDS = (
+    'video', 'match', 'raw_path', 'path', 'duration', 'output_format', 'extension',
+    'bpm', 'musical_key', 'mode', 'loudness', 'replay_gain', 'replay_peak',
+)
+STAGE_ORDER = ('search', 'match', 'download', 'transcode', 'analyze', 'art', 'tag')
+RESUMABLE_STAGES = STAGE_ORDER[2:]
+# Which job fields each stage needs from the ones before it
+STAGE_INPUTS = {
+    'match': ('candidates',),
+    'download': ('video',),
+    'transcode': ('raw_path',),
+    'analyze': ('path',),
+    'art': ('path',),
+    'tag': ('path',),
+}
+
+
+def resume_point(job, stage_names):
+    """The stage a restored or retried job should restart at, or None to run it from the top.
+
+    Walks back from the recorded stage while its inputs are missing, e.g. a
+    failed transcode whose raw download was already removed restarts at the
+    download, which yt-dlp resumes from the .part file.
+    """
+    stage = job.get('resume_stage')
+    if stage not in STAGE_ORDER:
+        return None
+    # A stage this run doesn't have (transcode with --stream) maps to the next one it does
+    later = [name for name in STAGE_ORDER[STAGE_ORDER.index(stage):] if name in stage_names]
+    if not later:
+        return None
+    index = stage_names.index(later[0])
+    while index > 0:
+        inputs = STAGE_INPUTS.get(stage_names[index], ())
+        present = all(job.get(field) for field in inputs)
+        paths = [job[field] for field in inputs if field.endswith('path')]
+        if present and all(os.path.exists(path) for path in paths):
+            return stage_names[index]
+        index -= 1
+    return None
+
+
+class JobJournal:
+    """Per-playlist record of every unfinished track and the stage it reached.
+
+    Each stage start is committed before the stage runs, so after a crash
+    or a killed run the next run restarts every track at the stage it was
+    in. Rows are removed once a track is finished; failed tracks keep
+    their row (with the attempt count and error) until they succeed.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        with self.conn:
+            self.conn.execute('PRAGMA journal_mode=WAL')
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS jobs (
+                    track_id TEXT PRIMARY KEY,
+                    stage TEXT,
+                    status TEXT,
+                    attempts INTEGER,
+                    error TEXT,
+                    data TEXT,
+                    updated_at REAL
+                )
+            ''')
+
+    @classmethod
+    def for_playlist(cls, playlist_folder):
+        return cls(os.path.join(playlist_folder, JOURNAL_FILENAME))
+
+    def _write(self, job, stage, status):
+        data = {field: job[field] for field in RESUME_FIELDS if job.get(field) is not None}
+        with self.lock, self.conn:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO jobs VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (job['track_id'], stage, status, job.get('attempts', 0), job.get('error'),
+                 json.dumps(data, ensure_ascii=False), time.time()),
+            )
+
+    def checkpoint(self, job, stage):
+        # Search and match are cheap to redo from the search cache; only later stages are worth a write
+        if job['track_id'] and stage in RESUMABLE_STAGES:
+            self._write(job, stage, 'running')
+
+    def fail(self, job):
+        if job['track_id']:
+            self._write(job, job['stage'], 'failed')
+
+    def finish(self, track_id):
+        if not track_id:
+            return
+        with self.lock, self.conn:
+            self.conn.execute('DELETE FROM jobs WHERE track_id = ?', (track_id,))
+
+    def restore(self, job):
+        # Copies what the last run got done back into a fresh job; returns the recorded stage
+        if not job['track_id']:
+            return None
+        with self.lock:
+            row = self.conn.execute(
+                'SELECT stage, attempts, data FROM jobs WHERE track_id = ?', (job['track_id'],),
+            ).fetchone()
+        if row is None:
+            return None
+        stage, attempts, data = row
+        data = json.loads(data)
+        if data.get('extension', job['extension']) != job['extension']:
+            # Output format changed since; the matched video is still good, the files aren't
+            data = {field: data[field] for field in ('video', 'match') if field in data}
+            stage = 'download'
+        job.update(data)
+        job['attempts'] = attempts
+        job['resume_stage'] = stage
+        return stage
+
+    def pending(self):
+        with self.lock:
+            return self.conn.execute('SELECT COUNT(*) FROM jobs').fetchone()[0]
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
@@ -0,0 +1,183 @@
+import hashlib
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+from mutagen import MutagenError, File as MutagenFile
+
+MANIFEST_FILENAME = '.manifest.sqlite'
+TRACK_ID_TAG = 'TXXX:SPOTIFY_TRACK_ID'
+# Where each tag format keeps the track id: ID3, MP4 freeform atom, Vorbis comment
+TRACK_ID_KEYS = (TRACK_ID_TAG, '----:com.apple.iTunes:SPOTIFY_TRACK_ID', 'spotify_track_id')
+AUDIO_EXTENSIONS = ('.mp3', '.m4a', '.opus')
+
+
+def file_checksum(path, chunk_size=1 << 20):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def read_track_id(tags):
+    if tags is None:
+        return None
+    for key in TRACK_ID_KEYS:
+        if key in tags:
+            value = tags[key]
+            value = value.text[0] if hasattr(value, 'text') else value[0]
+            return value.decode('utf-8') if isinstance(value, bytes) else str(value)
+    return None
+
+
+def read_track_info(path):
+    # Returns (spotify_track_id, duration_seconds) straight from the file's tags
+    try:
+        audio = MutagenFile(path)
+    except MutagenError:
+        return None, None
+    if audio is None:
+        return None, None
+    return read_track_id(audio.tags), audio.info.length
+
+
+class LibraryManifest:
+    """Index of every downloaded file in a library, keyed by Spotify track id.
+
+    Paths are stored relative to the library root so the whole
+    Downloaded_Music folder can be moved. The index can always be rebuilt
+    from the SPOTIFY_TRACK_ID tag written into each file.
+    """
+
+    def __init__(self, path, library_root):
+        self.path = path
+        self.library_root = os.path.abspath(library_root)
+        self.lock = threading.Lock()
+
+        is_new = not os.path.exists(path)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        with self.conn:
+            self.conn.execute('PRAGMA journal_mode=WAL')
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS files (
+                    path TEXT PRIMARY KEY,
+                    track_id TEXT,
+                    folder TEXT,
+                    size INTEGER,
+                    duration REAL,
+                    checksum TEXT,
+                    mtime REAL,
+                    added_at REAL
+                )
+            ''')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS idx_files_track ON files (track_id, folder)')
+
+        if is_new:
+            self.rebuild()
+
+    @classmethod
+    def for_library(cls, library_root):
+        os.makedirs(library_root, exist_ok=True)
+        return cls(os.path.join(library_root, MANIFEST_FILENAME), library_root)
+
+    def _relative(self, path):
+        return os.path.relpath(os.path.abspath(path), self.library_root)
+
+    def _row_to_entry(self, row):
+        path, track_id, folder, size, duration, checksum, mtime, added_at = row
+        return {
+            'path': os.path.join(self.library_root, path),
+            'track_id': track_id,
+            'folder': os.path.join(self.library_root, folder),
+            'size': size,
+            'duration': duration,
+            'checksum': checksum,
+            'mtime': mtime,
+        }
+
+    def lookup(self, track_id, folder):
+        if not track_id:
+            return None
+        with self.lock:
+            row = self.conn.execute(
+                'SELECT * FROM files WHERE track_id = ? AND folder = ? LIMIT 1',
+                (track_id, self._relative(folder)),
+            ).fetchone()
+        if row is None:
+            return None
+
+        entry = self._row_to_entry(row)
+        if not os.path.exists(entry['path']):
+            # Deleted behind our back; forget it so the track is fetched again
+            self.remove(entry['path'])
+            return None
+        return entry
+
+    def find_any(self, track_id):
+        # Any copy of the track anywhere in the library, e.g. in another playlist
+        if not track_id:
+            return None
+        with self.lock:
+            rows = self.conn.execute('SELECT * FROM files WHERE track_id = ?', (track_id,)).fetchall()
+        for row in rows:
+            entry = self._row_to_entry(row)
+            if os.path.exists(entry['path']):
+                return entry
+        return None
+
+    def entries(self):
+        with self.lock:
+            rows = self.conn.execute('SELECT * FROM files').fetchall()
+        return [self._row_to_entry(row) for row in rows]
+
+    def record(self, track_id, path, duration=None, checksum=None):
+        # Callers that already hashed the file (or a hardlink of it) pass the checksum in
+        stat = os.stat(path)
+        relative = self._relative(path)
+        checksum = checksum or file_checksum(path)
+        with self.lock, self.conn:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (
+                    relative, track_id, os.path.dirname(relative),
+                    stat.st_size, duration, checksum,
+                    stat.st_mtime, time.time(),
+                ),
+            )
+
+    def remove(self, path):
+        with self.lock, self.conn:
+            self.conn.execute('DELETE FROM files WHERE path = ?', (self._relative(path),))
+
+    def rebuild(self):
+        count = 0
+        with self.lock, self.conn:
+            self.conn.execute('DELETE FROM files')
+        for dirpath, _, filenames in os.walk(self.library_root):
+            for filename in filenames:
+                if not filename.lower().endswith(AUDIO_EXTENSIONS):
+                    continue
+                path = os.path.join(dirpath, filename)
+                track_id, duration = read_track_info(path)
+                if track_id:
+                    self.record(track_id, path, duration)
+                    count += 1
+        print(f"📒 Manifest rebuilt: {count} tracks indexed in {self.library_root}")
+        return count
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+if __name__ == "__main__":
+    # python -m src.manifest [library_root]
+    root = sys.argv[1] if len(sys.argv) > 1 else os.path.join(os.getcwd(), "Downloaded_Music")
+    existed = os.path.exists(os.path.join(root, MANIFEST_FILENAME))
+    manifest = LibraryManifest.for_library(root)
+    if existed:
+        manifest.rebuild()
+    manifest.close()
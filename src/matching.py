@@ -0,0 +1,159 @@
+import re
+import unicodedata
+
+MIN_CONFIDENCE = 0.5
+DURATION_SCALE = 10.0  # seconds; a candidate this far off keeps ~37% of the duration score
+
+WEIGHTS = {
+    'duration': 0.35,
+    'title': 0.30,
+    'artist': 0.20,
+    'topic': 0.10,
+    'official_channel': 0.05,
+}
+PENALTY = 0.30  # per unwanted keyword, e.g. 'live' when the Spotify title isn't a live version
+
+# Unigrams, plus bigrams joined with '_' (tokenize emits both)
+PENALTY_KEYWORDS = {
+    'live', 'remix', 'cover', 'performance', 'music_video', 'sped_up', 'slowed', 'reverb',
+    'nightcore', '8d', 'shorts', 'karaoke', 'instrumental', 'reaction', 'tutorial', 'lesson',
+}
+# Noise that shouldn't count towards (or against) title similarity
+IGNORED_TOKENS = {
+    'the', 'a', 'feat', 'ft', 'featuring', 'official', 'audio', 'video', 'lyrics', 'lyric', 'hd', 'hq', '4k',
+    'remastered', 'remaster', 'version', 'radio', 'edit', 'mv', 'visualizer', 'explicit', 'clean',
+}
+
+
+def tokenize(text):
+    # Fold accents (Beyoncé -> beyonce) but keep non-Latin scripts intact
+    text = ''.join(c for c in unicodedata.normalize('NFKD', text or '') if not unicodedata.combining(c))
+    words = re.findall(r'\w+', text.lower().replace('&', ' and '))
+    return set(words) | {f"{a}_{b}" for a, b in zip(words, words[1:])}
+
+
+def _significant(tokens):
+    return {token for token in tokens if '_' not in token and token not in IGNORED_TOKENS}
+
+
+class _Vocabulary(dict):
+    def ids(self, tokens):
+        return [self.setdefault(token, len(self)) for token in tokens]
+
+
+def _pairs(groups, vocabulary):
+    # [(owner, {tokens})] -> parallel owner and token-id arrays, one row per distinct pair
+    import numpy as np
+    owners, tokens = [], []
+    for owner, group in groups:
+        ids = vocabulary.ids(group)
+        owners.extend([owner] * len(ids))
+        tokens.extend(ids)
+    return np.array(owners, dtype=np.int64), np.array(tokens, dtype=np.int64)
+
+
+def score_candidates(tracks, candidate_lists):
+    """Scores every YouTube candidate of every track in one vectorized pass.
+
+    tracks: dicts with 'title', 'artists' (names) and 'duration_ms'.
+    candidate_lists: one list of search results per track ('title',
+    'duration' in seconds, and 'channel' when known).
+
+    Returns one (scores, details) pair per track: a score in [0, 1] for each
+    of its candidates and the per-signal arrays behind them.
+    """
+    # NumPy is imported on first use so importing the downloader stays cheap
+    import numpy as np
+    vocabulary = _Vocabulary()
+    segments = np.repeat(np.arange(len(tracks)), [len(c) for c in candidate_lists])
+    candidates = [candidate for candidate_list in candidate_lists for candidate in candidate_list]
+
+    track_titles = [tokenize(track['title']) for track in tracks]
+    title_owners, title_tokens = _pairs(((i, _significant(t)) for i, t in enumerate(track_titles)), vocabulary)
+    artist_owners, artist_tokens = _pairs(
+        ((i, _significant(set().union(*map(tokenize, track['artists'])))) for i, track in enumerate(tracks)), vocabulary,
+    )
+    # Anything in the Spotify title (a real remix, a live album) isn't penalized
+    allowed_owners, allowed_tokens = _pairs(enumerate(track_titles), vocabulary)
+
+    candidate_titles = [tokenize(candidate.get('title')) for candidate in candidates]
+    channels = [(candidate.get('channel') or '') for candidate in candidates]
+    text_owners, text_tokens = _pairs(enumerate(candidate_titles), vocabulary)
+    full_owners, full_tokens = _pairs(
+        ((i, title | tokenize(channel)) for i, (title, channel) in enumerate(zip(candidate_titles, channels))), vocabulary,
+    )
+    channel_owners, channel_tokens = _pairs(((i, tokenize(channel)) for i, channel in enumerate(channels)), vocabulary)
+
+    size = len(vocabulary)
+    count = len(candidates)
+
+    def keys(owners, tokens):
+        return owners * size + tokens
+
+    def hits(owners, tokens, reference_keys):
+        # How many of each candidate's tokens appear in its own track's reference set
+        if not len(owners):
+            return np.zeros(count)
+        matched = np.isin(keys(segments[owners], tokens), reference_keys)
+        return np.bincount(owners[matched], minlength=count).astype(float)
+
+    title_counts = np.bincount(title_owners, minlength=len(tracks)).astype(float)
+    artist_counts = np.bincount(artist_owners, minlength=len(tracks)).astype(float)
+    title_keys = keys(title_owners, title_tokens)
+    artist_keys = keys(artist_owners, artist_tokens)
+    allowed_keys = keys(allowed_owners, allowed_tokens)
+
+    def recall(found, wanted, default):
+        # Share of the track's tokens a candidate contains; default when the track has none
+        wanted = wanted[segments]
+        return np.divide(found, wanted, out=np.full(count, default), where=wanted > 0)
+
+    title_recall = recall(hits(text_owners, text_tokens, title_keys), title_counts, 1.0)
+    artist_recall = recall(hits(full_owners, full_tokens, artist_keys), artist_counts, 1.0)
+    channel_artist = recall(hits(channel_owners, channel_tokens, artist_keys), artist_counts, 0.0)
+
+    penalty_ids = np.array([vocabulary[token] for token in PENALTY_KEYWORDS if token in vocabulary], dtype=np.int64)
+    unwanted = np.isin(text_tokens, penalty_ids) & ~np.isin(keys(segments[text_owners], text_tokens), allowed_keys)
+    penalties = np.bincount(text_owners[unwanted], minlength=count).astype(float)
+
+    expected = np.array([(track.get('duration_ms') or 0) / 1000 for track in tracks])[segments]
+    actual = np.array([candidate.get('duration') or 0 for candidate in candidates], dtype=float)
+    delta = np.abs(actual - expected)
+    duration_score = np.where(expected > 0, np.exp(-delta / DURATION_SCALE), 0.5)
+    duration_score = np.where(actual > 0, duration_score, 0.0)
+
+    lowered = np.array([channel.lower() for channel in channels], dtype=object)
+    topic = np.array([channel.endswith(' - topic') for channel in lowered], dtype=float)
+    official_channel = np.maximum(
+        (channel_artist >= 1).astype(float), np.array(['vevo' in channel for channel in lowered], dtype=float),
+    )
+
+    scores = (
+        WEIGHTS['duration'] * duration_score
+        + WEIGHTS['title'] * title_recall
+        + WEIGHTS['artist'] * artist_recall
+        + WEIGHTS['topic'] * topic
+        + WEIGHTS['official_channel'] * official_channel
+        - PENALTY * penalties
+    )
+    scores = np.clip(scores, 0, 1)
+
+    bounds = np.cumsum([0] + [len(c) for c in candidate_lists])
+    return [
+        (scores[start:end], {'duration_delta': delta[start:end], 'penalties': penalties[start:end]})
+        for start, end in zip(bounds[:-1], bounds[1:])
+    ]
+
+
+def select_matches(tracks, candidate_lists, min_confidence=MIN_CONFIDENCE):
+    """Best candidate per track: (candidate or None, confidence, duration_delta, accepted)."""
+    import numpy as np
+    matches = []
+    for candidate_list, (scores, details) in zip(candidate_lists, score_candidates(tracks, candidate_lists)):
+        if not len(scores):
+            matches.append((None, 0.0, None, False))
+            continue
+        best = int(np.argmax(scores))
+        confidence = round(float(scores[best]), 3)
+        matches.append((candidate_list[best], confidence, float(details['duration_delta'][best]), confidence >= min_confidence))
+    return matches
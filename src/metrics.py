@@ -0,0 +1,232 @@
+import csv
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+REPORT_JSON = 'run_report.json'
+REPORT_CSV = 'run_report.csv'
+REPORT_HEADER = ['Spotify ID', 'Artist', 'Title', 'Status', 'Stage', 'Elapsed (s)', 'Download Bytes',
+                 'Download MB/s', 'Spans']
+SECONDS_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+METRIC_PREFIX = 'dj_library'
+
+
+@contextmanager
+def span(spans, name):
+    # Records the wall time of the block as spans[name], e.g. in a job's 'timings'; a retry overwrites it
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        spans[name] = round(time.perf_counter() - started, 3)
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class Histogram:
+    def __init__(self, buckets=SECONDS_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+
+
+class RunMetrics:
+    """Counters and histograms fed from progress events, in Prometheus text format.
+
+    Add it as an EventEmitter listener. render() gives the exposition text,
+    write_textfile() saves it for node_exporter's textfile collector (or
+    for diffing two runs), and serve() exposes it at /metrics while a run
+    is going.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+        self.server = None
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def __call__(self, event):
+        name = event['event']
+        if name in ('track_finished', 'track_failed'):
+            self.inc('tracks_total', status=event['status'])
+            self.observe('track_duration_seconds', event['elapsed'])
+            for name, seconds in (event.get('timings') or {}).items():
+                self.observe('span_duration_seconds', seconds, span=name)
+            if event.get('download_bytes'):
+                self.inc('download_bytes_total', event['download_bytes'])
+        elif name == 'track_retrying':
+            self.inc('retries_total', stage=event['stage'])
+        elif name == 'concurrency_changed':
+            self.inc('concurrency_changes_total', pool=event['pool'])
+        elif name == 'run_span':
+            self.observe('run_span_seconds', event['seconds'], span=event['span'])
+
+    def render(self):
+        lines = []
+        typed = set()
+
+        def declare(name, kind):
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {METRIC_PREFIX}_{name} {kind}")
+
+        with self.lock:
+            for (name, labels), value in sorted(self.counters.items()):
+                declare(name, 'counter')
+                lines.append(f"{METRIC_PREFIX}_{name}{_labels(labels)} {value}")
+            for (name, labels), histogram in sorted(self.histograms.items()):
+                declare(name, 'histogram')
+                # observe() already counts each value into every bucket it fits, so these are cumulative
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    lines.append(f"{METRIC_PREFIX}_{name}_bucket{_labels(labels + (('le', bound),))} {count}")
+                lines.append(f"{METRIC_PREFIX}_{name}_bucket{_labels(labels + (('le', '+Inf'),))} {histogram.count}")
+                lines.append(f"{METRIC_PREFIX}_{name}_sum{_labels(labels)} {round(histogram.sum, 6)}")
+                lines.append(f"{METRIC_PREFIX}_{name}_count{_labels(labels)} {histogram.count}")
+        return '\n'.join(lines) + '\n'
+
+    def write_textfile(self, path):
+        temp_path = path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            f.write(self.render())
+        os.replace(temp_path, path)
+
+    def serve(self, port, host='127.0.0.1'):
+        # Only --metrics-port runs need the HTTP server, so it isn't imported with the module
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=self.server.serve_forever, name='metrics-http', daemon=True).start()
+        return self.server.server_address[1]
+
+    def close(self):
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{value}"' for name, value in labels) + '}'
+
+
+class RunReport:
+    """Per-track timing spans for one run, written next to each playlist's tracklist.csv."""
+
+    def __init__(self):
+        self.started_at = time.time()
+        self.spans = {}
+        self.tracks = []
+
+    def add(self, job):
+        timings = job['timings']
+        download_bytes = job.get('download_bytes')
+        download_seconds = timings.get('download')
+        self.tracks.append({
+            'track_id': job['track_id'],
+            'artist': job['artist'],
+            'title': job['title'],
+            'status': job['status'],
+            'stage': job['stage'],
+            'elapsed': round(time.time() - job['queued_at'], 3),
+            'download_bytes': download_bytes,
+            'download_mb_per_sec': round(download_bytes / download_seconds / 1e6, 3)
+            if download_bytes and download_seconds else None,
+            # 'attempts' counts failures; a track that finished also made one successful try
+            'attempts': job.get('attempts', 0) + (job['status'] != 'failed'),
+            'spans': dict(timings),
+            'folders': job['folders'],
+        })
+
+    def summary(self, tracks):
+        stages = {}
+        for track in tracks:
+            for name, seconds in track['spans'].items():
+                stages.setdefault(name, []).append(seconds)
+        counts = {}
+        for track in tracks:
+            counts[track['status']] = counts.get(track['status'], 0) + 1
+        return {
+            'started_at': round(self.started_at, 3),
+            'elapsed': round(time.time() - self.started_at, 3),
+            'counts': counts,
+            'run_spans': self.spans,
+            'download_bytes': sum(track['download_bytes'] or 0 for track in tracks),
+            'stages': {
+                name: {
+                    'count': len(values),
+                    'total': round(sum(values), 3),
+                    'p50': percentile(values, 0.5),
+                    'p95': percentile(values, 0.95),
+                    'max': max(values),
+                }
+                for name, values in sorted(stages.items())
+            },
+        }
+
+    def write(self, playlist_folder):
+        tracks = [track for track in self.tracks if playlist_folder in track['folders']]
+        report = {'summary': self.summary(tracks), 'tracks': [
+            {name: value for name, value in track.items() if name != 'folders'} for track in tracks
+        ]}
+        json_path = os.path.join(playlist_folder, REPORT_JSON)
+        with open(json_path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        os.replace(json_path + '.tmp', json_path)
+
+        csv_path = os.path.join(playlist_folder, REPORT_CSV)
+        with open(csv_path + '.tmp', 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow(REPORT_HEADER)
+            for track in tracks:
+                writer.writerow([
+                    track['track_id'] or '', track['artist'], track['title'], track['status'], track['stage'],
+                    track['elapsed'], track['download_bytes'] or '', track['download_mb_per_sec'] or '',
+                    ' '.join(f"{name}={seconds}" for name, seconds in track['spans'].items()),
+                ])
+        os.replace(csv_path + '.tmp', csv_path)
@@ -0,0 +1,177 @@
+import contextvars
+import heapq
+import itertools
+import queue
+import threading
+import time
+
+from src.scheduler import SessionCancelled
+
+_STOP = object()
+
+
+class PriorityStageQueue(queue.Queue):
+    # Hands out the waiting item with the lowest key(item) first (ties in arrival order); _STOP always goes last
+    def __init__(self, key, maxsize=0):
+        self.key = key
+        self.counter = itertools.count()
+        super().__init__(maxsize)
+
+    def _init(self, maxsize):
+        self.queue = []
+
+    def _qsize(self):
+        return len(self.queue)
+
+    def _put(self, item):
+        rank = (1, 0) if item is _STOP else (0, self.key(item))
+        heapq.heappush(self.queue, (rank, next(self.counter), item))
+
+    def _get(self):
+        return heapq.heappop(self.queue)[-1]
+
+
+class Stage:
+    def __init__(self, name, func, workers, queue_size=None, batch_size=None, priority=None):
+        self.name = name
+        self.func = func
+        self.workers = max(1, int(workers))
+        # With a batch_size, func takes a list of up to that many items (whatever
+        # is already waiting) and returns a list of results in the same order
+        self.batch_size = batch_size
+        # Bounded so a fast stage can only run a little ahead of a slow one
+        maxsize = queue_size or max(self.workers * 2, batch_size or 0)
+        # With a priority key, workers take the waiting item with the lowest key instead of the oldest
+        self.queue = PriorityStageQueue(priority, maxsize) if priority else queue.Queue(maxsize=maxsize)
+
+
+class Pipeline:
+    """Streams items through a chain of stages, each with its own worker pool.
+
+    A stage function returns the item to hand to the next stage, or None to
+    retire it early (skipped, failed, already done). Every item that leaves
+    the pipeline, finished or not, is yielded by run().
+
+    With a scheduler session, each stage call also holds a slot from the
+    matching pool of the shared budget. Cancelling the session retires the
+    remaining items without running them.
+
+    skip(stage_name, item) -> True hands an item straight to the next stage
+    without running (or scheduling) that stage, e.g. for resumed work.
+    """
+
+    def __init__(self, stages, on_error=None, session=None, on_stage_start=None, on_stage_done=None, skip=None):
+        self.stages = stages
+        self.on_error = on_error
+        self.session = session
+        self.skip = skip
+        self.on_stage_start = on_stage_start
+        self.on_stage_done = on_stage_done
+        self.results = queue.Queue()
+
+    def _thread(self, target, *args):
+        # Each worker runs in a copy of the caller's context, so context-local
+        # state (like where output is routed) follows the work into the pool
+        return threading.Thread(target=contextvars.copy_context().run, args=(target, *args), daemon=True)
+
+    def _cancelled(self):
+        return self.session is not None and self.session.cancelled
+
+    def _timed(self, stage, items):
+        if self.on_stage_start:
+            for item in items:
+                self.on_stage_start(stage.name, item)
+        started = time.perf_counter()
+        try:
+            return stage.func(items) if stage.batch_size else [stage.func(items[0])]
+        finally:
+            if self.on_stage_done:
+                elapsed = time.perf_counter() - started
+                for item in items:
+                    self.on_stage_done(stage.name, item, elapsed)
+
+    def _call(self, stage, items):
+        if self.session is None:
+            return self._timed(stage, items)
+        with self.session.slot(stage.name):
+            return self._timed(stage, items)
+
+    def _take(self, stage):
+        # Blocks for one item, then tops the batch up with whatever else is already queued
+        items = [stage.queue.get()]
+        while items[-1] is not _STOP and len(items) < (stage.batch_size or 1):
+            try:
+                items.append(stage.queue.get_nowait())
+            except queue.Empty:
+                break
+        stopped = items[-1] is _STOP
+        return (items[:-1] if stopped else items), stopped
+
+    def run(self, items):
+        threads = [self._thread(self._feed, items)]
+        for index, stage in enumerate(self.stages):
+            is_last = index == len(self.stages) - 1
+            next_queue = self.results if is_last else self.stages[index + 1].queue
+            next_workers = 1 if is_last else self.stages[index + 1].workers
+            remaining = [stage.workers]
+            lock = threading.Lock()
+            for _ in range(stage.workers):
+                threads.append(self._thread(self._work, stage, next_queue, next_workers, remaining, lock))
+
+        for thread in threads:
+            thread.start()
+
+        while True:
+            item = self.results.get()
+            if item is _STOP:
+                break
+            yield item
+
+        for thread in threads:
+            thread.join()
+
+    def _feed(self, items):
+        first = self.stages[0]
+        try:
+            for item in items:
+                if self._cancelled():
+                    break
+                first.queue.put(item)
+        finally:
+            for _ in range(first.workers):
+                first.queue.put(_STOP)
+
+    def _work(self, stage, next_queue, next_workers, remaining, lock):
+        try:
+            stopped = False
+            while not stopped:
+                items, stopped = self._take(stage)
+                skipped = [item for item in items if self.skip and self.skip(stage.name, item)]
+                for item in skipped:
+                    next_queue.put(item)
+                items = [item for item in items if not any(item is other for other in skipped)]
+                if not items:
+                    continue
+                try:
+                    if self._cancelled():
+                        raise SessionCancelled(self.session.name)
+                    results = self._call(stage, items)
+                except Exception as e:
+                    if self.on_error:
+                        for item in items:
+                            self.on_error(stage.name, item, e)
+                    results = [None] * len(items)
+
+                for item, result in zip(items, results):
+                    if result is None:
+                        self.results.put(item)
+                    else:
+                        next_queue.put(result)
+        finally:
+            # The last worker out of a stage tells the next stage to wind down
+            with lock:
+                remaining[0] -= 1
+                last_out = remaining[0] == 0
+            if last_out:
+                for _ in range(next_workers):
+                    next_queue.put(_STOP)
@@ -0,0 +1,136 @@
+import csv
+import json
+import os
+import shutil
+import time
+
+STATE_FILENAME = '.sync_state.json'
+TRACKLIST_HEADER = ['Artist', 'Title', 'YouTube URL', 'Spotify ID']
+ARCHIVE_FOLDER = 'Archive'
+REVIEW_FILENAME = 'review.csv'
+REVIEW_HEADER = ['Artist', 'Title', 'Spotify ID', 'Confidence', 'Duration Delta (s)', 'Best Match', 'YouTube URL']
+
+
+def load_sync_state(playlist_folder):
+    path = os.path.join(playlist_folder, STATE_FILENAME)
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def save_sync_state(playlist_folder, playlist_id, snapshot_id, track_ids):
+    path = os.path.join(playlist_folder, STATE_FILENAME)
+    state = {
+        'playlist_id': playlist_id,
+        'snapshot_id': snapshot_id,
+        'track_ids': list(track_ids),
+        'synced_at': time.time(),
+    }
+    # Write-then-rename so a crash never leaves a half-written state file
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f)
+    os.replace(temp_path, path)
+
+
+def diff_track_ids(previous_ids, current_ids):
+    previous, current = set(previous_ids), set(current_ids)
+    return current - previous, previous - current
+
+
+def write_review(playlist_folder, jobs):
+    # Rewritten every run: tracks deferred last time are re-scored along with the rest
+    path = os.path.join(playlist_folder, REVIEW_FILENAME)
+    if not jobs:
+        if os.path.exists(path):
+            os.remove(path)
+        return
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(REVIEW_HEADER)
+        for job in jobs:
+            match = job['match']
+            delta = round(match['duration_delta']) if match['duration_delta'] is not None else ''
+            writer.writerow([job['artist'], job['title'], job['track_id'], match['confidence'], delta,
+                             match['title'] or '', match['url'] or ''])
+    os.replace(temp_path, path)
+
+
+class Tracklist:
+    """tracklist.csv, appended to as tracks finish instead of rewritten per run."""
+
+    def __init__(self, path):
+        self.path = path
+        self.ids = set()
+        self._upgrade()
+        self.file = open(path, 'a', newline='', encoding='utf-8')
+        self.writer = csv.writer(self.file)
+        if self.file.tell() == 0:
+            self.writer.writerow(TRACKLIST_HEADER)
+            self.file.flush()
+
+    def _read_rows(self):
+        if not os.path.exists(self.path):
+            return None, []
+        with open(self.path, newline='', encoding='utf-8') as f:
+            rows = list(csv.reader(f))
+        return (rows[0], rows[1:]) if rows else (None, [])
+
+    def _write_rows(self, rows):
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow(TRACKLIST_HEADER)
+            writer.writerows(rows)
+        os.replace(temp_path, self.path)
+
+    def _upgrade(self):
+        header, rows = self._read_rows()
+        if header is None:
+            return
+        if header != TRACKLIST_HEADER:
+            # Older tracklists have no Spotify ID column; pad them once
+            rows = [row[:3] + [''] * (3 - len(row[:3])) + [''] for row in rows]
+            self._write_rows(rows)
+        self.ids = {row[3] for row in rows if len(row) > 3 and row[3]}
+
+    def add(self, artist, title, youtube_url, track_id):
+        if track_id and track_id in self.ids:
+            return
+        self.writer.writerow([artist, title, youtube_url or '', track_id or ''])
+        self.file.flush()
+        if track_id:
+            self.ids.add(track_id)
+
+    def remove(self, track_ids):
+        track_ids = set(track_ids)
+        if not track_ids & self.ids:
+            return
+        self.file.close()
+        _, rows = self._read_rows()
+        self._write_rows([row for row in rows if len(row) < 4 or row[3] not in track_ids])
+        self.ids -= track_ids
+        self.file = open(self.path, 'a', newline='', encoding='utf-8')
+        self.writer = csv.writer(self.file)
+
+    def close(self):
+        self.file.close()
+
+
+def archive_removed(manifest, playlist_folder, track_ids):
+    archive_folder = os.path.join(playlist_folder, ARCHIVE_FOLDER)
+    moved = 0
+    for track_id in track_ids:
+        entry = manifest.lookup(track_id, playlist_folder)
+        if not entry:
+            continue
+        os.makedirs(archive_folder, exist_ok=True)
+        target = os.path.join(archive_folder, os.path.basename(entry['path']))
+        shutil.move(entry['path'], target)
+        manifest.remove(entry['path'])
+        manifest.record(track_id, target, entry['duration'])
+        moved += 1
+    return moved
@@ -0,0 +1,73 @@
+import threading
+import time
+
+
+class TokenBucket:
+    """Thread-safe token bucket with a shared backoff window.
+
+    Every caller draws from the same bucket, so when one thread is told to
+    back off (a 429 with Retry-After, or a run of server errors) all of them
+    pause together instead of each hammering the API on its own schedule.
+    """
+
+    def __init__(self, rate, capacity=None, max_backoff=60):
+        self.rate = float(rate)
+        self.capacity = float(capacity or rate)
+        self.max_backoff = max_backoff
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.consecutive_failures = 0
+        self.cond = threading.Condition()
+
+        self.calls = 0
+        self.throttled = 0
+        self.retries = 0
+        self.waited = 0.0
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, amount=1):
+        # Requests larger than the bucket go through once it is full, leaving it in debt
+        needed = min(amount, self.capacity)
+        with self.cond:
+            while True:
+                now = time.monotonic()
+                self._refill(now)
+                if now < self.blocked_until:
+                    wait = self.blocked_until - now
+                elif self.tokens >= needed:
+                    self.tokens -= amount
+                    self.calls += 1
+                    return
+                else:
+                    wait = (needed - self.tokens) / self.rate
+                self.waited += wait
+                self.cond.wait(wait)
+
+    def backoff(self, retry_after=None, throttled=False):
+        with self.cond:
+            self.consecutive_failures += 1
+            self.retries += 1
+            if throttled:
+                self.throttled += 1
+            if retry_after is None:
+                retry_after = min(self.max_backoff, 0.5 * 2 ** (self.consecutive_failures - 1))
+            self.blocked_until = max(self.blocked_until, time.monotonic() + retry_after)
+            self.tokens = 0
+            return retry_after
+
+    def success(self):
+        with self.cond:
+            self.consecutive_failures = 0
+
+    def stats(self):
+        with self.cond:
+            return {
+                'calls': self.calls,
+                'throttled': self.throttled,
+                'retries': self.retries,
+                'waited_seconds': round(self.waited, 3),
+            }
@@ -0,0 +1,129 @@
+import itertools
+import threading
+from contextlib import contextmanager
+
+
+class SessionCancelled(Exception):
+    pass
+
+
+class JobScheduler:
+    """One global worker budget shared by every download session.
+
+    Budgets are per pool (search, download, transcode, ...). When a slot
+    frees up it goes to the waiting session using the smallest share of that
+    pool relative to its weight, so adding sessions splits the same budget
+    instead of multiplying it. Paused sessions are skipped until resumed.
+    """
+
+    def __init__(self, budgets):
+        self.budgets = dict(budgets)
+        self.in_use = {pool: 0 for pool in self.budgets}
+        self.sessions = []
+        self.cond = threading.Condition()
+        self._grants = itertools.count()
+
+    def create_session(self, name, weight=1):
+        session = SchedulerSession(self, name, weight)
+        with self.cond:
+            self.sessions.append(session)
+        return session
+
+    def remove_session(self, session):
+        with self.cond:
+            if session in self.sessions:
+                self.sessions.remove(session)
+            self.cond.notify_all()
+
+    def set_budget(self, pool, slots):
+        with self.cond:
+            self.budgets[pool] = max(1, int(slots))
+            self.in_use.setdefault(pool, 0)
+            self.cond.notify_all()
+
+    def _next_for(self, pool):
+        candidates = [
+            s for s in self.sessions
+            if s.waiting.get(pool) and not s.paused and not s.cancelled
+        ]
+        if not candidates:
+            return None
+        # Least served relative to weight first; ties go to whoever waited longest
+        return min(candidates, key=lambda s: (s.running.get(pool, 0) / s.weight, s.last_grant.get(pool, -1)))
+
+    def acquire(self, session, pool):
+        if pool not in self.budgets:
+            return False
+        with self.cond:
+            session.waiting[pool] = session.waiting.get(pool, 0) + 1
+            try:
+                while True:
+                    if session.cancelled:
+                        raise SessionCancelled(session.name)
+                    if self.in_use[pool] < self.budgets[pool] and self._next_for(pool) is session:
+                        break
+                    self.cond.wait()
+            finally:
+                session.waiting[pool] -= 1
+            self.in_use[pool] += 1
+            session.running[pool] = session.running.get(pool, 0) + 1
+            session.last_grant[pool] = next(self._grants)
+            # Another waiter may now be next in line for a free slot
+            self.cond.notify_all()
+        return True
+
+    def release(self, session, pool):
+        with self.cond:
+            self.in_use[pool] -= 1
+            session.running[pool] -= 1
+            self.cond.notify_all()
+
+    def snapshot(self):
+        with self.cond:
+            return {
+                'budgets': dict(self.budgets),
+                'in_use': dict(self.in_use),
+                'sessions': {
+                    s.name: {'weight': s.weight, 'paused': s.paused, 'running': dict(s.running)}
+                    for s in self.sessions
+                },
+            }
+
+
+class SchedulerSession:
+    def __init__(self, scheduler, name, weight=1):
+        self.scheduler = scheduler
+        self.name = name
+        self.weight = max(1, weight)
+        self.paused = False
+        self.cancelled = False
+        self.waiting = {}
+        self.running = {}
+        self.last_grant = {}
+
+    @contextmanager
+    def slot(self, pool):
+        acquired = self.scheduler.acquire(self, pool)
+        try:
+            yield
+        finally:
+            if acquired:
+                self.scheduler.release(self, pool)
+
+    def _update(self, **changes):
+        with self.scheduler.cond:
+            for key, value in changes.items():
+                setattr(self, key, value)
+            self.scheduler.cond.notify_all()
+
+    def pause(self):
+        self._update(paused=True)
+
+    def resume(self):
+        self._update(paused=False)
+
+    def cancel(self):
+        self._update(cancelled=True)
+
+    def set_weight(self, weight):
+        self._update(weight=max(1, weight))
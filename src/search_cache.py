@@ -0,0 +1,112 @@
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+
+DEFAULT_TTL = 30 * 24 * 3600  # 30 days
+DEFAULT_MAX_ENTRIES = 50000
+CACHE_FILENAME = '.search_cache.sqlite'
+
+
+def normalize_query(query):
+    return re.sub(r'\s+', ' ', query.lower()).strip()
+
+
+class SearchCache:
+    """On-disk cache of YouTube search results, shared by every worker thread.
+
+    Entries are keyed by Spotify track id when known, otherwise by the
+    normalized query. Expired entries are ignored, and once the cache holds
+    more than max_entries the least recently used ones are dropped.
+    """
+
+    def __init__(self, path, ttl=DEFAULT_TTL, max_entries=DEFAULT_MAX_ENTRIES, force_refresh=False):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.force_refresh = force_refresh
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        with self.conn:
+            self.conn.execute('PRAGMA journal_mode=WAL')
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS searches (
+                    key TEXT PRIMARY KEY,
+                    query TEXT,
+                    track_id TEXT,
+                    webpage_url TEXT,
+                    selected TEXT,
+                    candidates TEXT,
+                    created_at REAL,
+                    accessed_at REAL
+                )
+            ''')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS idx_searches_accessed ON searches (accessed_at)')
+
+    @classmethod
+    def for_library(cls, library_root, **kwargs):
+        os.makedirs(library_root, exist_ok=True)
+        return cls(os.path.join(library_root, CACHE_FILENAME), **kwargs)
+
+    @staticmethod
+    def make_key(query, track_id=None):
+        if track_id:
+            return f"id:{track_id}"
+        return f"q:{normalize_query(query)}"
+
+    def get(self, query, track_id=None):
+        if self.force_refresh:
+            self.misses += 1
+            return None
+
+        key = self.make_key(query, track_id)
+        now = time.time()
+        with self.lock:
+            row = self.conn.execute(
+                'SELECT selected, candidates, created_at FROM searches WHERE key = ?', (key,)
+            ).fetchone()
+            if row is None or (self.ttl and now - row[2] > self.ttl):
+                self.misses += 1
+                return None
+            with self.conn:
+                self.conn.execute('UPDATE searches SET accessed_at = ? WHERE key = ?', (now, key))
+            self.hits += 1
+
+        return {
+            'selected': json.loads(row[0]) if row[0] else None,
+            'candidates': json.loads(row[1]),
+        }
+
+    def put(self, query, selected, candidates, track_id=None):
+        key = self.make_key(query, track_id)
+        now = time.time()
+        with self.lock, self.conn:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO searches VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (
+                    key, normalize_query(query), track_id,
+                    selected['webpage_url'] if selected else None,
+                    json.dumps(selected) if selected else None,
+                    json.dumps(candidates),
+                    now, now,
+                ),
+            )
+            self._evict()
+
+    def _evict(self):
+        count = self.conn.execute('SELECT COUNT(*) FROM searches').fetchone()[0]
+        if count <= self.max_entries:
+            return
+        self.conn.execute(
+            'DELETE FROM searches WHERE key IN (SELECT key FROM searches ORDER BY accessed_at LIMIT ?)',
+            (count - self.max_entries,),
+        )
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
@@ -1,46 +1,199 @@
-import auth
+import json
+import os
+import sqlite3
+import threading
+import time
 
-def get_spotify_data(sp, search_query):
-    # Check if the input is a Spotify URI
-    if search_query.startswith('spotify:track:'):
-        track_id = search_query.split(':')[2]
-        track = sp.track(track_id)
-    else:
-        # Perform a search query if it's not a URI
-        result = sp.search(q=search_query, limit=1, type='track')
-        if not result['tracks']['items']:
-            return None
-        track = result['tracks']['items'][0]
-   
-    # Get additional track details using the track ID
-    track_id = track['id']
-    track_details = sp.track(track_id)
+TRACKS_BATCH = 50
+FEATURES_BATCH = 100
+ARTISTS_BATCH = 50
+CACHE_FILENAME = '.spotify_cache.sqlite'
+DEFAULT_TTL = 30 * 24 * 3600  # 30 days
+
+
+def _chunks(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+class SpotifyMetadata:
+    """Batched, memoized access to track, audio-feature and artist objects.
+
+    Ids are collected across a whole playlist and fetched with the plural
+    endpoints (sp.tracks, sp.audio_features, sp.artists), each object only
+    once per process. With a cache_path, results also survive between runs.
+    """
+
+    def __init__(self, sp, cache_path=None, ttl=DEFAULT_TTL):
+        self.sp = sp
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.memory = {'track': {}, 'features': {}, 'artist': {}}
+        self.requests = 0
+        self.features_available = True
+
+        self.conn = None
+        if cache_path:
+            self.conn = sqlite3.connect(cache_path, check_same_thread=False)
+            with self.conn:
+                self.conn.execute('''
+                    CREATE TABLE IF NOT EXISTS objects (
+                        kind TEXT,
+                        id TEXT,
+                        data TEXT,
+                        fetched_at REAL,
+                        PRIMARY KEY (kind, id)
+                    )
+                ''')
+
+    @classmethod
+    def for_library(cls, sp, library_root, **kwargs):
+        os.makedirs(library_root, exist_ok=True)
+        return cls(sp, os.path.join(library_root, CACHE_FILENAME), **kwargs)
+
+    def _load_from_disk(self, kind, ids):
+        if self.conn is None or not ids:
+            return {}
+        found = {}
+        cutoff = time.time() - self.ttl if self.ttl else 0
+        for chunk in _chunks(ids, 500):
+            placeholders = ','.join('?' * len(chunk))
+            rows = self.conn.execute(
+                f'SELECT id, data FROM objects WHERE kind = ? AND fetched_at >= ? AND id IN ({placeholders})',
+                [kind, cutoff, *chunk],
+            ).fetchall()
+            found.update((object_id, json.loads(data)) for object_id, data in rows)
+        return found
+
+    def _store(self, kind, objects):
+        self.memory[kind].update(objects)
+        if self.conn is None or not objects:
+            return
+        now = time.time()
+        with self.conn:
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO objects VALUES (?, ?, ?, ?)',
+                [(kind, object_id, json.dumps(data), now) for object_id, data in objects.items()],
+            )
+
+    def _get_many(self, kind, ids, batch_size, fetch_batch):
+        with self.lock:
+            memory = self.memory[kind]
+            wanted = list(dict.fromkeys(i for i in ids if i and i not in memory))
+            if wanted:
+                cached = self._load_from_disk(kind, wanted)
+                memory.update(cached)
+                wanted = [i for i in wanted if i not in cached]
+
+            # Without a client, only what's already cached is returned
+            for chunk in _chunks(wanted if self.sp else [], batch_size):
+                results = fetch_batch(chunk)
+                self.requests += 1
+                # Missing objects are remembered as None so they aren't refetched
+                fetched = {object_id: None for object_id in chunk}
+                fetched.update((obj['id'], obj) for obj in results if obj)
+                self._store(kind, fetched)
+
+            return {i: memory.get(i) for i in ids if i}
 
-    # Get detailed audio features for the track
-    audio_features = sp.audio_features([track_id])[0]
+    def cached(self, kind, ids):
+        # Whatever is already known locally, without touching the API
+        with self.lock:
+            memory = self.memory[kind]
+            found = {i: memory[i] for i in ids if memory.get(i)}
+            on_disk = self._load_from_disk(kind, [i for i in ids if i not in found])
+            found.update((i, obj) for i, obj in on_disk.items() if obj)
+            return found
 
-    duration_ms = audio_features['duration_ms']
+    def prime_tracks(self, tracks):
+        # Playlist pages already carry full track objects; no need to refetch them
+        with self.lock:
+            self._store('track', {track['id']: track for track in tracks if track and track.get('id')})
+
+    def tracks(self, track_ids):
+        return self._get_many('track', track_ids, TRACKS_BATCH, lambda chunk: self.sp.tracks(chunk)['tracks'])
+
+    def audio_features(self, track_ids):
+        from spotipy.exceptions import SpotifyException
+        if not self.features_available:
+            return {}
+        try:
+            return self._get_many('features', track_ids, FEATURES_BATCH, lambda chunk: self.sp.audio_features(chunk))
+        except SpotifyException as e:
+            if e.http_status not in (403, 404):
+                raise
+            # Newer Spotify apps can't use this endpoint at all
+            print(f"⚠️ Audio features unavailable for this app ({e.http_status}); BPM and energy will be empty")
+            self.features_available = False
+            return {}
+
+    def artists(self, artist_ids):
+        return self._get_many('artist', artist_ids, ARTISTS_BATCH, lambda chunk: self.sp.artists(chunk)['artists'])
+
+    def fetch(self, track_ids):
+        track_ids = [i for i in track_ids if i]
+        tracks = self.tracks(track_ids)
+        features = self.audio_features(track_ids)
+        artist_ids = [track['artists'][0]['id'] for track in tracks.values() if track and track['artists']]
+        artists = self.artists(artist_ids)
+
+        data = {}
+        for track_id, track in tracks.items():
+            if not track:
+                continue
+            artist = artists.get(track['artists'][0]['id']) if track['artists'] else None
+            data[track_id] = build_track_data(track, features.get(track_id), artist)
+        return data
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+
+
+def build_track_data(track, audio_features=None, artist=None):
+    duration_ms = track.get('duration_ms') or (audio_features or {}).get('duration_ms') or 0
     # Convert duration from milliseconds to MM:SS format
     minutes, seconds = divmod(duration_ms // 1000, 60)
     duration_str = f"{minutes}:{seconds:02d}"
-    
-    # Organize the data into a dictionary
-    track_data = {
-        'id': track_id,
+    album = track.get('album', {})
+    # Spotify reports key -1 when it detects none; leave it unset so local analysis can fill it in
+    key = audio_features['key'] if audio_features else None
+    has_key = key is not None and 0 <= key < 12
+
+    return {
+        'id': track['id'],
         'artist': track['artists'][0]['name'],
         'title': track['name'],
-        'album': track['album']['name'],
-        'release_date': track['album']['release_date'],
-        'release_date_precision': track['album']['release_date_precision'],
-        'year': track['album']['release_date'].split('-')[0],
-        'genre': sp.artist(track['artists'][0]['id'])['genres'],
-        'bpm': audio_features['tempo'],
-        'energy': audio_features['energy'],
+        'album': album.get('name', ''),
+        'release_date': album.get('release_date', ''),
+        'release_date_precision': album.get('release_date_precision'),
+        'year': album.get('release_date', '').split('-')[0],
+        'genre': artist['genres'] if artist else [],
+        'bpm': audio_features['tempo'] if audio_features else None,
+        'energy': audio_features['energy'] if audio_features else None,
+        'key': key if has_key else None,
+        'mode': audio_features['mode'] if has_key else None,
         'duration': duration_str,  # Added duration in MM:SS
-        'album_art_url': track['album']['images'][0]['url'] if track['album']['images'] else None,
-        'album': track['album']['name'],
-        'album_spotify_id': track['album']['id']
+        'duration_ms': duration_ms,
+        'isrc': track.get('external_ids', {}).get('isrc'),
+        'album_art_url': album['images'][0]['url'] if album.get('images') else None,
+        'album_spotify_id': album.get('id'),
     }
-    
-    return track_data
 
+
+def get_spotify_data(sp, search_query, metadata=None):
+    metadata = metadata or SpotifyMetadata(sp)
+
+    # Check if the input is a Spotify URI
+    if search_query.startswith('spotify:track:'):
+        track_id = search_query.split(':')[2]
+    else:
+        # Perform a search query if it's not a URI
+        result = sp.search(q=search_query, limit=1, type='track')
+        if not result['tracks']['items']:
+            return None
+        track = result['tracks']['items'][0]
+        metadata.prime_tracks([track])
+        track_id = track['id']
+
+    return metadata.fetch([track_id]).get(track_id)
@@ -0,0 +1,164 @@
+import base64
+import os
+
+from mutagen.id3 import ID3, ID3NoHeaderError, TIT2, TPE1, TALB, TCON, TDRC, TBPM, TKEY, TSRC, COMM, TXXX, APIC
+from mutagen.mp4 import MP4, MP4Cover, MP4FreeForm
+from mutagen.oggopus import OggOpus
+from mutagen.flac import Picture
+
+from src.album_art import image_mime
+
+KEY_NAMES = ('C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#', 'A', 'A#', 'B')
+PADDING = 16 * 1024  # room for later edits (a new comment, BPM, key) without rewriting the audio
+MAX_PADDING = 256 * 1024
+MP4_FREEFORM = '----:com.apple.iTunes:'
+
+
+def key_name(key, mode):
+    # Spotify pitch class and mode to the TKEY notation DJ software reads, e.g. 'F#m'
+    if key is None or not 0 <= key < len(KEY_NAMES):
+        return None
+    return KEY_NAMES[key] + ('m' if mode == 0 else '')
+
+
+def reserve_padding(info):
+    # Reuse whatever padding the file has; if the tag no longer fits, the file
+    # is rewritten once anyway, so leave enough behind for the next edit
+    if 0 <= info.padding <= MAX_PADDING:
+        return info.padding
+    return PADDING
+
+
+def build_tags(artist, title, album='', genre='', year='', track_id=None, bpm=None, energy=None,
+               key=None, mode=None, isrc=None, loudness=None, replay_gain=None, peak=None):
+    """The complete tag set for one track, with empty fields left out."""
+    tags = {
+        'artist': artist,
+        'title': title,
+        'album': album,
+        'genre': genre,
+        'year': str(year) if year else '',
+        'track_id': track_id,
+        'bpm': str(round(bpm)) if bpm else None,
+        'energy': f"{energy:.3f}" if energy is not None else None,
+        'key': key_name(key, mode),
+        'isrc': isrc,
+        'comment': f"Energy {round(energy * 10)}" if energy is not None else None,
+        'replay_gain': f"{replay_gain:+.2f} dB" if replay_gain is not None else None,
+        'replay_peak': f"{peak:.6f}" if peak is not None else None,
+        # Opus players ignore ReplayGain and read R128 gain instead: Q7.8 dB relative to -23 LUFS
+        'r128_gain': str(round((-23 - loudness) * 256)) if loudness is not None else None,
+    }
+    return {name: value for name, value in tags.items() if value}
+
+
+def job_tags(job):
+    return build_tags(
+        job['artist'], job['title'], job['album'], job['genre'], job['year'], job['track_id'],
+        job.get('bpm'), job.get('energy'), job.get('musical_key'), job.get('mode'), job.get('isrc'),
+        job.get('loudness'), job.get('replay_gain'), job.get('replay_peak'),
+    )
+
+
+def track_data_tags(data, analysis=None):
+    # From spotify_data.build_track_data, with local analysis filling in what Spotify didn't provide
+    analysis = analysis or {}
+    key, mode = (data['key'], data['mode']) if data['key'] is not None else (analysis.get('key'), analysis.get('mode'))
+    return build_tags(
+        data['artist'], data['title'], data['album'], ', '.join(data['genre'] or []), data['year'], data['id'],
+        data['bpm'] or analysis.get('bpm'), data['energy'], key, mode, data['isrc'],
+        analysis.get('loudness'), analysis.get('replay_gain'), analysis.get('peak'),
+    )
+
+
+ID3_TEXT_FRAMES = (
+    ('artist', TPE1), ('title', TIT2), ('album', TALB), ('genre', TCON),
+    ('year', TDRC), ('bpm', TBPM), ('key', TKEY), ('isrc', TSRC),
+)
+ID3_USER_FRAMES = (
+    ('track_id', 'SPOTIFY_TRACK_ID'), ('energy', 'ENERGY'),
+    ('replay_gain', 'REPLAYGAIN_TRACK_GAIN'), ('replay_peak', 'REPLAYGAIN_TRACK_PEAK'),
+)
+
+
+def write_mp3(path, tags, art=None):
+    # Only the ID3 tag is read and written; the MPEG stream is left alone
+    try:
+        id3 = ID3(path)
+    except ID3NoHeaderError:
+        id3 = ID3()
+
+    for name, frame in ID3_TEXT_FRAMES:
+        if name in tags:
+            id3.add(frame(encoding=3, text=[tags[name]]))
+    for name, desc in ID3_USER_FRAMES:
+        if name in tags:
+            id3.add(TXXX(encoding=3, desc=desc, text=[tags[name]]))
+    if 'comment' in tags:
+        id3.add(COMM(encoding=3, lang='eng', desc='', text=[tags['comment']]))
+    if art:
+        id3.add(APIC(encoding=3, mime=image_mime(art), type=3, desc='Cover', data=art))
+
+    id3.save(path, padding=reserve_padding)
+
+
+MP4_TEXT_ATOMS = (
+    ('artist', '\xa9ART'), ('title', '\xa9nam'), ('album', '\xa9alb'),
+    ('genre', '\xa9gen'), ('year', '\xa9day'), ('comment', '\xa9cmt'),
+)
+MP4_FREEFORM_ATOMS = (
+    ('track_id', 'SPOTIFY_TRACK_ID'), ('key', 'initialkey'), ('isrc', 'ISRC'), ('energy', 'ENERGY'),
+    ('replay_gain', 'replaygain_track_gain'), ('replay_peak', 'replaygain_track_peak'),
+)
+
+
+def write_mp4(path, tags, art=None):
+    audio = MP4(path)
+    if audio.tags is None:
+        audio.add_tags()
+
+    for name, atom in MP4_TEXT_ATOMS:
+        if name in tags:
+            audio[atom] = [tags[name]]
+    for name, atom in MP4_FREEFORM_ATOMS:
+        if name in tags:
+            audio[MP4_FREEFORM + atom] = [MP4FreeForm(tags[name].encode('utf-8'))]
+    if 'bpm' in tags:
+        audio['tmpo'] = [int(tags['bpm'])]
+    if art:
+        image_format = MP4Cover.FORMAT_PNG if image_mime(art) == 'image/png' else MP4Cover.FORMAT_JPEG
+        audio['covr'] = [MP4Cover(art, imageformat=image_format)]
+
+    audio.save(padding=reserve_padding)
+
+
+VORBIS_FIELDS = (
+    ('artist', 'artist'), ('title', 'title'), ('album', 'album'), ('genre', 'genre'),
+    ('year', 'date'), ('bpm', 'bpm'), ('key', 'initialkey'), ('isrc', 'isrc'),
+    ('comment', 'comment'), ('energy', 'energy'), ('track_id', 'spotify_track_id'), ('r128_gain', 'r128_track_gain'),
+)
+
+
+def write_opus(path, tags, art=None):
+    audio = OggOpus(path)
+
+    for name, field in VORBIS_FIELDS:
+        if name in tags:
+            audio[field] = [tags[name]]
+    if art:
+        picture = Picture()
+        picture.type = 3
+        picture.mime = image_mime(art)
+        picture.desc = 'Cover'
+        picture.data = art
+        audio['metadata_block_picture'] = [base64.b64encode(picture.write()).decode('ascii')]
+
+    audio.save(padding=reserve_padding)
+
+
+WRITERS = {'.mp3': write_mp3, '.m4a': write_mp4, '.opus': write_opus}
+
+
+def write_tags(path, tags, art=None):
+    """Writes the whole tag set (and cover art) in a single save."""
+    WRITERS[os.path.splitext(path)[1].lower()](path, tags, art)
@@ -1,37 +1,131 @@
 import os
 import re
 import json
+import shutil
 import subprocess
-from youtube_search import YoutubeSearch
-import yt_dlp
+import threading
 
 from mutagen.mp3 import MP3
-from mutagen import MutagenError
+from mutagen import MutagenError, File as MutagenFile
 
-def search_youtube(query, max_results=5):
-    ydl_opts = {
+# For each output format: container extension, which YouTube stream to prefer,
+# source codecs that can be stream-copied, and the encoder used otherwise
+OUTPUT_FORMATS = {
+    'mp3': {'ext': 'mp3', 'format': 'bestaudio/best', 'copy_codecs': ('mp3',), 'encoder': 'libmp3lame'},
+    'm4a': {'ext': 'm4a', 'format': 'bestaudio[ext=m4a]/bestaudio/best', 'copy_codecs': ('aac', 'mp4a'), 'encoder': 'aac'},
+    'opus': {'ext': 'opus', 'format': 'bestaudio[acodec=opus]/bestaudio/best', 'copy_codecs': ('opus',), 'encoder': 'libopus'},
+}
+
+ENCODER_PRESETS = {
+    'mp3-192': ['-b:a', '192k'],
+    'mp3-320': ['-b:a', '320k'],
+    'mp3-v0': ['-q:a', '0'],
+    'mp3-v2': ['-q:a', '2'],
+    'aac-256': ['-b:a', '256k'],
+    'opus-160': ['-b:a', '160k'],
+}
+DEFAULT_PRESETS = {'mp3': 'mp3-192', 'm4a': 'aac-256', 'opus': 'opus-160'}
+
+YDL_OPTIONS = {
+    "search": {
         "quiet": True,
         "format": "bestaudio/best",
         "noplaylist": True,
         "extract_flat": "in_playlist",
         "default_search": "ytsearch",
+    },
+    "legacy_mp3": {
+        'format': 'bestaudio/best',
+        'postprocessors': [{
+            'key': 'FFmpegExtractAudio',
+            'preferredcodec': 'mp3',
+            'preferredquality': '192',
+        }],
+        'quiet': True,
+        'noplaylist': True,
+    },
+}
+for _name, _spec in OUTPUT_FORMATS.items():
+    # Same options serve both downloading and resolving a stream URL
+    # continuedl picks an interrupted download up from its .part file instead of starting over
+    # noprogress silences the fragment downloader's console output; progress hooks still fire
+    YDL_OPTIONS[f"download_{_name}"] = {
+        'format': _spec['format'], 'quiet': True, 'noprogress': True, 'noplaylist': True, 'continuedl': True,
     }
 
-    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-        try:
-            results = ydl.extract_info(f"ytsearch{max_results}:{query}", download=False)
-            videos = []
-            for video in results["entries"]:
-                videos.append({
-                    "title": video.get("title", ""),
-                    "duration": video.get("duration", 0),
-                    "webpage_url": f"https://www.youtube.com/watch?v={video.get('id')}"
-                })
-            return videos
-
-        except Exception as e:
-            print(f"❌ YouTube search failed: {e}")
-            return []
+_worker = threading.local()
+
+# Containers YouTube serves audio in, i.e. what a .part file can be named after
+PART_EXTENSIONS = ('webm', 'm4a', 'mp4', 'opus', 'mp3')
+
+# Messages yt-dlp surfaces when YouTube is rate limiting us
+THROTTLE_MARKERS = ('HTTP Error 429', 'Too Many Requests', 'rate-limited', 'Sign in to confirm')
+_throttled = 0
+_throttle_lock = threading.Lock()
+
+def note_failure(error):
+    global _throttled
+    if any(marker in str(error) for marker in THROTTLE_MARKERS):
+        with _throttle_lock:
+            _throttled += 1
+
+def throttled_count():
+    # Running total for this process; callers diff it between samples
+    return _throttled
+
+# Bandwidth cap, per-host connections and fragment concurrency for every download in the process
+_shaping = None
+
+def set_download_shaping(shaping):
+    global _shaping
+    _shaping = shaping
+
+def download_shaping():
+    return _shaping
+
+def _progress_hook(status):
+    # Installed on every YoutubeDL instance; reads the current policy so it can change between runs
+    if _shaping is not None:
+        _shaping.shaper.hook(status)
+
+def get_ydl(kind):
+    # Building a YoutubeDL loads every extractor and postprocessor, so each
+    # worker thread keeps one per configuration and reuses it for every track
+    instances = getattr(_worker, "ydl", None)
+    if instances is None:
+        instances = _worker.ydl = {}
+    ydl = instances.get(kind)
+    if ydl is None:
+        # yt_dlp and its extractor registry are only imported once a worker first needs them
+        import yt_dlp
+        ydl = instances[kind] = yt_dlp.YoutubeDL(dict(YDL_OPTIONS[kind]))
+        ydl.add_progress_hook(_progress_hook)
+    return ydl
+
+def set_outtmpl(ydl, outtmpl):
+    # The output template is the only per-track option on a shared instance
+    ydl.params['outtmpl']['default'] = outtmpl
+
+def search_youtube(query, max_results=5):
+    # [] means YouTube found nothing; None means the search itself failed (network, 429, sign-in wall)
+    ydl = get_ydl("search")
+    try:
+        results = ydl.extract_info(f"ytsearch{max_results}:{query}", download=False)
+        videos = []
+        for video in results["entries"]:
+            videos.append({
+                "title": video.get("title", ""),
+                "duration": video.get("duration", 0),
+                "webpage_url": f"https://www.youtube.com/watch?v={video.get('id')}",
+                # Matching uses the channel: "Artist - Topic" uploads are the label's own audio
+                "channel": video.get("channel") or video.get("uploader"),
+            })
+        return videos
+
+    except Exception as e:
+        note_failure(e)
+        print(f"❌ YouTube search failed: {e}")
+        return None
 
 def is_valid_video(title, duration):
     title = title.lower()
@@ -43,8 +137,7 @@ def is_valid_video(title, duration):
         return False
     return 90 <= duration <= 600  # 1.5 to 10 minutes
 
-def search_youtube_multiple(query, fallback_limit=5):
-    entries = search_youtube(query, max_results=fallback_limit)
+def select_video(entries):
     for video in entries:
         title = video.get("title", "")
         duration = video.get("duration", 0)
@@ -56,47 +149,170 @@ def search_youtube_multiple(query, fallback_limit=5):
             }
     return None
 
+def search_candidates(query, limit=5, cache=None, track_id=None):
+    # Every result, for src.matching to score; the choice itself isn't cached so scoring can improve
+    if cache is not None:
+        cached = cache.get(query, track_id)
+        if cached is not None:
+            return cached["candidates"]
+
+    entries = search_youtube(query, max_results=limit)
+    if cache is not None and entries:
+        cache.put(query, None, entries, track_id)
+    return entries
+
+def search_youtube_multiple(query, fallback_limit=5, cache=None, track_id=None):
+    if cache is not None:
+        cached = cache.get(query, track_id)
+        if cached is not None:
+            return cached["selected"] or select_video(cached["candidates"])
+
+    entries = search_youtube(query, max_results=fallback_limit)
+    if entries is None:
+        return None
+    selected = select_video(entries)
+    if cache is not None and entries:
+        cache.put(query, selected, entries, track_id)
+    return selected
 
 
-def download_audio_from_url(url, output_path):
-    from yt_dlp import YoutubeDL
 
+def download_audio_from_url(url, output_path):
     # Remove existing .mp3 extension explicitly to avoid duplication
     output_path = re.sub(r'(\.mp3)+$', '', output_path)
 
-    ydl_opts = {
-        'format': 'bestaudio/best',
-        'outtmpl': output_path,  # NO .mp3 here; yt-dlp adds it automatically
-        'postprocessors': [{
-            'key': 'FFmpegExtractAudio',
-            'preferredcodec': 'mp3',
-            'preferredquality': '192',
-        }],
-        'quiet': True,
-        'noplaylist': True,
-    }
+    ydl = get_ydl('legacy_mp3')
+    set_outtmpl(ydl, output_path)  # NO .mp3 here; yt-dlp adds it automatically
+    try:
+        ydl.download([url])
+        final_output = output_path + ".mp3"
+        return final_output if os.path.exists(final_output) else None
+    except Exception as e:
+        print(f"❌ Download failed: {e}")
+        return None
+
+
+def get_ffmpeg_path():
+    # Prefer a system ffmpeg, fall back to the binary shipped with imageio-ffmpeg
+    path = shutil.which("ffmpeg")
+    if path:
+        return path
+    try:
+        import imageio_ffmpeg
+        return imageio_ffmpeg.get_ffmpeg_exe()
+    except Exception:
+        return "ffmpeg"
+
+
+def download_raw_audio(url, output_path, output_format='mp3'):
+    # Fetch bestaudio as-is; conversion happens in its own stage
+    ydl = get_ydl(f'download_{output_format}')
+    set_outtmpl(ydl, output_path + '.%(ext)s')
+    try:
+        info = _shaping.download(ydl, url) if _shaping else ydl.extract_info(url, download=True)
+        downloads = info.get('requested_downloads') or [{}]
+        path = downloads[0].get('filepath') or ydl.prepare_filename(info)
+        return path if os.path.exists(path) else None
+    except Exception as e:
+        note_failure(e)
+        print(f"❌ Download failed: {e}")
+        return None
 
-    with YoutubeDL(ydl_opts) as ydl:
+
+def partial_download_size(output_path):
+    # Bytes already in yt-dlp's .part file for download_raw_audio(url, output_path), e.g. from a killed run
+    for extension in PART_EXTENSIONS:
         try:
-            ydl.download([url])
-            final_output = output_path + ".mp3"
-            return final_output if os.path.exists(final_output) else None
-        except Exception as e:
-            print(f"❌ Download failed: {e}")
-            return None
+            return os.path.getsize(f"{output_path}.{extension}.part")
+        except OSError:
+            continue
+    return 0
 
 
+def guess_codec(path):
+    extension = os.path.splitext(path)[1].lower()
+    return {'.m4a': 'aac', '.mp4': 'aac', '.webm': 'opus', '.opus': 'opus', '.mp3': 'mp3'}.get(extension)
 
 
+def codec_args(output_format, source_codec=None, preset=None):
+    spec = OUTPUT_FORMATS[output_format]
+    if source_codec and source_codec.lower().startswith(spec['copy_codecs']):
+        return ['-c:a', 'copy']
+    preset = preset or DEFAULT_PRESETS[output_format]
+    return ['-c:a', spec['encoder'], *ENCODER_PRESETS[preset]]
 
-def is_valid_mp3(file_path):
+
+def convert_audio(source, output_path, output_format='mp3', preset=None, source_codec=None,
+                  input_args=(), remove_source=True):
+    # Encode to a temp name first so a half-written file never looks finished
+    root, extension = os.path.splitext(output_path)
+    temp_path = root + '.tmp' + extension
+    command = [
+        get_ffmpeg_path(), '-y', '-loglevel', 'error', '-nostdin',
+        *input_args, '-i', source,
+        '-vn', '-map', '0:a:0', *codec_args(output_format, source_codec, preset),
+        temp_path,
+    ]
     try:
-        audio = MP3(file_path)
-        return audio.info.length > 0
+        subprocess.run(command, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    except (OSError, subprocess.CalledProcessError) as e:
+        print(f"❌ FFmpeg conversion failed: {e}")
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        return None
+
+    os.replace(temp_path, output_path)
+    if remove_source:
+        os.remove(source)
+    return output_path
+
+
+def transcode_to_mp3(source_path, output_path, quality='192'):
+    return convert_audio(source_path, output_path, 'mp3', f'mp3-{quality}', guess_codec(source_path))
+
+
+def stream_audio(url, output_path, output_format='mp3', preset=None):
+    # Resolve the audio stream URL and let a single ffmpeg read it directly:
+    # no intermediate file, and a plain remux when the codec already matches
+    ydl = get_ydl(f'download_{output_format}')
+    try:
+        info = ydl.extract_info(url, download=False)
+    except Exception as e:
+        note_failure(e)
+        print(f"❌ Stream lookup failed: {e}")
+        return None
+    if not info.get('url'):
+        print(f"❌ No direct audio stream for {url}")
+        return None
+
+    input_args = ['-reconnect', '1', '-reconnect_streamed', '1', '-reconnect_delay_max', '5']
+    headers = info.get('http_headers') or {}
+    if headers:
+        input_args += ['-headers', ''.join(f"{key}: {value}\r\n" for key, value in headers.items())]
+    return convert_audio(info['url'], output_path, output_format, preset, info.get('acodec'),
+                         input_args=input_args, remove_source=False)
+
+
+def mp3_duration(file_path):
+    try:
+        return MP3(file_path).info.length
     except MutagenError:
-        return False
+        return 0
     except Exception:
-        return False
+        return 0
+
+def audio_duration(file_path):
+    # Works for every output format (MP3, M4A, Ogg Opus)
+    try:
+        audio = MutagenFile(file_path)
+        return audio.info.length if audio is not None else 0
+    except MutagenError:
+        return 0
+    except Exception:
+        return 0
+
+def is_valid_mp3(file_path):
+    return mp3_duration(file_path) > 0
 
 
 
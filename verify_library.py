@@ -0,0 +1,130 @@
+import os
+import csv
+import time
+import argparse
+import multiprocessing
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from tqdm import tqdm
+from src.integrity import check_file, is_broken
+from src.manifest import LibraryManifest, AUDIO_EXTENSIONS
+from src.spotify_data import SpotifyMetadata, CACHE_FILENAME
+
+BROKEN_SUFFIX = '.broken'
+
+
+def find_audio_files(root):
+    for dirpath, dirnames, filenames in os.walk(root):
+        # Archived tracks are no longer part of any playlist
+        dirnames[:] = [d for d in dirnames if d != 'Archive']
+        for filename in filenames:
+            if filename.lower().endswith(AUDIO_EXTENSIONS):
+                yield os.path.join(dirpath, filename)
+
+def expected_durations(root, paths_to_ids):
+    # Spotify durations from the local metadata cache only; verifying never calls the API
+    cache_path = os.path.join(root, CACHE_FILENAME)
+    if not os.path.exists(cache_path):
+        return {}
+    metadata = SpotifyMetadata(None, cache_path, ttl=None)
+    try:
+        tracks = metadata.cached('track', list(set(paths_to_ids.values())))
+    finally:
+        metadata.close()
+    return {track_id: track.get('duration_ms') for track_id, track in tracks.items()}
+
+def requeue(manifest, path):
+    # Sync re-downloads anything the manifest doesn't know about; the bad file is kept aside for inspection
+    manifest.remove(path)
+    os.replace(path, path + BROKEN_SUFFIX)
+
+def write_report(path, reports):
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['Path', 'Problems', 'Duration', 'Expected Duration', 'Bitrate (kbps)', 'Frames'])
+        for report in reports:
+            writer.writerow([
+                report['path'], ' '.join(report['problems']),
+                round(report['duration'], 2), report.get('expected_duration', ''),
+                report['bitrate_kbps'], report['frames'],
+            ])
+
+def verify_library(root, workers=None, requeue_broken=True, strict_duration=False, report_path=None):
+    manifest = LibraryManifest.for_library(root)
+    try:
+        paths_to_ids = {entry['path']: entry['track_id'] for entry in manifest.entries()}
+        durations = expected_durations(root, paths_to_ids)
+
+        paths = list(find_audio_files(root))
+        total_bytes = sum(os.path.getsize(path) for path in paths)
+        print(f"🔎 Verifying {len(paths)} files ({total_bytes / 1e6:.1f} MB) with {workers} workers")
+
+        started = time.perf_counter()
+        reports = []
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                executor.submit(check_file, path, durations.get(paths_to_ids.get(os.path.abspath(path))))
+                for path in paths
+            ]
+            for future in tqdm(as_completed(futures), total=len(futures), desc="Verifying", unit="file"):
+                reports.append(future.result())
+        elapsed = time.perf_counter() - started
+
+        problems = Counter()
+        broken = []
+        for report in reports:
+            problems.update(report['problems'])
+            if is_broken(report) or (strict_duration and 'duration_mismatch' in report['problems']):
+                broken.append(report)
+
+        requeued = untracked = 0
+        for report in broken:
+            # Only files the manifest knows are re-downloaded; anything else (e.g. the user's own MP3s) stays put
+            tracked = os.path.abspath(report['path']) in paths_to_ids
+            print(f"❌ {report['path']}: {', '.join(report['problems'])}{'' if tracked else ' (untracked, left in place)'}")
+            if not tracked:
+                untracked += 1
+            elif requeue_broken:
+                requeue(manifest, report['path'])
+                requeued += 1
+
+        print(f"\n⏱️ Checked {len(reports)} files in {elapsed:.1f}s ({total_bytes / 1e6 / max(elapsed, 1e-9):.0f} MB/s)")
+        if problems:
+            print("📋 Problems found: " + ", ".join(f"{name} ×{count}" for name, count in problems.most_common()))
+        if requeued:
+            print(f"🔁 {requeued} broken tracks queued for re-download; run the downloader with --sync")
+        if untracked:
+            print(f"⚠️ {untracked} broken files have no Spotify track id, so nothing can re-download them; "
+                  f"they were left as they are")
+        if not broken:
+            print("✅ No broken tracks found")
+
+        if report_path:
+            write_report(report_path, sorted(reports, key=lambda r: r['path']))
+            print(f"📝 Report written to {report_path}")
+        return broken
+    finally:
+        manifest.close()
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Check every track in the library for truncated or corrupt audio.")
+    parser.add_argument('root', nargs='?', default=os.path.join(os.getcwd(), "Downloaded_Music"),
+                        help="library folder (default: ./Downloaded_Music)")
+    parser.add_argument('-w', '--workers', type=int, default=multiprocessing.cpu_count(),
+                        help="worker processes (default: CPU count)")
+    parser.add_argument('--dry-run', action='store_true',
+                        help="only report problems; don't queue broken tracks for re-download")
+    parser.add_argument('--strict-duration', action='store_true',
+                        help="also treat tracks whose length differs from Spotify's as broken")
+    parser.add_argument('--report', metavar='CSV', help="write a per-file report to this CSV")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    verify_library(
+        args.root,
+        workers=args.workers,
+        requeue_broken=not args.dry_run,
+        strict_duration=args.strict_duration,
+        report_path=args.report,
+    )